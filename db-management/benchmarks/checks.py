@@ -0,0 +1,260 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).parent.parent / "scripts"))
+import argparse
+import contextlib
+import io
+import re
+import tempfile
+import traceback
+import fake_drivers
+from run_benchmarks import fleet, write_config
+from utils.engines import ENGINES
+from utils.options import SyncOptions
+
+# Behaviour checks against the in-process fake drivers, for the cases the benchmark scenarios do not
+# reach (a daemon's second sync, unusual names). Each check sets up its own fake server and config
+# directory and fails with an AssertionError. Exits non-zero when any check fails, so it can gate CI.
+
+CHECKS = []
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+@check
+def daemon_clickhouse_ddl_starts_from_zero():
+    # A handler kept open between daemon syncs must only wait for the DDL of the current sync
+    from utils.daemon import SyncDaemon
+    for use_async in (False, True):
+        server = fake_drivers.install("clickhouse", use_async=use_async)
+        with tempfile.TemporaryDirectory() as tmp:
+            daemon = SyncDaemon(tmp, ["clickhouse"], False, SyncOptions(use_async=use_async))
+            try:
+                for round_ in range(3):
+                    users = fleet(3, offset=3 * round_)
+                    write_config(Path(tmp), "clickhouse", users)
+                    queued = len(server.ddl_log)
+                    out = run_quietly(daemon.sync, None)
+                    submitted = len(server.ddl_log) - queued
+                    result = daemon.results[("clickhouse", "bench:9000")]
+                    assert result.ok, f"sync {round_ + 1} reported errors:\n{out}"
+                    handler = daemon.handlers[("clickhouse", "bench:9000")]._handler
+                    assert not handler._ddl_submitted and handler._ddl_run is None, \
+                        f"sync {round_ + 1} left DDL tracking behind ({len(handler._ddl_submitted)} entries)"
+                    waited = [int(n) for n in re.findall(r"Distributed DDL: (\d+) entries", out)]
+                    assert waited == [submitted], \
+                        f"sync {round_ + 1} submitted {submitted} DDL statement(s) but waited for {waited} queue entries"
+            finally:
+                daemon.close()
+
+@check
+def clickhouse_failed_async_ddl_is_retried():
+    # A statement that is queued but fails on the cluster must fail its user: no password hash is
+    # recorded and the next --incremental run reconciles the user again. DDL of other clients on the
+    # same cluster is not waited for.
+    from clickhouse_sync import run
+    from utils.password_state import PasswordState
+    for use_async in (False, True):
+        server = fake_drivers.install("clickhouse", use_async=use_async)
+        server.ddl_log.append(["CREATE USER IF NOT EXISTS `other` ON CLUSTER `bench_cluster`", {}, None])
+        server.failing_ddl = "CREATE USER IF NOT EXISTS `user000001`"
+        options = SyncOptions(use_async=use_async, incremental=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            users = fleet(3)
+            write_config(Path(tmp), "clickhouse", users)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                result = run(tmp, False, options)
+            assert result.failed_users == {"user000001"}, f"failed users {result.failed_users}:\n{out.getvalue()}"
+            assert "Distributed DDL: 15 entries" in out.getvalue(), out.getvalue()
+            state = PasswordState.open(tmp, "clickhouse", {"host": "bench", "port": 9000})
+            assert not state.matches("user000001", users["user000001"]), "hash recorded for a failed CREATE USER"
+            assert state.matches("user000000", users["user000000"]), "hash missing for a confirmed CREATE USER"
+            server.failing_ddl = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(tmp, False, options)
+            assert result.ok and result.added + result.updated == 1, "the next incremental run skipped the failed user"
+            assert "user000001" in server.users, "the failed user was not created"
+
+@check
+def account_dropped_outside_is_recreated():
+    # A user whose account was dropped by someone else while their databases were kept gets the
+    # account back (with the password from users.txt), not a GRANT to a user that does not exist
+    import importlib
+    for engine in ENGINES:
+        for use_async in (False, True):
+            server = fake_drivers.install(engine, use_async=use_async)
+            run = importlib.import_module(f"{engine}_sync").run
+            options = SyncOptions(use_async=use_async)
+            with tempfile.TemporaryDirectory() as tmp:
+                write_config(Path(tmp), engine, fleet(2))
+                run_quietly(run, tmp, False, options)
+                with server.lock:
+                    server.drop_user("user000001")
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    result = run(tmp, False, options)
+                mode = "async" if use_async else "sync"
+                assert result.ok, f"{engine} ({mode}): the run after the drop failed:\n{out.getvalue()}"
+                assert "user000001" in server.users, f"{engine} ({mode}): the account was not recreated"
+                assert len(server.grants.get("user000001", ())) == 3, f"{engine} ({mode}): grants missing"
+
+@check
+def managed_index_prefix_collisions():
+    # Template `app` is a prefix of template `app_x` and user `dev_ops` contains the separator. Every
+    # database must be attributed to the right user, and databases that only look similar (no
+    # `<managed user>_` prefix) are never classed as managed, granted or dropped.
+    import importlib
+    from utils.common import build_managed_index
+    from utils.engines import template_file
+    templates = ["app", "app_x"]
+    foreign = {"app_x_reports", "devops_app_xy", "shared_app_xyz", "appx_dev"}
+    index = build_managed_index(["dev_app", "dev_app_x", "dev_ops_app", "dev_ops_app_x", "dev_ops_old",
+                                 *sorted(foreign)], templates, ["dev", "dev_ops"])
+    assert index == {"dev": {"app": "dev_app", "app_x": "dev_app_x"},
+                     "dev_ops": {"app": "dev_ops_app", "app_x": "dev_ops_app_x", "old": "dev_ops_old"}}, \
+        f"index {index}"
+    for engine in ENGINES:
+        server = fake_drivers.install(engine)
+        run = importlib.import_module(f"{engine}_sync").run
+        with tempfile.TemporaryDirectory() as tmp:
+            config_dir = Path(tmp)
+            with server.lock:
+                server.databases.update(foreign)
+            for users, expected in (({"dev": "Passw0rd1", "dev_ops": "Passw0rd2"}, {"dev", "dev_ops"}),
+                                    ({"dev_ops": "Passw0rd2"}, {"dev_ops"})):
+                write_config(config_dir, engine, users)
+                (config_dir / template_file(engine)).write_text("\n".join(templates) + "\n", encoding="utf-8")
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    result = run(tmp, False, SyncOptions())
+                    again = run(tmp, False, SyncOptions())
+                assert result.ok and again.ok, f"{engine}: sync failed:\n{out.getvalue()}"
+                assert again.operations == 0, f"{engine}: {again.operations} operation(s) left after converging"
+                managed = {f"{u}_{t}" for u in expected for t in templates}
+                assert server.databases == managed | foreign, \
+                    f"{engine}: databases {sorted(server.databases)}, expected {sorted(managed | foreign)}"
+                granted = {db for dbs in server.grants.values() for db in dbs}
+                assert not granted & foreign, f"{engine}: foreign database(s) granted: {sorted(granted & foreign)}"
+
+@check
+def targets_on_one_server_are_rejected():
+    # Two targets of an engine on the same host and port would share one password state and journal
+    from utils.targets import engine_targets
+    section = {"port": 5432, "targets": [{"name": "web", "host": "pg-1", "templates": ["web"]},
+                                         {"name": "tools", "host": "pg-1", "templates": ["tools"]}]}
+    try:
+        engine_targets(section)
+    except ValueError as e:
+        assert "'web' and 'tools'" in str(e), str(e)
+    else:
+        raise AssertionError("two targets on pg-1:5432 were accepted")
+    section["targets"][1]["host"] = "pg-2"
+    assert [cfg["name"] for cfg in engine_targets(section)] == ["web", "tools"]
+
+@check
+def postgresql_failed_drop_reopens_database():
+    # Offboarding closes a batch of databases before dropping them: a database that is not dropped after
+    # all (its drop fails, or the batched CLOSE fails part-way) must accept connections again
+    import asyncio
+    from postgresql_sync import run
+    from run_benchmarks import CONNECTIONS
+    from utils.engines import create_handler
+    for use_async in (False, True):
+        mode = "async" if use_async else "sync"
+        server = fake_drivers.install("postgresql", use_async=use_async)
+        options = SyncOptions(use_async=use_async)
+        with tempfile.TemporaryDirectory() as tmp:
+            users = fleet(3)
+            write_config(Path(tmp), "postgresql", users)
+            run_quietly(run, tmp, False, options)
+            del users["user000001"]
+            write_config(Path(tmp), "postgresql", users)
+            server.failing_ddl = 'DROP DATABASE IF EXISTS "user000001_web"'
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                result = run(tmp, False, options)
+            assert not result.ok, f"{mode}: the failed drop was not reported:\n{out.getvalue()}"
+            left = {db for db in server.databases if db.startswith("user000001_")}
+            assert left == {"user000001_web"}, f"{mode}: databases left {sorted(left)}"
+            assert not server.closed, f"{mode}: {sorted(server.closed)} still refuse connections"
+
+            names = ["user000000_analytics", "user000000_tools", "user000000_web"]
+            server.failing_ddl = 'ALTER DATABASE "user000000_tools" WITH ALLOW_CONNECTIONS false'
+            handler = create_handler("postgresql", CONNECTIONS["postgresql"], use_async=use_async)
+            try:
+                if use_async:
+                    run_quietly(asyncio.run, handler.drop_databases([(n,) for n in names]))
+                else:
+                    run_quietly(handler.drop_databases, [(n,) for n in names])
+            except Exception:
+                pass
+            else:
+                raise AssertionError(f"{mode}: the failed CLOSE was not raised")
+            finally:
+                if use_async:
+                    asyncio.run(handler.close())
+                else:
+                    handler.close()
+            assert set(names) <= server.databases, f"{mode}: a database was dropped after the failed CLOSE"
+            assert not server.closed, f"{mode}: {sorted(server.closed)} still refuse connections after the failed CLOSE"
+
+@check
+def clickhouse_async_ddl_confirmations_are_journaled():
+    # With async DDL the operations are confirmed in finish(); a run interrupted right after that must
+    # leave them in its journal, so --resume has nothing left to replay
+    from clickhouse_sync import run
+    from utils import async_reconcile, reconcile
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupt(*args):
+        raise Interrupted()
+
+    for use_async in (False, True):
+        mode = "async" if use_async else "sync"
+        module = async_reconcile if use_async else reconcile
+        fake_drivers.install("clickhouse", use_async=use_async)
+        with tempfile.TemporaryDirectory() as tmp:
+            write_config(Path(tmp), "clickhouse", fleet(3))
+            settle_state, module.settle_state = module.settle_state, interrupt
+            try:
+                run_quietly(run, tmp, False, SyncOptions(use_async=use_async))
+            except Interrupted:
+                pass
+            else:
+                raise AssertionError(f"{mode}: the run was not interrupted")
+            finally:
+                module.settle_state = settle_state
+            out = run_quietly(run, tmp, False, SyncOptions(use_async=use_async, resume=True))
+            assert "21 operation(s) already confirmed, 0 left" in out, f"{mode}: resume replayed work:\n{out}"
+
+def run_quietly(fn, *args):
+    # Runs fn with its output captured and returns the output
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        fn(*args)
+    return out.getvalue()
+
+def main():
+    ap = argparse.ArgumentParser(description="Check sync behaviour against in-process fake databases")
+    ap.add_argument("names", nargs="*", help="Checks to run (default: all)")
+    args = ap.parse_args()
+    selected = [fn for fn in CHECKS if not args.names or fn.__name__ in args.names]
+    failed = 0
+    for fn in selected:
+        try:
+            fn()
+        except Exception:
+            failed += 1
+            print(f"FAILED  {fn.__name__}")
+            print(traceback.format_exc())
+        else:
+            print(f"ok      {fn.__name__}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
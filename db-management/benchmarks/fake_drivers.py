@@ -0,0 +1,756 @@
+import asyncio
+import json
+import re
+import sys
+import threading
+import time
+import types
+
+# In-process stand-ins for pymysql, psycopg2, clickhouse_driver and pymongo.
+# They understand exactly the statements the handlers send, keep server state in memory
+# and charge a configurable latency per round-trip and per new connection.
+
+class FakeServer:
+    def __init__(self, engine: str, rtt: float = 0.0, connect_cost: float = 0.0):
+        self.engine = engine
+        self.rtt = rtt
+        self.connect_cost = connect_cost
+        self.lock = threading.Lock()
+        self.users = set()
+        self.databases = set()
+        self.grants = {}
+        self.grantees = {}
+        self.owners = {}
+        self.public_access = set()
+        self.templates = set()
+        # PostgreSQL databases closed to new sessions (ALLOW_CONNECTIONS false)
+        self.closed = set()
+        self.collections = {}
+        self.roles = {}
+        # [statement, settings, (exception code, text) or None] of every ON CLUSTER statement, in queue order
+        self.ddl_log = []
+        # ClickHouse and PostgreSQL statements containing this text fail (ClickHouse on the hosts, when
+        # queued asynchronously; PostgreSQL with a permission error)
+        self.failing_ddl = None
+        # server_version_num reported by the PostgreSQL fakes (below 130000 there is no DROP ... WITH (FORCE))
+        self.pg_version = 160000
+        # The asyncio fakes wait with asyncio.sleep() instead, so they turn this off
+        self.blocking = True
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.connections = 0
+        self.statements = 0
+
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+        if self.connect_cost and self.blocking:
+            time.sleep(self.connect_cost)
+
+    def round_trip(self, statements: int = 1):
+        with self.lock:
+            self.round_trips += 1
+            self.statements += statements
+        if self.rtt and self.blocking:
+            time.sleep(self.rtt)
+
+    def drop_database(self, name: str):
+        self.databases.discard(name)
+        self.owners.pop(name, None)
+        self.public_access.discard(name)
+        self.closed.discard(name)
+        self.collections.pop(name, None)
+        for user in self.grantees.pop(name, ()):
+            self.grants[user].discard(name)
+
+    def drop_user(self, name: str):
+        self.users.discard(name)
+        self.set_grants(name, ())
+        self.grants.pop(name, None)
+        self.roles.pop(name, None)
+
+    def grant(self, user: str, db: str):
+        self.grants.setdefault(user, set()).add(db)
+        self.grantees.setdefault(db, set()).add(user)
+
+    def set_grants(self, user: str, dbs):
+        for db in self.grants.get(user, ()):
+            self.grantees[db].discard(user)
+        self.grants[user] = set()
+        for db in dbs:
+            self.grant(user, db)
+
+    def stats(self) -> dict:
+        return {"round_trips": self.round_trips, "connections": self.connections, "statements": self.statements}
+
+def _unquote(name: str, quote: str) -> str:
+    return name[1:-1].replace(quote * 2, quote)
+
+# ---------------------------------------------------------------- pymysql
+
+MYSQL_IDENT = r"`(?:[^`]|``)*`"
+
+def _make_pymysql(server: FakeServer):
+    mod = types.ModuleType("pymysql")
+    constants = types.ModuleType("pymysql.constants")
+    constants.CLIENT = types.SimpleNamespace(MULTI_STATEMENTS=1 << 16)
+    mod.constants = constants
+    err = types.ModuleType("pymysql.err")
+
+    class OperationalError(Exception):
+        pass
+
+    err.OperationalError = OperationalError
+    mod.err = err
+    mod.OperationalError = OperationalError
+
+    class Cursor:
+        def __init__(self, conn):
+            self.conn = conn
+            self.rows = []
+            self.description = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql, args=None):
+            if args is not None:
+                sql = sql % tuple(self.conn.escape(a) for a in args)
+            statements = [s for s in sql.split(";\n") if s.strip()]
+            server.round_trip(len(statements))
+            with server.lock:
+                for stmt in statements:
+                    self._run(stmt.strip())
+            return len(self.rows)
+
+        def _run(self, sql):
+            self.description = None
+            self.rows = []
+            names = [_unquote(n, "`") for n in re.findall(MYSQL_IDENT, sql)]
+            if sql.startswith("SELECT User FROM mysql.user"):
+                self.rows = [(u,) for u in sorted(server.users)]
+            elif sql.startswith("SHOW DATABASES"):
+                self.rows = [(d,) for d in sorted(server.databases)]
+            elif sql.startswith("SELECT * FROM mysql.db"):
+                self.description = [("Host",), ("Db",), ("User",), ("Select_priv",), ("Insert_priv",), ("Grant_priv",)]
+                self.rows = [("%", d, u, "Y", "Y", "N") for u, dbs in server.grants.items() for d in sorted(dbs)]
+            elif sql.startswith("CREATE USER"):
+                server.users.update(names)
+            elif sql.startswith("DROP USER"):
+                for n in names:
+                    server.drop_user(n)
+            elif sql.startswith("CREATE DATABASE"):
+                server.databases.add(names[0])
+            elif sql.startswith("DROP DATABASE"):
+                server.drop_database(names[0])
+            elif sql.startswith("GRANT"):
+                if names[1] not in server.users:
+                    raise OperationalError(1410, "You are not allowed to create a user with GRANT")
+                server.grant(names[1], names[0])
+
+        def fetchall(self):
+            return list(self.rows)
+
+        def fetchone(self):
+            return self.rows[0] if self.rows else None
+
+        def nextset(self):
+            return None
+
+    class Connection:
+        def __init__(self, **kwargs):
+            server.connect()
+            self.open = True
+
+        def cursor(self):
+            return Cursor(self)
+
+        def escape(self, value):
+            if isinstance(value, str):
+                return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+            return str(value)
+
+        def close(self):
+            self.open = False
+
+    mod.connect = lambda **kwargs: Connection(**kwargs)
+    mod.Connection = Connection
+    return {"pymysql": mod, "pymysql.constants": constants, "pymysql.err": err}
+
+# ---------------------------------------------------------------- psycopg2
+
+PG_IDENT = r'"(?:[^"]|"")*"'
+
+def _make_psycopg2(server: FakeServer):
+    mod = types.ModuleType("psycopg2")
+    errors = types.ModuleType("psycopg2.errors")
+
+    class Error(Exception):
+        pass
+
+    class DuplicateObject(Error):
+        pass
+
+    class DuplicateDatabase(Error):
+        pass
+
+    class ObjectInUse(Error):
+        pass
+
+    class OperationalError(Error):
+        pass
+
+    class UndefinedObject(Error):
+        pgcode = "42704"
+
+    class InsufficientPrivilege(Error):
+        pgcode = "42501"
+
+    errors.DuplicateObject = DuplicateObject
+    errors.UndefinedObject = UndefinedObject
+    errors.DuplicateDatabase = DuplicateDatabase
+    errors.ObjectInUse = ObjectInUse
+    errors.InsufficientPrivilege = InsufficientPrivilege
+    mod.errors = errors
+    mod.Error = Error
+    mod.OperationalError = OperationalError
+
+    class Cursor:
+        def __init__(self, conn):
+            self.conn = conn
+            self.rows = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql, args=None):
+            # Several statements in one string go out in one round-trip, as with the real driver
+            statements = [" ".join(s.split()) for s in re.split(r";\s*", sql) if s.strip()]
+            server.round_trip(len(statements))
+            args = list(args or ())
+            self.rows = []
+            with server.lock:
+                for stmt in statements:
+                    count = stmt.count("%s")
+                    self._run(stmt, args[:count])
+                    del args[:count]
+
+        def _run(self, sql, args):
+            names = [_unquote(n, '"') for n in re.findall(PG_IDENT, sql)]
+            if server.failing_ddl and server.failing_ddl in sql:
+                raise InsufficientPrivilege(f"permission denied: {sql}")
+            if sql.startswith("SELECT rolname FROM pg_roles"):
+                self.rows = [(u,) for u in sorted(server.users)]
+            elif "aclexplode" in sql:
+                for d in sorted(server.databases):
+                    owner = server.owners.get(d)
+                    if d in server.public_access:
+                        self.rows.append((d, owner, True, None, None, 0))
+                        continue
+                    grantees = sorted(server.grantees.get(d, ()))
+                    for u in grantees:
+                        self.rows.append((d, owner, False, 1, u, 3))
+                    if not grantees:
+                        self.rows.append((d, owner, False, None, None, 0))
+            elif sql.startswith("SELECT datname FROM pg_database"):
+                wanted = set(args[0]) if " ANY(" in sql else server.databases
+                self.rows = [(d,) for d in sorted(server.databases & wanted)]
+            elif sql.startswith("SELECT 1 FROM pg_database"):
+                self.rows = [(1,)] if args and args[0] in server.databases | server.templates else []
+            elif sql.startswith("CREATE ROLE"):
+                if names[0] in server.users:
+                    raise DuplicateObject(f'role "{names[0]}" already exists')
+                server.users.add(names[0])
+            elif sql.startswith("DROP ROLE"):
+                server.drop_user(names[0])
+            elif sql.startswith("CREATE DATABASE"):
+                if names[0] in server.databases:
+                    raise DuplicateDatabase(f'database "{names[0]}" already exists')
+                server.databases.add(names[0])
+                server.owners[names[0]] = names[1] if len(names) > 1 and " OWNER " in sql else "postgres"
+                server.public_access.add(names[0])
+            elif sql.startswith("DROP DATABASE"):
+                server.drop_database(names[0])
+            elif sql.startswith("ALTER DATABASE") and " OWNER TO " in sql:
+                self._role(names[1])
+                server.owners[names[0]] = names[1]
+            elif sql.startswith("ALTER DATABASE") and "ALLOW_CONNECTIONS" in sql:
+                if names[0] not in server.databases:
+                    raise Error(f'database "{names[0]}" does not exist')
+                if sql.endswith("false"):
+                    server.closed.add(names[0])
+                else:
+                    server.closed.discard(names[0])
+            elif sql.startswith("ALTER DATABASE") and "IS_TEMPLATE true" in sql:
+                server.drop_database(names[0])
+                server.templates.add(names[0])
+            elif sql.startswith("REVOKE ALL PRIVILEGES ON DATABASE"):
+                server.public_access.discard(names[0])
+            elif sql.startswith("GRANT ALL PRIVILEGES ON DATABASE"):
+                self._role(names[1])
+                server.grant(names[1], names[0])
+
+        def _role(self, name):
+            if name not in server.users:
+                raise UndefinedObject(f'role "{name}" does not exist')
+
+        def fetchall(self):
+            return list(self.rows)
+
+        def fetchone(self):
+            return self.rows[0] if self.rows else None
+
+    class Connection:
+        def __init__(self, **kwargs):
+            server.connect()
+            self.dbname = kwargs.get("dbname")
+            self.autocommit = False
+            self.closed = 0
+            self.server_version = server.pg_version
+
+        def cursor(self):
+            return Cursor(self)
+
+        def close(self):
+            self.closed = 1
+
+    mod.connect = lambda **kwargs: Connection(**kwargs)
+    return {"psycopg2": mod, "psycopg2.errors": errors}
+
+# ---------------------------------------------------------------- clickhouse_driver
+
+CH_IDENT = r"`(?:[^`]|``)*`"
+
+def _make_clickhouse_driver(server: FakeServer):
+    mod = types.ModuleType("clickhouse_driver")
+    errors = types.ModuleType("clickhouse_driver.errors")
+
+    class ServerException(Exception):
+        def __init__(self, message, code=None):
+            super().__init__(f"Code: {code}. DB::Exception: {message}")
+            self.code = code
+
+    errors.ServerException = ServerException
+    mod.errors = errors
+
+    class Client:
+        def __init__(self, **kwargs):
+            self.connected = False
+
+        def execute(self, sql, params=None, settings=None):
+            if not self.connected:
+                server.connect()
+                self.connected = True
+            server.round_trip()
+            with server.lock:
+                if sql.startswith("SELECT name FROM system.users"):
+                    return [(u,) for u in sorted(server.users)]
+                if sql.startswith("SELECT name FROM system.databases"):
+                    return [(d,) for d in sorted(server.databases)]
+                if "FROM system.grants" in sql:
+                    return [(u, d) for u, dbs in server.grants.items() for d in sorted(dbs)]
+                if "system.distributed_ddl_queue" in sql:
+                    return [ddl_queue_row(i, *entry) for i, entry in enumerate(server.ddl_log)
+                            if entry[1].get("log_comment", "").startswith((params or {}).get("run", ""))]
+                if "ON CLUSTER " not in sql:
+                    self._apply(sql)
+                    return []
+                # Queued; with distributed_ddl_task_timeout = 0 a failure only shows in the queue
+                entry = [sql, dict(settings or {}), None]
+                server.ddl_log.append(entry)
+                try:
+                    self._apply(sql)
+                except ServerException as e:
+                    if str(entry[1].get("distributed_ddl_task_timeout")) != "0":
+                        raise
+                    entry[2] = (e.code, str(e))
+            return []
+
+        def _apply(self, sql):
+            names = [_unquote(n, "`") for n in re.findall(CH_IDENT, sql)]
+            names = [n for n in names if n not in _cluster_names(sql)]
+            if server.failing_ddl and server.failing_ddl in sql:
+                raise ServerException("Authentication failed", 516)
+            if sql.startswith("CREATE USER"):
+                server.users.add(names[0])
+            elif sql.startswith("DROP USER"):
+                server.drop_user(names[0])
+            elif sql.startswith("CREATE DATABASE"):
+                server.databases.add(names[0])
+            elif sql.startswith("DROP DATABASE"):
+                server.drop_database(names[0])
+            elif sql.startswith("ALTER USER"):
+                if names[0] not in server.users:
+                    raise ServerException(f"There is no user `{names[0]}` in user directories", 192)
+            elif sql.startswith("GRANT"):
+                if names[-1] not in server.users:
+                    raise ServerException(f"There is no user `{names[-1]}` in user directories", 192)
+                for db in names[:-1]:
+                    server.grant(names[-1], db)
+
+        def disconnect(self):
+            self.connected = False
+
+    mod.Client = Client
+    return {"clickhouse_driver": mod, "clickhouse_driver.errors": errors}
+
+def ddl_queue_row(i: int, sql: str, settings: dict, error) -> tuple:
+    # entry, host, port, status, exception_code, exception_text, settings['log_comment']
+    code, text = error or (0, "")
+    return (f"query-{i:010d}", "localhost", 9000, "Finished", code, text, settings.get("log_comment", ""))
+
+def _cluster_names(sql: str) -> set:
+    return {_unquote(n, "`") for n in re.findall(r"ON CLUSTER (" + CH_IDENT + ")", sql)}
+
+# ---------------------------------------------------------------- pymongo
+
+def _make_pymongo(server: FakeServer):
+    mod = types.ModuleType("pymongo")
+    errors = types.ModuleType("pymongo.errors")
+
+    class PyMongoError(Exception):
+        pass
+
+    class OperationFailure(PyMongoError):
+        def __init__(self, message, code=None):
+            super().__init__(message)
+            self.code = code
+
+    errors.PyMongoError = PyMongoError
+    errors.OperationFailure = OperationFailure
+    mod.errors = errors
+
+    class Database:
+        def __init__(self, name):
+            self.name = name
+
+        def command(self, name, value=None, **kwargs):
+            server.round_trip()
+            with server.lock:
+                if name == "usersInfo":
+                    names = sorted(server.users) if value in (None, 1) else [value]
+                    return {"users": [{"user": u, "roles": list(server.roles.get(u, []))} for u in names if u in server.users]}
+                if name == "createUser":
+                    if value in server.users:
+                        raise OperationFailure(f"User \"{value}\" already exists", 51003)
+                    server.users.add(value)
+                    server.roles[value] = list(kwargs.get("roles", []))
+                elif name == "updateUser":
+                    if "roles" in kwargs:
+                        server.roles[value] = list(kwargs["roles"])
+                elif name == "grantRolesToUser":
+                    if value not in server.users:
+                        raise OperationFailure(f"Could not find user \"{value}\" for db \"admin\"", 11)
+                    current = server.roles.setdefault(value, [])
+                    current.extend(r for r in kwargs.get("roles", []) if r not in current)
+                elif name == "dropUser":
+                    server.drop_user(value)
+                elif name == "create":
+                    self._create(value)
+                if value in server.roles:
+                    server.set_grants(value, [r["db"] for r in server.roles[value] if r.get("role") == "readWrite"])
+            return {"ok": 1}
+
+        def _create(self, collection):
+            existing = server.collections.setdefault(self.name, set())
+            if collection in existing:
+                raise OperationFailure(f"Collection {self.name}.{collection} already exists", 48)
+            existing.add(collection)
+            server.databases.add(self.name)
+
+        def create_collection(self, name, check_exists=True, **kwargs):
+            server.round_trip()
+            with server.lock:
+                self._create(name)
+
+        def list_collection_names(self):
+            server.round_trip()
+            return sorted(server.collections.get(self.name, ()))
+
+    class MongoClient:
+        def __init__(self, uri=None, **kwargs):
+            server.connect()
+
+        def __getitem__(self, name):
+            return Database(name)
+
+        def list_database_names(self):
+            server.round_trip()
+            return sorted(server.databases)
+
+        def drop_database(self, name):
+            server.round_trip()
+            with server.lock:
+                server.drop_database(name)
+
+        def close(self):
+            pass
+
+    mod.MongoClient = MongoClient
+    return {"pymongo": mod, "pymongo.errors": errors}
+
+# ---------------------------------------------------------------- asyncio drivers
+# Thin wrappers over the blocking fakes above: the statement handling and counters are shared,
+# the simulated latency is awaited so concurrent tasks overlap like they would on a real socket.
+
+def _make_aiomysql(server: FakeServer):
+    sync = _make_pymysql(server)
+    pymysql = sync["pymysql"]
+    mod = types.ModuleType("aiomysql")
+
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        @property
+        def description(self):
+            return self._cursor.description
+
+        async def execute(self, sql, args=None):
+            value = self._cursor.execute(sql, args)
+            await asyncio.sleep(server.rtt)
+            return value
+
+        async def fetchall(self):
+            return self._cursor.fetchall()
+
+        async def nextset(self):
+            return self._cursor.nextset()
+
+    class Connection:
+        def __init__(self, conn):
+            self._conn = conn
+
+        @property
+        def closed(self):
+            return not self._conn.open
+
+        def cursor(self):
+            return Cursor(self._conn.cursor())
+
+        def escape(self, value):
+            return self._conn.escape(value)
+
+        def close(self):
+            self._conn.close()
+
+    async def connect(**kwargs):
+        conn = pymysql.connect(**kwargs)
+        await asyncio.sleep(server.connect_cost)
+        return Connection(conn)
+
+    mod.connect = connect
+    return {"aiomysql": mod, **sync}
+
+def _make_asyncpg(server: FakeServer):
+    psycopg2 = _make_psycopg2(server)["psycopg2"]
+    mod = types.ModuleType("asyncpg")
+    exceptions = types.ModuleType("asyncpg.exceptions")
+
+    class PostgresError(Exception):
+        pass
+
+    class DuplicateObjectError(PostgresError):
+        pass
+
+    class DuplicateDatabaseError(PostgresError):
+        pass
+
+    class ObjectInUseError(PostgresError):
+        pass
+
+    class UndefinedObjectError(PostgresError):
+        sqlstate = "42704"
+
+    class InsufficientPrivilegeError(PostgresError):
+        sqlstate = "42501"
+
+    exceptions.PostgresError = PostgresError
+    exceptions.UndefinedObjectError = UndefinedObjectError
+    exceptions.DuplicateObjectError = DuplicateObjectError
+    exceptions.DuplicateDatabaseError = DuplicateDatabaseError
+    exceptions.ObjectInUseError = ObjectInUseError
+    exceptions.InsufficientPrivilegeError = InsufficientPrivilegeError
+    mod.exceptions = exceptions
+    translate = {psycopg2.errors.DuplicateObject: DuplicateObjectError,
+                 psycopg2.errors.DuplicateDatabase: DuplicateDatabaseError,
+                 psycopg2.errors.ObjectInUse: ObjectInUseError,
+                 psycopg2.errors.UndefinedObject: UndefinedObjectError,
+                 psycopg2.errors.InsufficientPrivilege: InsufficientPrivilegeError}
+
+    class Connection:
+        def __init__(self, conn):
+            self._conn = conn
+
+        async def _run(self, sql, args):
+            # Several statements in one simple-query message count as one round-trip
+            with self._conn.cursor() as cur:
+                try:
+                    cur.execute(re.sub(r"\$\d+", "%s", sql), args or None)
+                except tuple(translate) as e:
+                    raise translate[type(e)](str(e)) from None
+                rows = cur.fetchall()
+            await asyncio.sleep(server.rtt)
+            return rows
+
+        async def execute(self, sql, *args):
+            await self._run(sql, args)
+            return "OK"
+
+        async def fetch(self, sql, *args):
+            return await self._run(sql, args)
+
+        async def fetchval(self, sql, *args):
+            rows = await self._run(sql, args)
+            return rows[0][0] if rows else None
+
+        def is_closed(self):
+            return bool(self._conn.closed)
+
+        def get_server_version(self):
+            return types.SimpleNamespace(major=server.pg_version // 10000)
+
+        async def close(self):
+            self._conn.close()
+
+    async def connect(**kwargs):
+        conn = psycopg2.connect(dbname=kwargs.get("database"))
+        conn.autocommit = True
+        await asyncio.sleep(server.connect_cost)
+        return Connection(conn)
+
+    mod.connect = connect
+    return {"asyncpg": mod, "asyncpg.exceptions": exceptions}
+
+def _make_aiohttp(server: FakeServer):
+    Client = _make_clickhouse_driver(server)["clickhouse_driver"].Client
+    mod = types.ModuleType("aiohttp")
+
+    class Response:
+        def __init__(self, status, text):
+            self.status = status
+            self._text = text
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def text(self):
+            return self._text
+
+    class ClientSession:
+        # Keep-alive HTTP: the first request pays the connection cost, later ones reuse the socket
+        def __init__(self, headers=None):
+            self._client = Client()
+
+        def post(self, url, params=None, data=b""):
+            return _Request(self, data.decode("utf-8"), params or {})
+
+        async def close(self):
+            self._client.disconnect()
+
+    class _Request:
+        def __init__(self, session, sql, query):
+            self.session = session
+            self.sql = sql.replace(" FORMAT JSONCompact", "")
+            # URL parameters: param_<name> are query parameters, everything else is a setting
+            self.params = {k[len("param_"):]: v for k, v in query.items() if k.startswith("param_")}
+            self.settings = {k: v for k, v in query.items() if not k.startswith("param_")}
+
+        async def __aenter__(self):
+            connecting = not self.session._client.connected
+            try:
+                rows = self.session._client.execute(self.sql, self.params, self.settings)
+                response = Response(200, json.dumps({"data": [list(r) for r in rows]}))
+            except Exception as e:
+                response = Response(500, str(e))
+            await asyncio.sleep(server.rtt + (server.connect_cost if connecting else 0))
+            return response
+
+        async def __aexit__(self, *exc):
+            return False
+
+    mod.ClientSession = ClientSession
+    return {"aiohttp": mod}
+
+def _make_motor(server: FakeServer):
+    MongoClient = _make_pymongo(server)["pymongo"].MongoClient
+    mod = types.ModuleType("motor")
+    motor_asyncio = types.ModuleType("motor.motor_asyncio")
+
+    class Database:
+        def __init__(self, db):
+            self._db = db
+
+        async def command(self, name, value=None, **kwargs):
+            result = self._db.command(name, value, **kwargs)
+            await asyncio.sleep(server.rtt)
+            return result
+
+        async def create_collection(self, name, **kwargs):
+            try:
+                return self._db.create_collection(name, **kwargs)
+            finally:
+                await asyncio.sleep(server.rtt)
+
+    class AsyncIOMotorClient:
+        def __init__(self, uri=None, **kwargs):
+            self._client = MongoClient(uri)
+
+        def __getitem__(self, name):
+            return Database(self._client[name])
+
+        async def list_database_names(self):
+            names = self._client.list_database_names()
+            await asyncio.sleep(server.rtt)
+            return names
+
+        async def drop_database(self, name):
+            self._client.drop_database(name)
+            await asyncio.sleep(server.rtt)
+
+        def close(self):
+            self._client.close()
+
+    motor_asyncio.AsyncIOMotorClient = AsyncIOMotorClient
+    mod.motor_asyncio = motor_asyncio
+    return {"motor": mod, "motor.motor_asyncio": motor_asyncio}
+
+DRIVERS = {
+    "mysql": _make_pymysql,
+    "postgresql": _make_psycopg2,
+    "clickhouse": _make_clickhouse_driver,
+    "mongodb": _make_pymongo,
+}
+
+ASYNC_DRIVERS = {
+    "mysql": _make_aiomysql,
+    "postgresql": _make_asyncpg,
+    "clickhouse": _make_aiohttp,
+    "mongodb": _make_motor,
+}
+
+def install(engine: str, rtt: float = 0.0, connect_cost: float = 0.0, use_async: bool = False) -> FakeServer:
+    # Replaces the real driver in sys.modules, so both `import pymysql` and
+    # importlib.import_module("psycopg2") inside the handlers pick up the fake
+    server = FakeServer(engine, rtt, connect_cost)
+    server.blocking = not use_async
+    for name, module in (ASYNC_DRIVERS if use_async else DRIVERS)[engine](server).items():
+        sys.modules[name] = module
+    return server
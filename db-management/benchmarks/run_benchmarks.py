@@ -0,0 +1,122 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).parent.parent / "scripts"))
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import tempfile
+import time
+import fake_drivers
+from utils.engines import ENGINES, template_file
+from utils.options import SyncOptions, DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY
+
+# Drives the real <engine>_sync.run() against the in-process fake drivers.
+# Each fleet size runs three scenarios on the same fake server:
+#   initial   - empty server, every user and database is created
+#   noop      - unchanged config, nothing should be sent besides discovery
+#   churn     - 10% of the users removed, 10% added and 10% with a new password
+
+TEMPLATES = ["web", "analytics", "tools"]
+
+CONNECTIONS = {
+    "mysql": {"host": "bench", "port": 3306, "admin_username": "root", "admin_password": "x"},
+    "postgresql": {"host": "bench", "port": 5432, "admin_username": "postgres", "admin_password": "x"},
+    "clickhouse": {"host": "bench", "port": 9000, "admin_username": "default", "admin_password": "x",
+                   "cluster": "bench_cluster", "async_ddl": True},
+    "mongodb": {"host": "bench", "port": 27017, "admin_username": "admin", "admin_password": "x"},
+}
+
+def write_config(config_dir: Path, engine: str, users: dict):
+    (config_dir / "users.txt").write_text("".join(f"{u}:{users[u]}\n" for u in sorted(users)), encoding="utf-8")
+    (config_dir / template_file(engine)).write_text("\n".join(TEMPLATES) + "\n", encoding="utf-8")
+    (config_dir / "connections.yaml").write_text(json.dumps({engine: CONNECTIONS[engine]}), encoding="utf-8")
+
+def fleet(count: int, offset: int = 0) -> dict:
+    return {f"user{i:06d}": f"Passw0rd{i}" for i in range(offset, offset + count)}
+
+def churn(users: dict) -> dict:
+    result = {}
+    for i, username in enumerate(sorted(users)):
+        if i % 10 == 0:
+            continue
+        result[username] = users[username] + ("x1" if i % 10 == 1 else "")
+    result.update(fleet(max(1, len(users) // 10), offset=len(users)))
+    return result
+
+def run_scenario(module, server, config_dir: Path, options: SyncOptions) -> dict:
+    server.reset_counters()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = module.run(str(config_dir), False, options)
+    return {
+        "wall": time.perf_counter() - started,
+        "ops": result.operations,
+        "errors": result.errors + (1 if result.failure else 0),
+        **server.stats(),
+    }
+
+def bench_engine(engine: str, sizes: list, args) -> list:
+    options = SyncOptions(workers=args.workers, batch_size=args.batch_size,
+                          use_async=args.use_async, concurrency=args.concurrency, sorted_merge=args.sorted_merge,
+                          incremental=args.incremental)
+    module = importlib.import_module(f"{engine}_sync")
+    rows = []
+    for size in sizes:
+        server = fake_drivers.install(engine, args.rtt_ms / 1000.0, args.connect_ms / 1000.0, args.use_async)
+        with tempfile.TemporaryDirectory() as tmp:
+            config_dir = Path(tmp)
+            users = fleet(size)
+            scenarios = [("initial", users), ("noop", users), ("churn", churn(users))]
+            for name, desired in scenarios:
+                write_config(config_dir, engine, desired)
+                row = {"engine": engine, "users": size, "scenario": name}
+                row.update(run_scenario(module, server, config_dir, options))
+                rows.append(row)
+                print_row(row)
+    return rows
+
+def print_header():
+    print(f"{'Engine':<12}{'Users':>7}  {'Scenario':<9}{'Wall':>9}{'Ops':>8}{'Round-trips':>13}{'Conns':>7}{'Stmts':>8}{'Errors':>8}")
+
+def print_row(row: dict):
+    print(f"{row['engine']:<12}{row['users']:>7}  {row['scenario']:<9}{row['wall']:>8.2f}s{row['ops']:>8}"
+          f"{row['round_trips']:>13}{row['connections']:>7}{row['statements']:>8}{row['errors']:>8}", flush=True)
+
+def parse_list(value: str, choices=None) -> list:
+    items = [v.strip() for v in value.split(",") if v.strip()]
+    if choices is not None:
+        unknown = [v for v in items if v not in choices]
+        if unknown:
+            raise SystemExit(f"Unknown engine(s): {', '.join(unknown)}. Choose from: {', '.join(choices)}")
+    return items
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the sync scripts against in-process fake databases")
+    ap.add_argument("--engines", default=",".join(ENGINES), help="Comma-separated engines (default: all)")
+    ap.add_argument("--users", default="10,1000,10000", help="Comma-separated fleet sizes")
+    ap.add_argument("--rtt-ms", type=float, default=0.5, help="Simulated latency per round-trip")
+    ap.add_argument("--connect-ms", type=float, default=5.0, help="Simulated cost of opening a connection")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--async", dest="use_async", action="store_true", help="Benchmark the asyncio handlers")
+    ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    ap.add_argument("--sorted-merge", action="store_true", help="Stream users.txt through the sorted-merge planner")
+    ap.add_argument("--incremental", action="store_true", help="Reconcile only users changed since the previous scenario")
+    ap.add_argument("--json", help="Also write the results as JSON lines to this file")
+    args = ap.parse_args()
+    engines = parse_list(args.engines, ENGINES)
+    sizes = [int(s) for s in parse_list(args.users)]
+    print_header()
+    rows = []
+    for engine in engines:
+        rows.extend(bench_engine(engine, sizes, args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Cold-start cost of the sync entry points: each one is imported in a fresh interpreter under
+# `python -X importtime` and the cumulative import time of the entry module is compared to the budget.
+# Modules that only some runs need (PyYAML, drivers, asyncio, the daemon's HTTP server) must not be
+# imported at startup at all. Exits non-zero when either check fails, so it can gate a CI job.
+
+SCRIPTS = Path(__file__).parent.parent / "scripts"
+ENTRY_POINTS = ("db_sync", "mysql_sync", "postgresql_sync", "clickhouse_sync", "mongodb_sync")
+
+# Import time of one entry module (milliseconds, median of --runs) that the check allows
+STARTUP_BUDGET_MS = 80.0
+
+# Loaded on first use only
+DEFERRED = ("yaml", "asyncio", "http.server", "concurrent.futures", "inspect",
+            "pymysql", "psycopg2", "clickhouse_driver", "pymongo", "aiomysql", "asyncpg", "aiohttp", "motor",
+            "utils.daemon", "utils.async_reconcile")
+
+def measure(module: str) -> tuple:
+    # (import time of the module in ms, {module: self time in us}) from one fresh interpreter
+    code = f"import sys; sys.path.insert(0, {str(SCRIPTS)!r}); import {module}"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    own, total = {}, None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        own[name.strip()] = int(self_us)
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000.0
+    return total, own
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure the import cost of the sync entry points")
+    ap.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point (the median is reported)")
+    ap.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="Allowed import time per entry point")
+    ap.add_argument("--top", type=int, default=5, help="Show the N most expensive modules of each entry point")
+    ap.add_argument("--json", help="Also write the results as JSON lines to this file")
+    args = ap.parse_args()
+    print(f"{'Entry point':<18}{'Median':>9}{'Min':>9}{'Budget':>9}  Status")
+    rows, failed = [], False
+    for module in ENTRY_POINTS:
+        samples, own = [], {}
+        for _ in range(max(1, args.runs)):
+            total, own = measure(module)
+            samples.append(total)
+        median = statistics.median(samples)
+        loaded = [name for name in DEFERRED if name in own]
+        status = "ok"
+        if median > args.budget_ms:
+            status = "over budget"
+        if loaded:
+            status = f"imports {', '.join(loaded)} at startup"
+        failed |= status != "ok"
+        print(f"{module:<18}{median:>8.1f}ms{min(samples):>7.1f}ms{args.budget_ms:>7.0f}ms  {status}")
+        for name, us in sorted(own.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {us / 1000.0:>8.1f}ms  {name}")
+        rows.append({"entry_point": module, "median_ms": median, "min_ms": min(samples),
+                     "budget_ms": args.budget_ms, "deferred_imported": loaded})
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent))
+from utils.cli import db_sync_main, run_engines
+
+def run(config_dir: str, engines: list, dry_run: bool, options=None) -> list:
+    return run_engines(config_dir, engines, dry_run, options)
+
+if __name__ == "__main__":
+    db_sync_main()
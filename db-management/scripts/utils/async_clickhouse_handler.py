@@ -0,0 +1,178 @@
+import asyncio
+import importlib
+import json
+import secrets
+import time
+from .async_pool import AsyncConnectionPool
+from .clickhouse_handler import (ALTER_USER, ASYNC_DDL_SETTINGS, CREATE_DATABASE, CREATE_USER, DDL_QUEUE_COLUMNS,
+                                 DROP_DATABASE, DROP_USER, GRANT, GRANTS_SQL, ClickHouseHandler, ddl_queue_errors,
+                                 ddl_queue_settled, ddl_tag, grant_targets, on_cluster)
+from .snapshot import Snapshot
+
+class AsyncClickHouseHandler:
+    # ClickHouseHandler over the HTTP interface (aiohttp), with the same methods as coroutines.
+    # One aiohttp session multiplexes every request, so the pool runs in shared mode.
+    label = "CH"
+    batch_methods = ClickHouseHandler.batch_methods
+    round_trips = ClickHouseHandler.round_trips
+
+    def __init__(self, cfg: dict, dry_run: bool = False):
+        self.cfg = cfg
+        self.dry = dry_run
+        self.pool = AsyncConnectionPool(self._connect, close=lambda s: s.close(), shared=True)
+        self.async_ddl = bool(cfg.get("cluster")) and bool(cfg.get("async_ddl", False))
+        self._on_cluster = on_cluster(cfg)
+        # Nothing is awaited while these change, so the event loop needs no lock around them
+        self._ddl_submitted = {}
+        self._ddl_run = None
+        scheme = "https" if cfg.get("secure", False) else "http"
+        self._url = f"{scheme}://{cfg.get('host', 'localhost')}:{int(cfg.get('http_port', 8123))}/"
+
+    async def _connect(self, _key=None):
+        aiohttp = importlib.import_module("aiohttp")
+        return aiohttp.ClientSession(headers={
+            "X-ClickHouse-User": self.cfg.get("admin_username", ""),
+            "X-ClickHouse-Key": self.cfg.get("admin_password", ""),
+        })
+
+    async def close(self):
+        await self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
+    async def _execute(self, sql: str, params: dict = None, settings: dict = None) -> list:
+        # Query parameters use ClickHouse's {name:Type} placeholders and travel as param_<name>
+        query = {k: str(v) for k, v in (settings or {}).items()}
+        query.update({f"param_{k}": str(v) for k, v in (params or {}).items()})
+        select = sql.lstrip().upper().startswith("SELECT")
+        body = sql + " FORMAT JSONCompact" if select else sql
+        async with self.pool.connection() as session:
+            async with session.post(self._url, params=query, data=body.encode("utf-8")) as resp:
+                text = await resp.text()
+                if resp.status != 200:
+                    raise RuntimeError(text.strip())
+        return json.loads(text)["data"] if select else []
+
+    async def _execute_ddl(self, sql: str, key: tuple):
+        if not self.async_ddl:
+            return await self._execute(sql)
+        if self._ddl_run is None:
+            self._ddl_run = f"db-sync-{secrets.token_hex(8)}"
+        tag = ddl_tag(self._ddl_run)
+        self._ddl_submitted[tag] = key
+        try:
+            return await self._execute(sql, settings={**ASYNC_DDL_SETTINGS, "log_comment": tag})
+        except Exception:
+            self._ddl_submitted.pop(tag, None)
+            raise
+
+    async def finish(self) -> list:
+        submitted, run = dict(self._ddl_submitted), self._ddl_run
+        if self.dry or not submitted:
+            return []
+        started = time.monotonic()
+        deadline = started + float(self.cfg.get("ddl_timeout", 600))
+        while True:
+            rows = await self._execute(
+                f"SELECT {DDL_QUEUE_COLUMNS} FROM system.distributed_ddl_queue "
+                "WHERE cluster = {cluster:String} AND startsWith(settings['log_comment'], {run:String})",
+                {"cluster": self.cfg.get("cluster"), "run": run + ":"},
+            )
+            if ddl_queue_settled(rows, submitted) or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(1)
+        # A handler kept open by --daemon starts every sync from zero
+        self._ddl_submitted, self._ddl_run = {}, None
+        return ddl_queue_errors(rows, submitted, time.monotonic() - started)
+
+    async def get_existing_users(self) -> set:
+        return {r[0] for r in await self._execute("SELECT name FROM system.users")}
+
+    async def get_existing_databases(self) -> list:
+        return [r[0] for r in await self._execute("SELECT name FROM system.databases")]
+
+    async def snapshot(self) -> Snapshot:
+        users, databases, rows = await asyncio.gather(
+            self._execute("SELECT name FROM system.users"),
+            self._execute("SELECT name FROM system.databases"),
+            self._execute(GRANTS_SQL),
+        )
+        grants = {}
+        for user, db in rows:
+            grants.setdefault(user, set()).add(db)
+        return Snapshot({r[0] for r in users}, [r[0] for r in databases], grants)
+
+    async def create_user(self, username: str, password: str):
+        if self.dry:
+            self._dry(CREATE_USER.show(user=username, on_cluster=self._on_cluster, password=password))
+            return
+        print(f"[CH] Creating user '{username}'")
+        await self._run(CREATE_USER.sql(user=username, on_cluster=self._on_cluster, password=password),
+                        ("create_user", username))
+
+    async def create_database(self, name: str, owner: str = None):
+        if self.dry:
+            self._dry(CREATE_DATABASE.show(db=name, on_cluster=self._on_cluster))
+            return
+        print(f"[CH] Creating database '{name}'")
+        await self._run(CREATE_DATABASE.sql(db=name, on_cluster=self._on_cluster), ("create_database", name))
+
+    async def grant_full_privileges(self, username: str, db_name: str):
+        await self.grant_full_privileges_many([(username, db_name)])
+
+    async def grant_full_privileges_many(self, items: list) -> dict:
+        if self.dry:
+            for username, db_name in items:
+                self._dry(GRANT.show(on_cluster=self._on_cluster, targets=grant_targets([db_name]), user=username))
+            return {}
+        by_user = {}
+        for i, (username, db_name) in enumerate(items):
+            by_user.setdefault(username, []).append((i, db_name))
+
+        async def grant(username, entries):
+            for _, db_name in entries:
+                print(f"[CH] Granting privileges on '{db_name}' to '{username}'")
+            targets = grant_targets([db_name for _, db_name in entries])
+            await self._run(GRANT.sql(on_cluster=self._on_cluster, targets=targets, user=username),
+                            ("grant_full_privileges", username))
+
+        # Users are independent; with async DDL the queue still preserves per-user ordering
+        outcomes = await asyncio.gather(*(grant(u, e) for u, e in by_user.items()), return_exceptions=True)
+        failures = {}
+        for entries, outcome in zip(by_user.values(), outcomes):
+            if isinstance(outcome, Exception):
+                for i, _ in entries:
+                    failures[i] = outcome
+        return failures
+
+    async def drop_user(self, username: str):
+        if self.dry:
+            self._dry(DROP_USER.show(user=username, on_cluster=self._on_cluster))
+            return
+        print(f"[CH] Dropping user '{username}'")
+        await self._run(DROP_USER.sql(user=username, on_cluster=self._on_cluster), ("drop_user", username))
+
+    async def drop_database(self, name: str):
+        if self.dry:
+            self._dry(DROP_DATABASE.show(db=name, on_cluster=self._on_cluster))
+            return
+        print(f"[CH] Dropping database '{name}'")
+        await self._run(DROP_DATABASE.sql(db=name, on_cluster=self._on_cluster), ("drop_database", name))
+
+    async def update_user_password(self, username: str, password: str):
+        if self.dry:
+            self._dry(ALTER_USER.show(user=username, on_cluster=self._on_cluster, password=password))
+            return
+        print(f"[CH] Updating password for '{username}'")
+        await self._run(ALTER_USER.sql(user=username, on_cluster=self._on_cluster, password=password),
+                        ("update_user_password", username))
+
+    async def _run(self, sql: str, key: tuple):
+        # DDL goes through the distributed queue when a cluster is configured
+        if self.cfg.get("cluster"):
+            return await self._execute_ddl(sql, key)
+        return await self._execute(sql)
+
+    def _dry(self, sql: str):
+        print(f"[CH][DRY] {sql}")
@@ -0,0 +1,141 @@
+import asyncio
+import importlib
+from .async_pool import AsyncConnectionPool
+from .mongodb_handler import CREATE_CONCURRENCY, MongoDBHandler, grants_by_user, snapshot_from_users_info
+from .snapshot import Snapshot
+
+class AsyncMongoDBHandler:
+    # motor variant of MongoDBHandler with the same methods as coroutines
+    label = "Mongo"
+    batch_methods = MongoDBHandler.batch_methods
+    round_trips = MongoDBHandler.round_trips
+
+    def __init__(self, cfg: dict, dry_run: bool = False):
+        self.cfg = cfg
+        self.dry = dry_run
+        self.pool = AsyncConnectionPool(self._connect, shared=True)
+
+    async def _connect(self, _key=None):
+        AsyncIOMotorClient = importlib.import_module("motor.motor_asyncio").AsyncIOMotorClient
+        host = self.cfg.get("host", "localhost")
+        port = int(self.cfg.get("port", 27017))
+        user = self.cfg.get("admin_username", "")
+        pwd = self.cfg.get("admin_password", "")
+        auth_db = self.cfg.get("auth_source", "admin")
+        if user:
+            uri = f"mongodb://{user}:{pwd}@{host}:{port}/?authSource={auth_db}"
+        else:
+            uri = f"mongodb://{host}:{port}/"
+        return AsyncIOMotorClient(uri)
+
+    async def _client(self):
+        async with self.pool.connection() as c:
+            return c
+
+    async def _admin(self):
+        return (await self._client())[self.cfg.get("auth_source", "admin")]
+
+    async def close(self):
+        await self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
+    async def get_existing_users(self) -> set:
+        info = await (await self._admin()).command("usersInfo")
+        return {u["user"] for u in info.get("users", [])}
+
+    async def get_existing_databases(self) -> list:
+        return await (await self._client()).list_database_names()
+
+    async def snapshot(self) -> Snapshot:
+        info = await (await self._admin()).command("usersInfo")
+        databases = await (await self._client()).list_database_names()
+        return snapshot_from_users_info(info, databases)
+
+    async def create_user(self, username: str, password: str):
+        if self.dry:
+            print(f"[Mongo][DRY] Create user '{username}'")
+            return
+        print(f"[Mongo] Creating user '{username}'")
+        try:
+            await (await self._admin()).command("createUser", username, pwd=password, roles=[])
+        except Exception as e:
+            if getattr(e, "code", None) == 51003 or "already exists" in str(e):
+                print(f"User '{username}' already exists, skipping creation.")
+            else:
+                raise
+
+    async def create_database(self, name: str, owner: str = None):
+        if self.dry:
+            print(f"[Mongo][DRY] Create database '{name}'")
+            return
+        print(f"[Mongo] Creating database '{name}'")
+        try:
+            await (await self._client())[name].create_collection("init_marker", check_exists=False)
+        except Exception as e:
+            if getattr(e, "code", None) != 48:
+                raise
+
+    async def grant_full_privileges(self, username: str, db_name: str):
+        if self.dry:
+            print(f"[Mongo][DRY] Grant privileges on '{db_name}' to '{username}'")
+            return
+        print(f"[Mongo] Granting privileges on '{db_name}' to '{username}'")
+        await (await self._admin()).command("grantRolesToUser", username, roles=[{"role": "readWrite", "db": db_name}])
+
+    async def create_databases(self, items: list) -> dict:
+        if self.dry:
+            for args in items:
+                await self.create_database(*args)
+            return {}
+        limit = asyncio.Semaphore(CREATE_CONCURRENCY)
+
+        async def create(args):
+            async with limit:
+                await self.create_database(*args)
+
+        outcomes = await asyncio.gather(*(create(args) for args in items), return_exceptions=True)
+        return {i: e for i, e in enumerate(outcomes) if isinstance(e, Exception)}
+
+    async def grant_full_privileges_many(self, items: list) -> dict:
+        if self.dry:
+            for username, db_name in items:
+                await self.grant_full_privileges(username, db_name)
+            return {}
+        admin = await self._admin()
+        by_user = grants_by_user(items)
+
+        async def grant(username, entries):
+            for _, role in entries:
+                print(f"[Mongo] Granting privileges on '{role['db']}' to '{username}'")
+            await admin.command("grantRolesToUser", username, roles=[role for _, role in entries])
+
+        outcomes = await asyncio.gather(*(grant(u, e) for u, e in by_user.items()), return_exceptions=True)
+        failures = {}
+        for entries, outcome in zip(by_user.values(), outcomes):
+            if isinstance(outcome, Exception):
+                for i, _ in entries:
+                    failures[i] = outcome
+        return failures
+
+    async def drop_user(self, username: str):
+        if self.dry:
+            print(f"[Mongo][DRY] Drop user '{username}'")
+            return
+        print(f"[Mongo] Dropping user '{username}'")
+        await (await self._admin()).command("dropUser", username)
+
+    async def drop_database(self, name: str):
+        if self.dry:
+            print(f"[Mongo][DRY] Drop database '{name}'")
+            return
+        print(f"[Mongo] Dropping database '{name}'")
+        await (await self._client()).drop_database(name)
+
+    async def update_user_password(self, username: str, password: str):
+        if self.dry:
+            print(f"[Mongo][DRY] Update password for '{username}'")
+            return
+        print(f"[Mongo] Updating password for '{username}'")
+        await (await self._admin()).command("updateUser", username, pwd=password)
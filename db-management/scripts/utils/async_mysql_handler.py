@@ -0,0 +1,130 @@
+import importlib
+from .async_pool import AsyncConnectionPool
+from .mysql_handler import (ACCOUNT, ALTER_USER, CREATE_DATABASE, CREATE_USER, DATABASES_SQL, DB_GRANTS_SQL, DROP_DATABASE,
+                           DROP_USER, GRANT_ALL, USERS_SQL, MySQLHandler, accounts_statement, grants_from_rows)
+from .snapshot import Snapshot
+
+class AsyncMySQLHandler:
+    # aiomysql variant of MySQLHandler with the same methods as coroutines
+    label = "MySQL"
+    batch_methods = MySQLHandler.batch_methods
+
+    def __init__(self, cfg: dict, dry_run: bool = False):
+        self.cfg = cfg
+        self.dry = dry_run
+        self.pool = AsyncConnectionPool(self._connect, alive=lambda conn: not conn.closed)
+
+    async def _connect(self, _key=None):
+        aiomysql = importlib.import_module("aiomysql")
+        CLIENT = importlib.import_module("pymysql.constants").CLIENT
+        return await aiomysql.connect(
+            host=self.cfg.get("host", "localhost"),
+            port=int(self.cfg.get("port", 3306)),
+            user=self.cfg.get("admin_username", ""),
+            password=self.cfg.get("admin_password", ""),
+            ssl=self.cfg.get("ssl", False) or None,
+            autocommit=True,
+            client_flag=CLIENT.MULTI_STATEMENTS,
+        )
+
+    async def close(self):
+        await self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
+    async def _execute(self, sql: str, args=None, fetch: bool = False):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, args)
+                if fetch:
+                    return await cur.fetchall()
+                # Drain every result set of a multi-statement batch so errors surface here
+                while await cur.nextset():
+                    pass
+
+    async def get_existing_users(self) -> set:
+        return {row[0] for row in await self._execute(USERS_SQL, fetch=True)}
+
+    async def get_existing_databases(self) -> list:
+        return [row[0] for row in await self._execute(DATABASES_SQL, fetch=True)]
+
+    async def snapshot(self) -> Snapshot:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(USERS_SQL)
+                users = {row[0] for row in await cur.fetchall()}
+                await cur.execute(DATABASES_SQL)
+                databases = [row[0] for row in await cur.fetchall()]
+                await cur.execute(DB_GRANTS_SQL)
+                grants = grants_from_rows([d[0] for d in cur.description], await cur.fetchall())
+        return Snapshot(users, databases, grants)
+
+    async def create_user(self, username: str, password: str):
+        await self.create_users([(username, password)])
+
+    async def update_user_password(self, username: str, password: str):
+        await self.update_user_passwords([(username, password)])
+
+    async def create_database(self, name: str, owner: str = None):
+        await self.create_databases([(name, owner)])
+
+    async def grant_full_privileges(self, username: str, db_name: str):
+        await self.grant_full_privileges_many([(username, db_name)])
+
+    async def drop_database(self, name: str):
+        await self.drop_databases([(name,)])
+
+    async def drop_user(self, username: str):
+        await self.drop_users([(username,)])
+
+    async def create_users(self, items: list):
+        if self.dry:
+            self._dry(CREATE_USER.show(user=u, password=p) for u, p in items)
+            return
+        self._announce("Creating user", [u for u, _ in items])
+        await self._execute(*accounts_statement("CREATE USER IF NOT EXISTS", items))
+
+    async def update_user_passwords(self, items: list):
+        if self.dry:
+            self._dry(ALTER_USER.show(user=u, password=p) for u, p in items)
+            return
+        self._announce("Updating password for", [u for u, _ in items])
+        await self._execute(*accounts_statement("ALTER USER", items))
+
+    async def create_databases(self, items: list):
+        if self.dry:
+            self._dry(CREATE_DATABASE.show(db=args[0]) for args in items)
+            return
+        self._announce("Creating database", [args[0] for args in items])
+        await self._execute(";\n".join(CREATE_DATABASE.sql(db=args[0]) for args in items))
+
+    async def grant_full_privileges_many(self, items: list):
+        if self.dry:
+            self._dry(GRANT_ALL.show(db=d, user=u) for u, d in items)
+            return
+        for username, db_name in items:
+            print(f"[MySQL] Granting privileges on '{db_name}' to '{username}'")
+        await self._execute(";\n".join(GRANT_ALL.sql(db=d, user=u) for u, d in items))
+
+    async def drop_databases(self, items: list):
+        if self.dry:
+            self._dry(DROP_DATABASE.show(db=name) for (name,) in items)
+            return
+        self._announce("Dropping database", [name for (name,) in items])
+        await self._execute(";\n".join(DROP_DATABASE.sql(db=name) for (name,) in items))
+
+    async def drop_users(self, items: list):
+        if self.dry:
+            self._dry(DROP_USER.show(user=u) for (u,) in items)
+            return
+        self._announce("Dropping user", [u for (u,) in items])
+        await self._execute("DROP USER IF EXISTS " + ", ".join(ACCOUNT.sql(user=u) for (u,) in items))
+
+    def _announce(self, verb: str, names: list):
+        for name in names:
+            print(f"[MySQL] {verb} '{name}'")
+
+    def _dry(self, statements):
+        for sql in statements:
+            print(f"[MySQL][DRY] {sql}")
@@ -0,0 +1,92 @@
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+
+class AsyncConnectionPool:
+    # asyncio counterpart of ConnectionPool: same keying, exclusive checkout, shared mode and stats.
+    # `factory` is a coroutine function; `close` may return an awaitable.
+    def __init__(self, factory, close=None, alive=None, shared: bool = False, max_idle: int = 32):
+        self.factory = factory
+        self._close = close or (lambda conn: conn.close())
+        self._alive = alive or (lambda conn: True)
+        self.shared = shared
+        self.max_idle = max_idle
+        self._idle = []
+        self._shared = {}
+        self._lock = asyncio.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @asynccontextmanager
+    async def connection(self, key=None):
+        conn = await self._checkout(key)
+        try:
+            yield conn
+        finally:
+            if not self.shared:
+                await self._release(key, conn)
+
+    async def _checkout(self, key):
+        if self.shared:
+            # Held across the factory call so concurrent tasks never open a second shared client
+            async with self._lock:
+                conn = self._shared.get(key)
+                if conn is not None:
+                    self.reused += 1
+                    return conn
+                conn = self._shared[key] = await self.factory(key)
+                self.opened += 1
+                return conn
+        stale = None
+        for i in range(len(self._idle) - 1, -1, -1):
+            k, conn = self._idle[i]
+            if k != key:
+                continue
+            del self._idle[i]
+            if self._alive(conn):
+                self.reused += 1
+                return conn
+            self.discarded += 1
+            stale = conn
+            break
+        if stale is not None:
+            await self._safe_close(stale)
+        conn = await self.factory(key)
+        self.opened += 1
+        return conn
+
+    async def _release(self, key, conn):
+        if not self._alive(conn):
+            self.discarded += 1
+            await self._safe_close(conn)
+            return
+        self._idle.append((key, conn))
+        if len(self._idle) > self.max_idle:
+            await self._safe_close(self._idle.pop(0)[1])
+
+    async def discard(self, key=None):
+        dropped = [c for k, c in self._idle if k == key]
+        self._idle = [(k, c) for k, c in self._idle if k != key]
+        if key in self._shared:
+            dropped.append(self._shared.pop(key))
+        for conn in dropped:
+            await self._safe_close(conn)
+
+    async def close(self):
+        conns = [c for _, c in self._idle] + list(self._shared.values())
+        self._idle = []
+        self._shared = {}
+        for conn in conns:
+            await self._safe_close(conn)
+
+    def stats(self) -> dict:
+        return {"opened": self.opened, "reused": self.reused, "discarded": self.discarded}
+
+    async def _safe_close(self, conn):
+        try:
+            value = self._close(conn)
+            if inspect.isawaitable(value):
+                await value
+        except Exception:
+            pass
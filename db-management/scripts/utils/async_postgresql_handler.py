@@ -0,0 +1,321 @@
+import asyncio
+import importlib
+import time
+from .async_pool import AsyncConnectionPool
+from .postgresql_handler import (ALTER_ROLE_PASSWORD, CLOSE_DATABASE, CREATE_ROLE, CREATE_TEMPLATE, DATABASE_ACL,
+                                 DATABASE_ACL_SQL, DEFAULT_DROP_CONCURRENCY, DROP_ATTEMPTS, DROP_DATABASE,
+                                 DROP_DATABASE_FORCE, DROP_ROLE, MARK_TEMPLATE, OPEN_DATABASE, ROLES_SQL, SCHEMA_ACL,
+                                 SET_OWNER, TEMPLATE_SCHEMA_SQL, TERMINATE_SQL, PostgreSQLHandler,
+                                 create_database_statement, snapshot_from_rows)
+from .snapshot import Snapshot
+
+class AsyncPostgreSQLHandler:
+    # asyncpg variant of PostgreSQLHandler with the same methods as coroutines
+    label = "PG"
+    batch_methods = PostgreSQLHandler.batch_methods
+    round_trips = PostgreSQLHandler.round_trips
+
+    def __init__(self, cfg: dict, dry_run: bool = False):
+        self.cfg = cfg
+        self.dry = dry_run
+        self.pool = AsyncConnectionPool(self._connect, alive=lambda conn: not conn.is_closed())
+        self._from_template = {}
+        self._template_ready = False
+        self._template_lock = asyncio.Lock()
+
+    async def _connect(self, db_name):
+        asyncpg = importlib.import_module("asyncpg")
+        # asyncpg never opens an implicit transaction, so CREATE/DROP DATABASE work on any pooled connection
+        return await asyncpg.connect(
+            host=self.cfg.get("host", "localhost"),
+            port=int(self.cfg.get("port", 5432)),
+            user=self.cfg.get("admin_username", ""),
+            password=self.cfg.get("admin_password", ""),
+            database=db_name,
+        )
+
+    def _conn(self, db_name="postgres"):
+        return self.pool.connection(db_name)
+
+    async def close(self):
+        await self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
+    async def get_existing_users(self) -> set:
+        async with self._conn() as conn:
+            return {r[0] for r in await conn.fetch(ROLES_SQL)}
+
+    async def get_existing_databases(self) -> list:
+        async with self._conn() as conn:
+            return [r[0] for r in await conn.fetch("SELECT datname FROM pg_database WHERE datistemplate = false")]
+
+    async def snapshot(self) -> Snapshot:
+        async with self._conn() as conn:
+            users = {r[0] for r in await conn.fetch(ROLES_SQL)}
+            rows = [tuple(r) for r in await conn.fetch(DATABASE_ACL_SQL)]
+        return snapshot_from_rows(users, rows)
+
+    async def create_user(self, username: str, password: str):
+        if self.dry:
+            self._dry(CREATE_ROLE.show(user=username, password=password))
+            return
+        print(f"[PG] Creating role '{username}'")
+        asyncpg = importlib.import_module("asyncpg")
+        async with self._conn() as conn:
+            try:
+                # Utility statements take no bind parameters in the extended protocol: the password is inlined
+                await conn.execute(CREATE_ROLE.sql(user=username, password=password))
+            except asyncpg.exceptions.DuplicateObjectError:
+                print(f"Role '{username}' already exists, skipping creation.")
+
+    async def create_database(self, name: str, owner: str):
+        if self.dry:
+            template = self.cfg.get("template_database")
+            self._dry(create_database_statement(template).show(db=name, owner=owner, template=template))
+            return
+        print(f"[PG] Creating database '{name}' owner '{owner}'")
+        asyncpg = importlib.import_module("asyncpg")
+        template = await self._template()
+        async with self._conn() as conn:
+            try:
+                await conn.execute(create_database_statement(template).sql(db=name, owner=owner, template=template))
+            except asyncpg.exceptions.DuplicateDatabaseError:
+                return
+        if template:
+            self._from_template[name] = owner
+
+    async def grant_full_privileges(self, username: str, db_name: str):
+        if self.dry:
+            self._dry(SCHEMA_ACL.show(user=username), db_name)
+            self._dry(DATABASE_ACL.show(db=db_name, user=username))
+            return
+        print(f"[PG] Granting privileges on '{db_name}' to '{username}'")
+        # Schema ACL first, as in PostgreSQLHandler: a locked-down database ACL implies the schema step is done
+        await self._lock_schema(username, db_name)
+        async with self._conn() as conn:
+            await conn.execute(DATABASE_ACL.sql(db=db_name, user=username))
+
+    async def set_database_owner(self, name: str, owner: str):
+        if self.dry:
+            self._dry(SET_OWNER.show(db=name, owner=owner))
+            return
+        print(f"[PG] Setting owner of '{name}' to '{owner}'")
+        async with self._conn() as conn:
+            await conn.execute(SET_OWNER.sql(db=name, owner=owner))
+
+    async def drop_user(self, username: str):
+        if self.dry:
+            self._dry(DROP_ROLE.show(user=username))
+            return
+        print(f"[PG] Dropping role '{username}'")
+        async with self._conn() as conn:
+            await conn.execute(DROP_ROLE.sql(user=username))
+
+    async def drop_database(self, name: str):
+        if self.dry:
+            self._dry(DROP_DATABASE.show(db=name))
+            return
+        print(f"[PG] Dropping database '{name}'")
+        await self.pool.discard(name)
+        async with self._conn() as conn:
+            force = conn.get_server_version().major >= 13
+            if not force:
+                await conn.execute(TERMINATE_SQL.format(databases="$1"), [name])
+        await self._drop(name, force)
+
+    async def drop_databases(self, items: list) -> dict:
+        # Same pipeline as PostgreSQLHandler.drop_databases, the drops bounded by a semaphore
+        if self.dry:
+            for args in items:
+                await self.drop_database(*args)
+            return {}
+        names = [args[0] for args in items]
+        started = time.monotonic()
+        for name in names:
+            print(f"[PG] Dropping database '{name}'")
+            await self.pool.discard(name)
+        try:
+            async with self._conn() as conn:
+                force = conn.get_server_version().major >= 13
+                await conn.execute("; ".join(CLOSE_DATABASE.sql(db=n) for n in names))
+                terminated = {r[0]: r[1] for r in await conn.fetch(TERMINATE_SQL.format(databases="$1"), names)}
+        except Exception:
+            await self._reopen(names)
+            raise
+        limit = asyncio.Semaphore(max(1, int(self.cfg.get("drop_concurrency", DEFAULT_DROP_CONCURRENCY))))
+
+        async def drop(name: str) -> float:
+            async with limit:
+                await self._drop(name, force)
+            return time.monotonic() - started
+
+        outcomes = await asyncio.gather(*(drop(name) for name in names), return_exceptions=True)
+        failures = {}
+        for i, (name, outcome) in enumerate(zip(names, outcomes)):
+            if isinstance(outcome, Exception):
+                failures[i] = outcome
+                continue
+            print(f"[PG] Dropped database '{name}' after {outcome:.2f}s ({terminated.get(name, 0)} session(s) terminated)")
+        await self._reopen([names[i] for i in failures])
+        return failures
+
+    async def _reopen(self, names: list):
+        if not names:
+            return
+        try:
+            async with self._conn() as conn:
+                for (name,) in await conn.fetch("SELECT datname FROM pg_database WHERE datname = ANY($1)", names):
+                    try:
+                        await conn.execute(OPEN_DATABASE.sql(db=name))
+                    except Exception as e:
+                        print(f"[PG] Database '{name}' still refuses connections: {e}")
+                    else:
+                        print(f"[PG] Database '{name}' was not dropped and accepts connections again")
+        except Exception as e:
+            print(f"[PG] Databases {', '.join(names)} may still refuse connections: {e}")
+
+    async def _drop(self, name: str, force: bool):
+        async with self._conn() as conn:
+            if force:
+                await conn.execute(DROP_DATABASE_FORCE.sql(db=name))
+                return
+            asyncpg = importlib.import_module("asyncpg")
+            for attempt in range(1, DROP_ATTEMPTS + 1):
+                try:
+                    await conn.execute(DROP_DATABASE.sql(db=name))
+                    return
+                except asyncpg.exceptions.ObjectInUseError:
+                    if attempt == DROP_ATTEMPTS:
+                        raise
+                await asyncio.sleep(0.2 * attempt)
+                await conn.execute(TERMINATE_SQL.format(databases="$1"), [name])
+
+    async def update_user_password(self, username: str, password: str):
+        if self.dry:
+            self._dry(ALTER_ROLE_PASSWORD.show(user=username, password=password))
+            return
+        print(f"[PG] Updating password for '{username}'")
+        async with self._conn() as conn:
+            await conn.execute(ALTER_ROLE_PASSWORD.sql(user=username, password=password))
+
+    async def create_users(self, items: list):
+        if self.dry:
+            for username, password in items:
+                await self.create_user(username, password)
+            return
+        for username, _ in items:
+            print(f"[PG] Creating role '{username}'")
+        await self._transaction([CREATE_ROLE.sql(user=u, password=p) for u, p in items])
+
+    async def update_user_passwords(self, items: list):
+        if self.dry:
+            for username, password in items:
+                await self.update_user_password(username, password)
+            return
+        for username, _ in items:
+            print(f"[PG] Updating password for '{username}'")
+        await self._transaction([ALTER_ROLE_PASSWORD.sql(user=u, password=p) for u, p in items])
+
+    async def set_database_owners(self, items: list):
+        if self.dry:
+            for name, owner in items:
+                await self.set_database_owner(name, owner)
+            return
+        for name, owner in items:
+            print(f"[PG] Setting owner of '{name}' to '{owner}'")
+        await self._transaction([SET_OWNER.sql(db=n, owner=o) for n, o in items])
+
+    async def create_databases(self, items: list) -> dict:
+        if self.dry:
+            for name, owner in items:
+                await self.create_database(name, owner)
+            return {}
+        asyncpg = importlib.import_module("asyncpg")
+        template = await self._template()
+        failures = {}
+        async with self._conn() as conn:
+            for i, (name, owner) in enumerate(items):
+                print(f"[PG] Creating database '{name}' owner '{owner}'")
+                try:
+                    await conn.execute(create_database_statement(template).sql(db=name, owner=owner, template=template))
+                except asyncpg.exceptions.DuplicateDatabaseError:
+                    continue
+                except asyncpg.exceptions.PostgresError as e:
+                    failures[i] = e
+                    continue
+                if template:
+                    self._from_template[name] = owner
+        return failures
+
+    async def grant_full_privileges_many(self, items: list) -> dict:
+        if self.dry:
+            for username, db_name in items:
+                await self.grant_full_privileges(username, db_name)
+            return {}
+        failures = {}
+        ready = []
+        for i, (username, db_name) in enumerate(items):
+            print(f"[PG] Granting privileges on '{db_name}' to '{username}'")
+            try:
+                await self._lock_schema(username, db_name)
+            except Exception as e:
+                failures[i] = e
+                continue
+            ready.append(i)
+        if not ready:
+            return failures
+        try:
+            async with self._conn() as conn:
+                await conn.execute("; ".join(DATABASE_ACL.sql(db=items[i][1], user=items[i][0]) for i in ready))
+        except Exception:
+            for i in ready:
+                try:
+                    async with self._conn() as conn:
+                        await conn.execute(DATABASE_ACL.sql(db=items[i][1], user=items[i][0]))
+                except Exception as e:
+                    failures[i] = e
+        return failures
+
+    async def _transaction(self, statements: list):
+        async with self._conn() as conn:
+            try:
+                await conn.execute("; ".join(["BEGIN"] + statements + ["COMMIT"]))
+            except Exception:
+                if not conn.is_closed():
+                    await conn.execute("ROLLBACK")
+                raise
+
+    async def _lock_schema(self, username: str, db_name: str):
+        if self._from_template.get(db_name) == username:
+            return
+        try:
+            async with self._conn(db_name) as conn:
+                await conn.execute(SCHEMA_ACL.sql(user=username))
+        except Exception as e:
+            raise RuntimeError(f"Could not adjust public schema privileges for {db_name}: {e}") from e
+
+    async def _template(self):
+        name = self.cfg.get("template_database")
+        if not name or self._template_ready:
+            return name
+        async with self._template_lock:
+            if not self._template_ready:
+                await self._prepare_template(name)
+                self._template_ready = True
+        return name
+
+    async def _prepare_template(self, name: str):
+        async with self._conn() as conn:
+            if await conn.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", name) is None:
+                print(f"[PG] Creating template database '{name}'")
+                await conn.execute(CREATE_TEMPLATE.sql(db=name))
+        async with self._conn(name) as conn:
+            await conn.execute(TEMPLATE_SCHEMA_SQL)
+        await self.pool.discard(name)
+        async with self._conn() as conn:
+            await conn.execute(MARK_TEMPLATE.sql(db=name))
+
+    def _dry(self, sql: str, db_name: str = None):
+        print(f"[PG][DRY] {sql}" + (f"  -- in {db_name}" if db_name else ""))
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from .estimate import CostEstimate
+from .incremental import settle_state, sync_scope
+from .journal import Journal
+from .options import SyncOptions
+from .planner import print_plan, print_plan_summary
+from .reconcile import (PHASES, NullPasswordState, SyncResult, batch_outcomes, confirm, count_plans,
+                        defer_confirmations, note_batch_failure, phase_pending, plan_chunks, record_outcomes,
+                        settle_unconfirmed, with_last)
+
+# Same plan, ordering and failure semantics as reconcile(); handler methods are coroutines and
+# concurrency is bounded by a per-engine semaphore instead of a thread pool.
+
+async def reconcile_async(handler, users: dict, templates: list, state=None, options: SyncOptions = None) -> SyncResult:
+    options = options or SyncOptions()
+    result = SyncResult(handler.label)
+    if state is None:
+        state = NullPasswordState()
+    limit = asyncio.Semaphore(options.concurrency)
+    defer_confirmations(handler, result)
+    journal = Journal.for_run(handler, state, options)
+    resumed = journal.resume(users, templates, state, handler.label) if journal is not None and options.resume else None
+    if resumed is not None:
+        result.journal = journal
+        journal.reopen()
+        try:
+            count_plans(result, resumed.plans)
+            await execute_chunk_async(handler, result, state, resumed.plans, options, limit)
+            await finish_run_async(handler, result, state)
+        finally:
+            journal.close()
+        if resumed.complete:
+            settle_state(state, templates, resumed.scope, resumed.removed, result)
+            journal.finish()
+            return result
+        journal.finish()
+    scope, removed = sync_scope(users, templates, state, options, handler.label)
+    if scope is not None and not scope:
+        return result
+    estimate = CostEstimate(handler, options, PHASES) if handler.dry or options.plan_only else None
+    started = time.monotonic()
+    snapshot = await handler.snapshot()
+    if estimate is not None:
+        estimate.discovery = time.monotonic() - started
+        result.estimate = estimate
+    if journal is not None:
+        journal.begin(users, templates, scope, handler.label)
+        result.journal = journal
+    try:
+        for plans, last in with_last(plan_chunks(users, templates, snapshot, state, scope)):
+            count_plans(result, plans)
+            if estimate is not None:
+                estimate.add(plans)
+            if options.plan_only:
+                print_plan(handler.label, plans, summary=False)
+                continue
+            if journal is not None:
+                journal.plan(plans, last)
+            await execute_chunk_async(handler, result, state, plans, options, limit)
+        if not options.plan_only:
+            # Confirmations held back until the handler's finish() are journaled as well
+            await finish_run_async(handler, result, state)
+    finally:
+        if journal is not None:
+            journal.close()
+    if options.plan_only:
+        print_plan_summary(handler.label, result.operations, result.added + result.updated + result.removed)
+        return result
+    settle_state(state, templates, scope, removed, result)
+    if journal is not None:
+        journal.finish()
+    return result
+
+async def execute_chunk_async(handler, result: SyncResult, state, plans: list, options: SyncOptions,
+                              limit: asyncio.Semaphore):
+    handler.pool.max_idle = max(handler.pool.max_idle, options.concurrency)
+    if options.batch_size > 1 and getattr(handler, "batch_methods", None):
+        await execute_phased_async(handler, result, state, plans, options, limit)
+    else:
+        await asyncio.gather(*(execute_plan_async(handler, result, state, p, limit) for p in plans))
+
+async def finish_run_async(handler, result: SyncResult, state):
+    finish = getattr(handler, "finish", None)
+    settle_unconfirmed(result, state, await finish() if finish is not None else [])
+
+async def execute_plan_async(handler, result: SyncResult, state, plan, limit: asyncio.Semaphore):
+    # The semaphore is held for the whole user so its steps stay in order and a user never
+    # occupies more than one slot
+    async with limit:
+        failed_scopes = set()
+        for op in plan.ops:
+            if op.scope is not None and op.scope in failed_scopes:
+                continue
+            try:
+                await op.apply(handler)
+            except Exception as e:
+                result.error(f"Failed to {op}: {e}", plan.username)
+                if op.scope is None:
+                    return
+                failed_scopes.add(op.scope)
+                continue
+            confirm(result, state, plan.username, op)
+
+async def execute_phased_async(handler, result: SyncResult, state, plans: list, options: SyncOptions,
+                               limit: asyncio.Semaphore):
+    failed = {}
+    for action in PHASES:
+        pending = phase_pending(plans, action, failed)
+        if not pending:
+            continue
+        batch_method = handler.batch_methods.get(action)
+        if batch_method:
+            size = options.batch_size
+            jobs = [_apply_batch_async(handler, batch_method, pending[i:i + size], limit)
+                    for i in range(0, len(pending), size)]
+        else:
+            jobs = [_apply_one_async(handler, item, limit) for item in pending]
+        for outcomes in await asyncio.gather(*jobs):
+            record_outcomes(outcomes, result, state, failed)
+
+async def _apply_one_async(handler, item, limit: asyncio.Semaphore) -> list:
+    plan, op = item
+    async with limit:
+        try:
+            await op.apply(handler)
+        except Exception as e:
+            return [(plan, op, e)]
+    return [(plan, op, None)]
+
+async def _apply_batch_async(handler, method: str, chunk: list, limit: asyncio.Semaphore) -> list:
+    try:
+        async with limit:
+            failures = await getattr(handler, method)([op.args for _, op in chunk]) or {}
+    except Exception as e:
+        note_batch_failure(handler, method, chunk, e)
+        outcomes = []
+        for item in chunk:
+            outcomes.extend(await _apply_one_async(handler, item, limit))
+        return outcomes
+    return batch_outcomes(handler, method, chunk, failures)
@@ -0,0 +1,74 @@
+import argparse
+import sys
+from .engines import ENGINES
+from .metrics import report_metrics
+from .options import SyncOptions, add_sync_arguments
+from .targets import combine_results, load_config, print_summary, sync_targets
+
+# Entry points of the sync commands: the console scripts declared in pyproject.toml and the
+# scripts/*_sync.py wrappers used from a checkout. Only what a one-shot sync needs is imported at
+# startup; PyYAML, the drivers, asyncio (--async) and the daemon (--daemon) are loaded on first use.
+# `python benchmarks/startup.py` measures the import cost against its budget.
+
+def run_engine(engine: str, config_dir: str, dry_run: bool, options: SyncOptions = None):
+    # One engine: every server listed under its section of connections.yaml, reconciled in parallel
+    options = options or SyncOptions()
+    users, jobs = load_config(config_dir, [engine], options)
+    results = sync_targets(config_dir, jobs, users, dry_run, options)
+    if len(results) > 1:
+        print_summary(results)
+    report_metrics(results, options)
+    return combine_results(engine, results)
+
+def run_engines(config_dir: str, engines: list, dry_run: bool, options: SyncOptions = None) -> list:
+    # Config is parsed and validated once, then every target of every engine reconciles concurrently
+    # from the same desired state (at most --parallel-targets at a time)
+    options = options or SyncOptions()
+    # Default to every engine that has a section in connections.yaml
+    users, jobs = load_config(config_dir, engines, options)
+    results = sync_targets(config_dir, jobs, users, dry_run, options)
+    print_summary(results)
+    report_metrics(results, options)
+    return results
+
+def parse_engines(value: str) -> list:
+    engines = [e.strip() for e in value.split(",") if e.strip()]
+    unknown = [e for e in engines if e not in ENGINES]
+    if unknown:
+        raise SystemExit(f"Unknown engine(s): {', '.join(unknown)}. Choose from: {', '.join(ENGINES)}")
+    return engines
+
+def engine_main(engine: str):
+    ap = argparse.ArgumentParser(prog=f"{engine}-sync")
+    add_sync_arguments(ap)
+    args = ap.parse_args()
+    options = SyncOptions.from_args(args)
+    if options.daemon:
+        from .daemon import run_daemon
+        sys.exit(run_daemon(args.config, [engine], args.dry_run, options))
+    result = run_engine(engine, args.config, args.dry_run, options)
+    sys.exit(0 if result.ok else 1)
+
+def db_sync_main():
+    ap = argparse.ArgumentParser(prog="db-sync")
+    add_sync_arguments(ap)
+    ap.add_argument("--engines", default="", help="Comma-separated engines to sync (default: all configured)")
+    args = ap.parse_args()
+    options = SyncOptions.from_args(args)
+    if options.daemon:
+        from .daemon import run_daemon
+        sys.exit(run_daemon(args.config, parse_engines(args.engines), args.dry_run, options))
+    results = run_engines(args.config, parse_engines(args.engines), args.dry_run, options)
+    sys.exit(0 if all(r.ok for r in results) else 1)
+
+def mysql_main():
+    engine_main("mysql")
+
+def postgresql_main():
+    engine_main("postgresql")
+
+def clickhouse_main():
+    engine_main("clickhouse")
+
+def mongodb_main():
+    engine_main("mongodb")
@@ -1,11 +1,101 @@
 import importlib
+import secrets
+import threading
+import time
+from .pool import ConnectionPool
+from .snapshot import Snapshot
+from .statements import CLICKHOUSE
+
+# Submit ON CLUSTER DDL without waiting for every replica; completion is tracked in bulk by finish()
+ASYNC_DDL_SETTINGS = {"distributed_ddl_task_timeout": 0, "distributed_ddl_output_mode": "none"}
+
+# Discovery queries, shared with the asyncio handler
+GRANTS_SQL = (
+    "SELECT user_name, database FROM system.grants "
+    "WHERE access_type = 'ALL' AND table IS NULL AND database IS NOT NULL "
+    "AND user_name IS NOT NULL AND is_partial_revoke = 0"
+)
+# log_comment is among the settings stored with every queue entry; it carries the tag of the statement
+DDL_QUEUE_COLUMNS = "entry, host, port, status, exception_code, exception_text, settings['log_comment']"
+
+# Statement templates, also shared with the asyncio handler. on_cluster is "" or the rendered ON_CLUSTER.
+ON_CLUSTER = CLICKHOUSE.statement(" ON CLUSTER {cluster}")
+CREATE_USER = CLICKHOUSE.statement(
+    "CREATE USER IF NOT EXISTS {user}{on_cluster!r} IDENTIFIED WITH plaintext_password BY {password!v}")
+ALTER_USER = CLICKHOUSE.statement("ALTER USER {user}{on_cluster!r} IDENTIFIED WITH plaintext_password BY {password!v}")
+DROP_USER = CLICKHOUSE.statement("DROP USER IF EXISTS {user}{on_cluster!r}")
+CREATE_DATABASE = CLICKHOUSE.statement("CREATE DATABASE IF NOT EXISTS {db}{on_cluster!r}")
+DROP_DATABASE = CLICKHOUSE.statement("DROP DATABASE IF EXISTS {db}{on_cluster!r}")
+# Every database granted to a user in one GRANT, i.e. one distributed DDL queue entry
+GRANT = CLICKHOUSE.statement("GRANT{on_cluster!r} {targets!r} TO {user}")
+GRANT_TARGET = CLICKHOUSE.statement("ALL ON {db}.*")
+
+def on_cluster(cfg: dict) -> str:
+    cluster = cfg.get("cluster")
+    return ON_CLUSTER.sql(cluster=cluster) if cluster else ""
+
+def grant_targets(databases: list) -> str:
+    return ", ".join(GRANT_TARGET.sql(db=db_name) for db_name in databases)
+
+def ddl_tag(run: str) -> str:
+    return f"{run}:{secrets.token_hex(6)}"
+
+def ddl_queue_settled(rows, submitted: dict) -> bool:
+    # Every submitted statement has its queue entry and none is still running on a host
+    tags = {r[6] for r in rows}
+    pending = [r for r in rows if r[3] != "Finished" and not r[4]]
+    return tags >= submitted.keys() and not pending
+
+def ddl_queue_errors(rows, submitted: dict, elapsed: float) -> list:
+    # Prints a summary of the distributed DDL queue and returns (message, key) for every submitted
+    # statement that failed on a host, is still pending or never reached the queue; submitted maps
+    # tag -> key, the (action, first argument) of the operations the statement was sent for
+    entries = {r[0] for r in rows}
+    hosts = {(r[1], r[2]) for r in rows}
+    print(f"[CH] Distributed DDL: {len(entries)} entries on {len(hosts)} host(s) in {elapsed:.1f}s")
+    by_tag = {}
+    for row in rows:
+        by_tag.setdefault(row[6], []).append(row)
+    errors = []
+    stragglers = {}
+    for tag, key in submitted.items():
+        tag_rows = by_tag.get(tag)
+        if not tag_rows:
+            errors.append(("distributed DDL statement never reached the queue", key))
+            continue
+        failed = [f"{host}:{port}: {text}" for _, host, port, _, code, text, _ in tag_rows if code]
+        pending = [(host, port) for _, host, port, status, code, _, _ in tag_rows if not code and status != "Finished"]
+        if failed:
+            errors.append((f"distributed DDL {tag_rows[0][0]} failed on {'; '.join(failed)}", key))
+        elif pending:
+            errors.append((f"distributed DDL {tag_rows[0][0]} still pending on "
+                           f"{', '.join(f'{h}:{p}' for h, p in pending)}", key))
+            for host_port in pending:
+                stragglers[host_port] = stragglers.get(host_port, 0) + 1
+    for (host, port), count in sorted(stragglers.items()):
+        print(f"[CH] Distributed DDL still pending on {host}:{port} ({count} entries)")
+    return errors
 
 class ClickHouseHandler:
+    label = "CH"
+    # All grants of one user are combined into a single GRANT, i.e. one distributed DDL queue entry
+    batch_methods = {"grant_full_privileges": "grant_full_privileges_many"}
+    # (per call, per item, per user) round-trips for --dry-run estimates; one per call otherwise
+    round_trips = {"grant_full_privileges_many": (0, 0, 1)}
+
     def __init__(self, cfg: dict, dry_run: bool = False):
         self.cfg = cfg
         self.dry = dry_run
+        # clickhouse_driver.Client is not thread-safe, so clients are checked out exclusively
+        self.pool = ConnectionPool(self._connect, close=lambda c: c.disconnect())
+        self.async_ddl = bool(cfg.get("cluster")) and bool(cfg.get("async_ddl", False))
+        self._on_cluster = on_cluster(cfg)
+        self._ddl_lock = threading.Lock()
+        # tag -> (action, first argument) of every statement queued by this run, see _execute_ddl
+        self._ddl_submitted = {}
+        self._ddl_run = None
 
-    def _client(self):
+    def _connect(self, _key=None):
         Client = importlib.import_module("clickhouse_driver").Client
         return Client(
             host=self.cfg.get("host", "localhost"),
@@ -14,97 +104,152 @@ class ClickHouseHandler:
             password=self.cfg.get("admin_password", ""),
         )
 
+    def _client(self):
+        return self.pool.connection()
+
+    def _execute(self, sql: str, params: dict = None, settings: dict = None):
+        with self._client() as c:
+            return c.execute(sql, params, settings=settings)
+
+    def _execute_ddl(self, sql: str, key: tuple):
+        # ON CLUSTER statements. In async mode they return as soon as the queue entry is created;
+        # entries run in submission order on every host, so a GRANT never overtakes its CREATE USER.
+        # Each statement is tagged through log_comment, so finish() only reads this run's queue entries
+        # (not those of other clients on the cluster) and knows which operation each one belongs to.
+        if not self.async_ddl:
+            return self._execute(sql)
+        with self._ddl_lock:
+            if self._ddl_run is None:
+                self._ddl_run = f"db-sync-{secrets.token_hex(8)}"
+            tag = ddl_tag(self._ddl_run)
+            self._ddl_submitted[tag] = key
+        try:
+            return self._execute(sql, settings={**ASYNC_DDL_SETTINGS, "log_comment": tag})
+        except Exception:
+            # Fails as a call of its own; nothing to wait for
+            with self._ddl_lock:
+                self._ddl_submitted.pop(tag, None)
+            raise
+
+    def finish(self) -> list:
+        # Waits for async distributed DDL to complete on every host; returns (message, key) problems
+        # (see ddl_queue_errors) for reconcile to fail the operations concerned
+        with self._ddl_lock:
+            submitted, run = dict(self._ddl_submitted), self._ddl_run
+        if self.dry or not submitted:
+            return []
+        started = time.monotonic()
+        deadline = started + float(self.cfg.get("ddl_timeout", 600))
+        while True:
+            rows = self._execute(
+                f"SELECT {DDL_QUEUE_COLUMNS} FROM system.distributed_ddl_queue "
+                "WHERE cluster = %(cluster)s AND startsWith(settings['log_comment'], %(run)s)",
+                {"cluster": self.cfg.get("cluster"), "run": run + ":"},
+            )
+            if ddl_queue_settled(rows, submitted) or time.monotonic() >= deadline:
+                break
+            time.sleep(1)
+        # A handler kept open by --daemon starts every sync from zero
+        with self._ddl_lock:
+            self._ddl_submitted, self._ddl_run = {}, None
+        return ddl_queue_errors(rows, submitted, time.monotonic() - started)
+
+    def close(self):
+        self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
     def get_existing_users(self) -> set:
-        if self.dry:
-            return set()
-        c = self._client()
-        rows = c.execute("SELECT name FROM system.users")
+        rows = self._execute("SELECT name FROM system.users")
         return {r[0] for r in rows}
 
     def get_existing_databases(self) -> list:
-        if self.dry:
-            return []
-        c = self._client()
-        rows = c.execute("SELECT name FROM system.databases")
+        rows = self._execute("SELECT name FROM system.databases")
         return [r[0] for r in rows]
 
+    def snapshot(self) -> Snapshot:
+        with self._client() as c:
+            users = {r[0] for r in c.execute("SELECT name FROM system.users")}
+            databases = [r[0] for r in c.execute("SELECT name FROM system.databases")]
+            rows = c.execute(GRANTS_SQL)
+        grants = {}
+        for user, db in rows:
+            grants.setdefault(user, set()).add(db)
+        return Snapshot(users, databases, grants)
+
     def create_user(self, username: str, password: str):
         if self.dry:
-            print(f"[CH][DRY] Create user '{username}'")
+            self._dry(CREATE_USER.show(user=username, on_cluster=self._on_cluster, password=password))
             return
         print(f"[CH] Creating user '{username}'")
-        c = self._client()
-        escaped_pwd = self._escape(password)
-        cluster = self.cfg.get("cluster")
-        if cluster:
-             c.execute(f"CREATE USER IF NOT EXISTS {self._ident(username)} ON CLUSTER {self._ident(cluster)} IDENTIFIED WITH plaintext_password BY '{escaped_pwd}'")
-        else:
-             c.execute(f"CREATE USER IF NOT EXISTS {self._ident(username)} IDENTIFIED WITH plaintext_password BY '{escaped_pwd}'")
-
-    def create_database(self, name: str):
+        self._run(CREATE_USER.sql(user=username, on_cluster=self._on_cluster, password=password),
+                  ("create_user", username))
+
+    def create_database(self, name: str, owner: str = None):
         if self.dry:
-            print(f"[CH][DRY] Create database '{name}'")
+            self._dry(CREATE_DATABASE.show(db=name, on_cluster=self._on_cluster))
             return
         print(f"[CH] Creating database '{name}'")
-        c = self._client()
-        cluster = self.cfg.get("cluster")
-        if cluster:
-            c.execute(f"CREATE DATABASE IF NOT EXISTS {self._ident(name)} ON CLUSTER {self._ident(cluster)}")
-        else:
-            c.execute(f"CREATE DATABASE IF NOT EXISTS {self._ident(name)}")
+        self._run(CREATE_DATABASE.sql(db=name, on_cluster=self._on_cluster), ("create_database", name))
 
     def grant_full_privileges(self, username: str, db_name: str):
         if self.dry:
-            print(f"[CH][DRY] Grant privileges on '{db_name}' to '{username}'")
+            self._dry(GRANT.show(on_cluster=self._on_cluster, targets=grant_targets([db_name]), user=username))
             return
         print(f"[CH] Granting privileges on '{db_name}' to '{username}'")
-        c = self._client()
-        cluster = self.cfg.get("cluster")
-        if cluster:
-            c.execute(f"GRANT ON CLUSTER {self._ident(cluster)} ALL ON {self._ident(db_name)}.* TO {self._ident(username)}")
-        else:
-            c.execute(f"GRANT ALL ON {self._ident(db_name)}.* TO {self._ident(username)}")
+        self._run(GRANT.sql(on_cluster=self._on_cluster, targets=grant_targets([db_name]), user=username),
+                  ("grant_full_privileges", username))
 
     def drop_user(self, username: str):
         if self.dry:
-            print(f"[CH][DRY] Drop user '{username}'")
+            self._dry(DROP_USER.show(user=username, on_cluster=self._on_cluster))
             return
         print(f"[CH] Dropping user '{username}'")
-        c = self._client()
-        cluster = self.cfg.get("cluster")
-        if cluster:
-            c.execute(f"DROP USER IF EXISTS {self._ident(username)} ON CLUSTER {self._ident(cluster)}")
-        else:
-            c.execute(f"DROP USER IF EXISTS {self._ident(username)}")
+        self._run(DROP_USER.sql(user=username, on_cluster=self._on_cluster), ("drop_user", username))
 
     def drop_database(self, name: str):
         if self.dry:
-            print(f"[CH][DRY] Drop database '{name}'")
+            self._dry(DROP_DATABASE.show(db=name, on_cluster=self._on_cluster))
             return
         print(f"[CH] Dropping database '{name}'")
-        c = self._client()
-        cluster = self.cfg.get("cluster")
-        if cluster:
-            c.execute(f"DROP DATABASE IF EXISTS {self._ident(name)} ON CLUSTER {self._ident(cluster)}")
-        else:
-            c.execute(f"DROP DATABASE IF EXISTS {self._ident(name)}")
+        self._run(DROP_DATABASE.sql(db=name, on_cluster=self._on_cluster), ("drop_database", name))
 
     def update_user_password(self, username: str, password: str):
         if self.dry:
-            print(f"[CH][DRY] Update password for '{username}'")
+            self._dry(ALTER_USER.show(user=username, on_cluster=self._on_cluster, password=password))
             return
         print(f"[CH] Updating password for '{username}'")
-        c = self._client()
-        escaped_pwd = self._escape(password)
-        cluster = self.cfg.get("cluster")
-        if cluster:
-            c.execute(f"ALTER USER {self._ident(username)} ON CLUSTER {self._ident(cluster)} IDENTIFIED WITH plaintext_password BY '{escaped_pwd}'")
-        else:
-            c.execute(f"ALTER USER {self._ident(username)} IDENTIFIED WITH plaintext_password BY '{escaped_pwd}'")
-
-    def _ident(self, s: str) -> str:
-        return "`" + s.replace("`", "``") + "`"
-
-    def _escape(self, s: str) -> str:
-        # ClickHouse string escaping: \ -> \\ and ' -> \'
-        return s.replace("\\", "\\\\").replace("'", "\\'")
+        self._run(ALTER_USER.sql(user=username, on_cluster=self._on_cluster, password=password),
+                  ("update_user_password", username))
+
+    def grant_full_privileges_many(self, items: list) -> dict:
+        if self.dry:
+            for username, db_name in items:
+                self.grant_full_privileges(username, db_name)
+            return {}
+        by_user = {}
+        for i, (username, db_name) in enumerate(items):
+            by_user.setdefault(username, []).append((i, db_name))
+        failures = {}
+        for username, entries in by_user.items():
+            for _, db_name in entries:
+                print(f"[CH] Granting privileges on '{db_name}' to '{username}'")
+            targets = grant_targets([db_name for _, db_name in entries])
+            try:
+                self._run(GRANT.sql(on_cluster=self._on_cluster, targets=targets, user=username),
+                          ("grant_full_privileges", username))
+            except Exception as e:
+                for i, _ in entries:
+                    failures[i] = e
+        return failures
+
+    def _run(self, sql: str, key: tuple):
+        # DDL goes through the distributed queue when a cluster is configured. key is the
+        # (action, first argument) of the operation(s) the statement is sent for.
+        if self.cfg.get("cluster"):
+            return self._execute_ddl(sql, key)
+        return self._execute(sql)
+
+    def _dry(self, sql: str):
+        print(f"[CH][DRY] {sql}")
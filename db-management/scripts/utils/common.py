@@ -1,46 +1,84 @@
 from pathlib import Path
 import re
-import yaml
 
-def read_users_file(path: str) -> dict:
-    p = Path(path)
+def read_users_file(path: str, warn=print) -> dict:
     result = {}
-    if not p.exists():
-        return result
-    for raw in p.read_text(encoding="utf-8").splitlines():
-        line = raw.strip()
-        if not line or line.startswith("#"):
-            continue
-        if ":" not in line:
-            continue
-        username, password = line.split(":", 1)
-        u = username.strip()
-        pw = password.strip()
-        if not u or not pw:
-            continue
-        if not validate_password(pw):
-            continue
+    for u, pw in iter_users_file(path, warn=warn):
         result[u] = pw
     return result
 
+def iter_users_file(path: str, require_sorted: bool = False, warn=print):
+    # Yields validated (username, password) pairs one line at a time. Skipped lines are reported
+    # with their line number, never with the password. With `require_sorted` a repeated name is
+    # skipped and a name out of order raises ValueError.
+    p = Path(path)
+    if not p.exists():
+        return
+    previous = None
+    with p.open(encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, 1):
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            where = f"{p.name}:{lineno}"
+            if ":" not in line:
+                warn(f"[users] {where}: no ':' between user name and password, line skipped")
+                continue
+            username, password = line.split(":", 1)
+            u = username.strip()
+            pw = password.strip()
+            if not u or not pw:
+                warn(f"[users] {where}: empty user name or password, line skipped")
+                continue
+            if not validate_password(pw):
+                warn(f"[users] {where}: password of '{u}' does not meet the password policy, line skipped")
+                continue
+            if require_sorted and previous is not None:
+                if u == previous:
+                    warn(f"[users] {where}: duplicate user '{u}', line skipped")
+                    continue
+                if u < previous:
+                    raise ValueError(f"{where}: '{u}' comes after '{previous}'; --sorted-merge needs users sorted by name "
+                                     "in byte order (LC_ALL=C sort -t: -k1,1)")
+            previous = u
+            yield u, pw
+
+class UsersStream:
+    # Re-iterable, sorted view of a users file for --sorted-merge. Each iteration reads the file again,
+    # so engines synced concurrently each get their own pass and nothing is kept in memory.
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self):
+        # Order is verified in a first, silent pass: discovering a misordered line halfway through
+        # the merge would otherwise have already dropped the users that appear later in the file
+        for _ in iter_users_file(self.path, require_sorted=True, warn=lambda message: None):
+            pass
+        return iter_users_file(self.path, require_sorted=True)
+
+def load_users(path: str, streaming: bool = False):
+    return UsersStream(path) if streaming else read_users_file(path)
+
 def read_template_databases(path: str) -> list:
     p = Path(path)
     if not p.exists():
         return []
     items = []
-    for raw in p.read_text(encoding="utf-8").splitlines():
-        line = raw.strip()
-        if not line or line.startswith("#"):
-            continue
-        items.append(line)
+    with p.open(encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            items.append(line)
     return items
 
-def load_connections(config_dir: str, key: str) -> dict:
+def load_all_connections(config_dir: str) -> dict:
     config_path = Path(config_dir) / "connections.yaml"
     if not config_path.exists():
         return {}
-    data = yaml.safe_load(config_path.read_text(encoding="utf-8")) or {}
-    return data.get(key, {}) or {}
+    # Imported here: commands that never read connections.yaml do not pay for PyYAML
+    import yaml
+    return yaml.safe_load(config_path.read_text(encoding="utf-8")) or {}
 
 def validate_password(password: str) -> bool:
     if len(password) < 8:
@@ -52,10 +90,40 @@ def validate_password(password: str) -> bool:
     return True
 
 def extract_managed_users_from_dbnames(dbnames: list, templates: list) -> set:
-    users = set()
+    return set(build_managed_index(dbnames, templates))
+
+def build_managed_index(dbnames, templates: list, known_users=()) -> dict:
+    # Maps user -> {template: dbname} for every database named <user>_<template>.
+    # Each database is split only at its underscores and looked up in a template hash set, so the
+    # cost is linear in the number of databases rather than databases x templates.
+    # A database belongs to exactly one user: when several splits match (`dev` + `ops_web` vs
+    # `dev_ops` + `web`) a user from `known_users` wins, then the longest user name.
+    template_set = set(templates)
+    known = set(known_users)
+    index = {}
+    unmatched = []
     for db in dbnames:
-        for t in templates:
-            suffix = f"_{t}"
-            if db.endswith(suffix) and len(db) > len(suffix):
-                users.add(db[: -len(suffix)])
-    return users
+        best = None
+        for i in _underscores(db):
+            user, template = db[:i], db[i + 1:]
+            if template not in template_set:
+                continue
+            rank = (user in known, len(user))
+            if best is None or rank > best[0]:
+                best = (rank, user, template)
+        if best is None:
+            unmatched.append(db)
+        else:
+            index.setdefault(best[1], {})[best[2]] = db
+    # Databases of managed users whose template has since been removed from the template file.
+    # The longest managed user prefix owns them, so `dev` never claims `dev_ops_*`.
+    for db in unmatched:
+        for i in reversed(_underscores(db)):
+            if db[:i] in index:
+                index[db[:i]][db[i + 1:]] = db
+                break
+    return index
+
+def _underscores(name: str) -> list:
+    # Split points that leave a non-empty user and template
+    return [i for i, ch in enumerate(name) if ch == "_" and 0 < i < len(name) - 1]
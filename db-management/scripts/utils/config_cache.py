@@ -0,0 +1,126 @@
+import hashlib
+import marshal
+import os
+import sys
+import time
+from pathlib import Path
+from .common import load_all_connections, read_template_databases, read_users_file
+from .password_state import STATE_DIR
+
+# Parsed config files, kept in `config/.sync_state/config.cache` so unchanged files are not parsed again:
+# the validated users of users.txt (with the warnings about skipped lines, printed again on every load),
+# the template lists and connections.yaml. Each entry is keyed by the file's size, mtime and a hash
+# of its contents. A file whose size and mtime are unchanged is trusted without being read, unless it
+# was modified less than RACY_WINDOW seconds before it was cached (a second write within the same
+# mtime tick would go unnoticed); any other file is hashed and parsed again only when the hash differs.
+# The cache is written with marshal: it only ever holds dicts, lists and strings, and unlike pickle
+# loading it cannot run code. A cache that is missing, corrupt or from another Python version is rebuilt.
+
+CACHE_FILE = "config.cache"
+
+# Bumped whenever what a parser returns changes
+CACHE_VERSION = 1
+
+# Files modified this recently (seconds) before they were cached are hashed on every load
+RACY_WINDOW = 2.0
+
+class ConfigCache:
+    def __init__(self, config_dir: str, path: Path = None):
+        self.config_dir = Path(config_dir)
+        self.path = Path(path) if path is not None else None
+        self._entries = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.path.exists():
+            self._entries = _read(self.path)
+
+    @classmethod
+    def open(cls, config_dir: str, enabled: bool = True):
+        # Disabled (--no-config-cache): every file is parsed and nothing is written
+        path = Path(config_dir) / STATE_DIR / CACHE_FILE if enabled else None
+        return cls(config_dir, path)
+
+    def users(self, name: str = "users.txt") -> dict:
+        def parse(path):
+            warnings = []
+            return [read_users_file(str(path), warn=warnings.append), warnings]
+
+        users, warnings = self._load(name, parse, [{}, []])
+        for message in warnings:
+            print(message)
+        return users
+
+    def templates(self, name: str) -> list:
+        return self._load(name, lambda path: read_template_databases(str(path)), [])
+
+    def connections(self) -> dict:
+        return self._load("connections.yaml", lambda path: load_all_connections(str(path.parent)), {})
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        payload = marshal.dumps([_signature(), self._entries])
+        self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # A read-only config directory only costs the next run a parse
+            print(f"[config] Cache not written: {e}")
+
+    def _load(self, name: str, parse, missing):
+        path = self.config_dir / name
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            self._forget(name)
+            return missing
+        stat = [st.st_size, st.st_mtime_ns]
+        entry = self._entries.get(name)
+        if entry is not None and entry["stat"] == stat and not entry["racy"]:
+            self.hits += 1
+            return entry["value"]
+        digest = hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+        if entry is not None and entry["hash"] == digest:
+            # Touched but not changed
+            self.hits += 1
+            value = entry["value"]
+        else:
+            self.misses += 1
+            value = parse(path)
+        self._store(name, {"stat": stat, "hash": digest, "racy": time.time() - st.st_mtime < RACY_WINDOW,
+                           "value": value})
+        return value
+
+    def _store(self, name: str, entry: dict):
+        if self.path is None:
+            return
+        try:
+            marshal.dumps(entry["value"])
+        except ValueError:
+            # YAML can produce values marshal cannot hold (timestamps): that file is parsed every time
+            self._forget(name)
+            return
+        if self._entries.get(name) != entry:
+            self._entries[name] = entry
+            self._dirty = True
+
+    def _forget(self, name: str):
+        if self._entries.pop(name, None) is not None:
+            self._dirty = True
+
+def _signature() -> list:
+    # A cache is only read back by the Python version and cache format that wrote it
+    return [CACHE_VERSION, marshal.version, list(sys.version_info[:2])]
+
+def _read(path: Path) -> dict:
+    try:
+        signature, entries = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    return entries if signature == _signature() and isinstance(entries, dict) else {}
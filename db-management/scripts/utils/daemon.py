@@ -0,0 +1,262 @@
+import asyncio
+import copy
+import json
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .engines import ENGINES, create_handler, instrument, sync_engine, sync_engine_async, template_file
+from .metrics import prometheus_text, report_metrics
+from .options import SyncOptions
+from .password_state import PasswordState
+from .reconcile import SyncResult
+from .config_cache import ConfigCache
+from .targets import load_config, target_options
+from .watch import ConfigWatcher
+
+# --daemon: the process stays up with its handlers (and their connection pools) open, watches the
+# config directory and runs an incremental sync of the affected engines once changes have settled.
+# /healthz and /metrics report on the last sync of every target. Handlers, their configs and results
+# are keyed by (engine, target name).
+
+USERS_FILE = "users.txt"
+CONNECTIONS_FILE = "connections.yaml"
+
+class SyncDaemon:
+    def __init__(self, config_dir: str, engines: list, dry_run: bool, options: SyncOptions):
+        self.config_dir = config_dir
+        self.engines = list(engines)
+        self.dry_run = dry_run
+        # Every sync is incremental; --full and --resume (if given) apply to the first one only
+        self.options = copy.copy(options)
+        self.options.incremental = True
+        # Kept in memory between syncs: files the change did not touch are not read again
+        self.config_cache = ConfigCache.open(config_dir, options.config_cache)
+        self.handlers = {}
+        self.configs = {}
+        self.results = {}
+        self.error = None
+        self.syncs = 0
+        self.last_sync = None
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop() if options.use_async else None
+
+    def run(self) -> int:
+        names = {USERS_FILE, CONNECTIONS_FILE} | {template_file(e) for e in ENGINES}
+        watcher = ConfigWatcher(self.config_dir, names)
+        server = start_status_server(self.options.listen, self) if self.options.listen else None
+        signal.signal(signal.SIGTERM, _terminate)
+        print(f"[daemon] Watching {self.config_dir} ({watcher.mode})")
+        # With --full-every the daemon wakes up periodically so a due full sync is not postponed indefinitely
+        timeout = 60.0 if self.options.full_every else None
+        try:
+            self.sync(None)
+            while True:
+                changed = watcher.wait(timeout)
+                while changed:
+                    more = watcher.wait(self.options.debounce)
+                    if not more:
+                        break
+                    changed |= more
+                self.sync(changed or None)
+        except (KeyboardInterrupt, SystemExit):
+            print("[daemon] Stopping")
+        finally:
+            watcher.close()
+            if server is not None:
+                server.shutdown()
+            self.close()
+        return 0
+
+    def sync(self, changed):
+        # changed is None for a sync of every engine (startup, periodic wakeup), otherwise the changed file names
+        if changed:
+            print(f"[daemon] Changed: {', '.join(sorted(changed))}")
+        try:
+            users, targets = load_config(self.config_dir, self.engines, self.options, self.config_cache)
+        except Exception as e:
+            # A half-written or invalid config is reported and the previous state kept until the next change
+            print(f"[daemon] Config not loaded: {e}")
+            with self._lock:
+                self.error = str(e)
+            return
+        # A warm handler is replaced only when its target's connections.yaml entry changed or went away
+        configs = {(engine, cfg["name"]): cfg for engine, cfg, _ in targets}
+        for key in list(self.handlers):
+            if self.configs.get(key) != configs.get(key):
+                self._close_handler(key)
+        jobs = [job for job in targets
+                if changed is None or changed & {USERS_FILE, CONNECTIONS_FILE, template_file(job[0])}]
+        if self._loop is not None:
+            results = self._loop.run_until_complete(self._sync_all_async(jobs, users))
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), self.options.parallel_targets))) as ex:
+                results = list(ex.map(lambda job: self._sync_one(*job, users), jobs))
+        for result in results:
+            status = "ok" if result.ok else (f"failed: {result.failure}" if result.failure else "errors")
+            print(f"[daemon] {result.engine} {result.target}: +{result.added} ~{result.updated} -{result.removed}, "
+                  f"{result.operations} op(s), {result.errors} error(s) in {result.elapsed:.2f}s, {status}")
+        report_metrics(results, self.options)
+        self.options.full = False
+        self.options.resume = False
+        with self._lock:
+            self.error = None
+            self.syncs += 1
+            self.last_sync = time.time()
+            for key in [k for k in self.results if k not in configs]:
+                del self.results[key]
+            for result in results:
+                self.results[(result.engine, result.target)] = result
+
+    def _handler(self, engine: str, cfg: dict):
+        key = (engine, cfg["name"])
+        handler = self.handlers.get(key)
+        if handler is not None:
+            return handler
+        # Instrumented once: the metrics served on /metrics accumulate over the daemon's lifetime
+        handler = instrument(create_handler(engine, cfg, self.dry_run, use_async=self._loop is not None), self.options)
+        self.handlers[key] = handler
+        self.configs[key] = cfg
+        return handler
+
+    def _sync_one(self, engine: str, cfg: dict, templates: list, users) -> SyncResult:
+        try:
+            state = PasswordState.open(self.config_dir, engine, cfg)
+            result = sync_engine(self._handler(engine, cfg), users, templates, state, target_options(self.options, cfg),
+                                 keep_open=True)
+        except Exception as e:
+            print(f"Error syncing {engine} target '{cfg['name']}': {e}")
+            # Its connections may be what failed: start over with a fresh handler next time
+            self._close_handler((engine, cfg["name"]))
+            result = SyncResult(engine)
+            result.failure = str(e)
+        result.engine = engine
+        result.target = cfg["name"]
+        return result
+
+    async def _sync_all_async(self, jobs: list, users) -> list:
+        limit = asyncio.Semaphore(self.options.parallel_targets)
+
+        async def bounded(job):
+            async with limit:
+                return await self._sync_one_async(*job, users)
+
+        return list(await asyncio.gather(*(bounded(job) for job in jobs)))
+
+    async def _sync_one_async(self, engine: str, cfg: dict, templates: list, users) -> SyncResult:
+        try:
+            state = PasswordState.open(self.config_dir, engine, cfg)
+            result = await sync_engine_async(self._handler(engine, cfg), users, templates, state,
+                                             target_options(self.options, cfg), keep_open=True)
+        except Exception as e:
+            print(f"Error syncing {engine} target '{cfg['name']}': {e}")
+            await self._close_handler_async((engine, cfg["name"]))
+            result = SyncResult(engine)
+            result.failure = str(e)
+        result.engine = engine
+        result.target = cfg["name"]
+        return result
+
+    def _close_handler(self, key: tuple):
+        handler = self.handlers.pop(key, None)
+        self.configs.pop(key, None)
+        if handler is None:
+            return
+        try:
+            if self._loop is not None:
+                self._loop.run_until_complete(handler.close())
+            else:
+                handler.close()
+        except Exception as e:
+            print(f"[daemon] Closing {key[0]} '{key[1]}' connections failed: {e}")
+
+    async def _close_handler_async(self, key: tuple):
+        handler = self.handlers.pop(key, None)
+        self.configs.pop(key, None)
+        if handler is not None:
+            try:
+                await handler.close()
+            except Exception as e:
+                print(f"[daemon] Closing {key[0]} '{key[1]}' connections failed: {e}")
+
+    def close(self):
+        for key in list(self.handlers):
+            self._close_handler(key)
+        if self._loop is not None:
+            self._loop.close()
+
+    def health(self) -> tuple:
+        # (healthy, report): healthy once every target's last sync succeeded and the config loaded
+        with self._lock:
+            targets = {
+                f"{engine}/{target}": {
+                    "engine": engine,
+                    "ok": r.ok,
+                    "added": r.added,
+                    "updated": r.updated,
+                    "removed": r.removed,
+                    "operations": r.operations,
+                    "errors": r.errors,
+                    "failure": r.failure,
+                    "elapsed_seconds": round(r.elapsed, 6),
+                }
+                for (engine, target), r in sorted(self.results.items())
+            }
+            healthy = self.syncs > 0 and self.error is None and all(t["ok"] for t in targets.values())
+            report = {
+                "status": "ok" if healthy else ("starting" if not self.syncs else "degraded"),
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "syncs": self.syncs,
+                "last_sync": self.last_sync,
+                "config_error": self.error,
+                "targets": targets,
+            }
+        return healthy, report
+
+    def metrics_text(self) -> str:
+        with self._lock:
+            results = [self.results[key] for key in sorted(self.results)]
+            finished = self.last_sync
+        metrics = [r.metrics for r in results if r.metrics is not None]
+        return prometheus_text(metrics, results, finished)
+
+def run_daemon(config_dir: str, engines: list, dry_run: bool, options: SyncOptions) -> int:
+    if options.plan_only:
+        raise SystemExit("--daemon cannot be combined with --plan")
+    return SyncDaemon(config_dir, engines, dry_run, options).run()
+
+def start_status_server(listen: str, daemon: SyncDaemon) -> ThreadingHTTPServer:
+    host, _, port = listen.rpartition(":")
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/healthz":
+                healthy, report = daemon.health()
+                self._reply(200 if healthy else 503, "application/json", json.dumps(report, indent=1) + "\n")
+            elif path == "/metrics":
+                self._reply(200, "text/plain; version=0.0.4", daemon.metrics_text())
+            else:
+                self._reply(404, "text/plain", "not found\n")
+
+        def _reply(self, status: int, content_type: str, body: str):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="status-server", daemon=True).start()
+    print(f"[daemon] Serving /healthz and /metrics on http://{host or '127.0.0.1'}:{port}")
+    return server
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
@@ -0,0 +1,96 @@
+import importlib
+import time
+from .estimate import LatencyHistory
+from .metrics import InstrumentedHandler, Metrics
+from .options import SyncOptions
+from .reconcile import reconcile
+from .resilience import Resilience
+
+# engine name -> (handler module, handler class, template file)
+ENGINES = {
+    "mysql": ("mysql_handler", "MySQLHandler", "mysql_databases.txt"),
+    "postgresql": ("postgresql_handler", "PostgreSQLHandler", "postgresql_databases.txt"),
+    "clickhouse": ("clickhouse_handler", "ClickHouseHandler", "clickhouse_databases.txt"),
+    "mongodb": ("mongodb_handler", "MongoDBHandler", "mongodb_databases.txt"),
+}
+
+# engine name -> (handler module, handler class) of the asyncio variant used with --async
+ASYNC_HANDLERS = {
+    "mysql": ("async_mysql_handler", "AsyncMySQLHandler"),
+    "postgresql": ("async_postgresql_handler", "AsyncPostgreSQLHandler"),
+    "clickhouse": ("async_clickhouse_handler", "AsyncClickHouseHandler"),
+    "mongodb": ("async_mongodb_handler", "AsyncMongoDBHandler"),
+}
+
+def create_handler(engine: str, cfg: dict, dry_run: bool = False, use_async: bool = False):
+    module_name, class_name = ASYNC_HANDLERS[engine] if use_async else ENGINES[engine][:2]
+    module = importlib.import_module(f".{module_name}", __package__)
+    return getattr(module, class_name)(cfg, dry_run)
+
+def template_file(engine: str) -> str:
+    return ENGINES[engine][2]
+
+def engine_of(handler) -> str:
+    class_name = type(handler).__name__
+    for engine in ENGINES:
+        if class_name in (ENGINES[engine][1], ASYNC_HANDLERS[engine][1]):
+            return engine
+    return handler.label
+
+def sync_engine(handler, users: dict, templates: list, state=None, options: SyncOptions = None,
+                keep_open: bool = False):
+    # keep_open leaves the handler's connections in its pool for the next sync (--daemon)
+    options = options or SyncOptions()
+    started = time.monotonic()
+    handler = instrument(handler, options)
+    try:
+        result = reconcile(handler, users, templates, state, options)
+    finally:
+        if not keep_open:
+            handler.close()
+        _after_sync(handler, state)
+    return _finish_result(result, handler.metrics, started, state)
+
+async def sync_engine_async(handler, users: dict, templates: list, state=None, options: SyncOptions = None,
+                            keep_open: bool = False):
+    # Same as sync_engine for the asyncio handlers; runs inside the caller's event loop
+    from .async_reconcile import reconcile_async
+    options = options or SyncOptions()
+    started = time.monotonic()
+    handler = instrument(handler, options)
+    try:
+        result = await reconcile_async(handler, users, templates, state, options)
+    finally:
+        if not keep_open:
+            await handler.close()
+        _after_sync(handler, state)
+    return _finish_result(result, handler.metrics, started, state)
+
+def instrument(handler, options: SyncOptions) -> InstrumentedHandler:
+    # A handler kept across syncs is instrumented once, so its metrics accumulate from one sync to the next
+    if isinstance(handler, InstrumentedHandler):
+        return handler
+    engine = engine_of(handler)
+    target = (getattr(handler, "cfg", None) or {}).get("name", "")
+    resilience = Resilience(engine, options.retries, f"{handler.label} {target}".strip())
+    return InstrumentedHandler(handler, Metrics(engine, options.profile, target), resilience)
+
+def _after_sync(handler, state):
+    if state is not None and not handler.dry:
+        state.save()
+        # Latencies of real runs are what --dry-run and --plan estimate from
+        history = LatencyHistory.beside(state)
+        if history is not None:
+            history.update(handler.metrics)
+            history.save()
+    stats = handler.connection_stats()
+    print(f"[{handler.label}] Connections opened: {stats['opened']}, reused: {stats['reused']}")
+
+def _finish_result(result, metrics: Metrics, started: float, state=None):
+    result.engine = metrics.engine
+    result.target = metrics.target or None
+    result.metrics = metrics
+    result.elapsed = time.monotonic() - started
+    if result.estimate is not None:
+        result.estimate.report(LatencyHistory.beside(state))
+    return result
@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+# Cost estimate printed by --dry-run and --plan: the planned operations are grouped into handler calls
+# exactly as the phased executor would send them, each call is charged its round-trips (handler
+# `round_trips`, one per call by default) and the mean latency that call had over previous real runs.
+# Those latencies are kept per target next to the password state in `<target>.latency.json`.
+
+# Observations kept per operation: older runs fade out once this many calls have been recorded
+HISTORY_CALLS = 1000
+
+class LatencyHistory:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._means = {}
+        if self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            self._means = {name: (float(e["seconds"]), int(e["calls"])) for name, e in data.items()}
+
+    @classmethod
+    def beside(cls, state):
+        # History of the target of a PasswordState; None for callers without a state file
+        path = getattr(state, "path", None)
+        return cls(path.with_name(path.stem + ".latency.json")) if path is not None else None
+
+    def mean(self, operation: str):
+        with self._lock:
+            entry = self._means.get(operation)
+        return entry[0] if entry else None
+
+    def update(self, metrics):
+        # Folds the latencies of a finished run into the running means
+        with self._lock:
+            for name, stats in metrics.summary():
+                h = stats.latency
+                if not h.count:
+                    continue
+                mean, calls = self._means.get(name, (0.0, 0))
+                calls = min(calls, HISTORY_CALLS)
+                self._means[name] = ((mean * calls + h.total) / (calls + h.count), min(calls + h.count, HISTORY_CALLS))
+
+    def save(self):
+        with self._lock:
+            data = {name: {"seconds": round(mean, 6), "calls": calls} for name, (mean, calls) in sorted(self._means.items())}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+class CostEstimate:
+    # Calls and round-trips per handler method, accumulated chunk by chunk as plans are built
+    def __init__(self, handler, options, phases: tuple):
+        self.label = handler.label
+        self.options = options
+        self.phases = phases
+        self.batch_methods = getattr(handler, "batch_methods", None) if options.batch_size > 1 else None
+        self.round_trips = getattr(handler, "round_trips", {})
+        self.discovery = None
+        # method -> [operations, calls, round-trips]
+        self.methods = {}
+
+    def add(self, plans: list):
+        for action in self.phases:
+            pending = [(plan, op) for plan in plans for op in plan.ops if op.action == action]
+            if not pending:
+                continue
+            method = self.batch_methods.get(action) if self.batch_methods else None
+            if method:
+                size = self.options.batch_size
+                for i in range(0, len(pending), size):
+                    self._charge(method, pending[i:i + size])
+            else:
+                for item in pending:
+                    self._charge(action, [item])
+
+    def _charge(self, method: str, items: list):
+        per_call, per_item, per_user = self.round_trips.get(method, (1, 0, 0))
+        users = len({plan.username for plan, _ in items}) if per_user else 0
+        entry = self.methods.setdefault(method, [0, 0, 0])
+        entry[0] += len(items)
+        entry[1] += 1
+        entry[2] += per_call + per_item * len(items) + per_user * users
+
+    def report(self, history: LatencyHistory = None):
+        parallel = self.options.concurrency if self.options.use_async else self.options.workers
+        prefix = f"[{self.label}][ESTIMATE]"
+        if self.discovery is not None:
+            print(f"{prefix} discovery took {self.discovery:.2f}s")
+        total_ops = total_round_trips = 0
+        total_seconds = 0.0
+        missing = []
+        for method in sorted(self.methods, key=_phase_order(self.phases, self.batch_methods)):
+            ops, calls, round_trips = self.methods[method]
+            mean = history.mean(method) if history is not None else None
+            if mean is None:
+                missing.append(method)
+                wall = "no recorded latency"
+            else:
+                # Calls of one method run `parallel` at a time
+                seconds = math.ceil(calls / parallel) * mean
+                total_seconds += seconds
+                wall = f"~{seconds:.2f}s ({mean * 1000:.1f} ms/call)"
+            print(f"{prefix} {method:<28}{ops:>8} op(s){calls:>8} call(s){round_trips:>9} round-trip(s)  {wall}")
+            total_ops += ops
+            total_round_trips += round_trips
+        workers = f"{parallel} {'task(s) in flight' if self.options.use_async else 'worker(s)'}"
+        line = f"{prefix} total {total_ops} op(s), {total_round_trips} round-trip(s), ~{total_seconds:.2f}s with {workers}"
+        if missing:
+            line += f"; no recorded latency for {', '.join(missing)} (run once without --dry-run to record it)"
+        print(line)
+
+def _phase_order(phases: tuple, batch_methods: dict):
+    order = {action: i for i, action in enumerate(phases)}
+    for action, method in (batch_methods or {}).items():
+        order[method] = order[action]
+    return lambda method: (order.get(method, len(order)), method)
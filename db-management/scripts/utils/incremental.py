@@ -0,0 +1,41 @@
+import hashlib
+
+# --incremental: instead of planning the whole fleet, reconcile only the users whose users.txt line
+# changed since it was last applied (new user or new password), users that disappeared from the
+# file, and users whose previous reconcile failed. The per-user salted password hashes in the
+# state file are the line fingerprints; a changed template list, --full or --full-every forces a full pass.
+
+def templates_fingerprint(templates: list) -> str:
+    return hashlib.sha256("\n".join(sorted(templates)).encode("utf-8")).hexdigest()
+
+def sync_scope(users, templates: list, state, options, label: str):
+    # Returns (scope, removed): scope is None for a full sync, otherwise the set of user names to
+    # reconcile (possibly empty). removed are known users that are no longer in users.txt.
+    pairs = users.items() if isinstance(users, dict) else users
+    remaining = state.known_users()
+    if not options.incremental or options.full:
+        for username, _ in pairs:
+            remaining.discard(username)
+        return None, remaining
+    reason = state.full_sync_reason(templates_fingerprint(templates), options.full_every)
+    if reason:
+        print(f"[{label}] Incremental: full sync ({reason})")
+        for username, _ in pairs:
+            remaining.discard(username)
+        return None, remaining
+    scope = state.pending_users()
+    for username, password in pairs:
+        remaining.discard(username)
+        if not state.matches(username, password):
+            scope.add(username)
+    scope |= remaining
+    print(f"[{label}] Incremental: {len(scope)} user(s) changed since the last sync")
+    return scope, remaining
+
+def settle_state(state, templates: list, scope, removed: set, result):
+    # Users that left users.txt and were cleaned up no longer need a password hash, even when
+    # there was no account left to drop (drop_user forgets the others itself)
+    failed = result.failed_users
+    for username in removed - failed:
+        state.forget(username)
+    state.finish_run(scope, failed, templates_fingerprint(templates))
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from .incremental import templates_fingerprint
+from .planner import Operation, UserPlan
+
+# Operation journal of a real sync, kept per target next to the password state in `<target>.journal`.
+# It is a JSON-lines file: a header describing the run, the operations of every plan chunk before
+# they run, and one line per confirmed operation. Plan lines are fsync'd before anything is executed,
+# confirmations are written as they happen and fsync'd at least every SYNC_INTERVAL seconds.
+# A run that reaches the end deletes its journal; --resume replays the rest of an interrupted one
+# without discovery. Passwords are never written: they are looked up in users.txt again, and a
+# salted fingerprint of users.txt and the templates makes sure they are still the ones the plan was made from.
+
+# Longest time a confirmed operation stays in the page cache only
+SYNC_INTERVAL = 0.1
+
+# action -> position of the argument that is left out of the journal (the password)
+SECRET_ARGS = {"create_user": 1, "update_user_password": 1}
+
+class Resume:
+    # What is left of an interrupted run: plans of the remaining operations, whether every chunk of the
+    # run had been planned (otherwise a regular sync has to follow), and the bookkeeping for settle_state
+    def __init__(self, plans: list, complete: bool, scope, removed: set):
+        self.plans = plans
+        self.complete = complete
+        self.scope = scope
+        self.removed = removed
+
+class Journal:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._fd = None
+        self._synced = 0.0
+
+    @classmethod
+    def for_run(cls, handler, state, options):
+        # Only real runs with a state file are journaled
+        path = getattr(state, "path", None)
+        if path is None or handler.dry or options.plan_only:
+            return None
+        return cls(path.with_name(path.stem + ".journal"))
+
+    def begin(self, users, templates: list, scope, label: str):
+        if self.path.exists():
+            print(f"[{label}] Discarding the journal of an interrupted sync (use --resume to continue it)")
+        salt = secrets.token_bytes(16)
+        header = {
+            "run": time.time(),
+            "salt": salt.hex(),
+            "desired": desired_fingerprint(users, templates, salt),
+            "scope": sorted(scope) if scope is not None else None,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+        self._append(header, sync=True)
+
+    def plan(self, plans: list, last: bool):
+        # last marks the final chunk: from then on the journal holds every operation of the run
+        entry = {"plan": [[p.username, p.kind, [op_entry(op) for op in p.ops]] for p in plans]}
+        if last:
+            entry["last"] = True
+        self._append(entry, sync=True)
+
+    def done(self, op: Operation):
+        self._append({"done": op_key(op)}, sync=False)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+    def finish(self):
+        # The run got to the end (failed operations included, those are retried by state): nothing to resume
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def resume(self, users, templates: list, state, label: str):
+        # Resume of the journaled run, or None (with the reason printed) when there is nothing to resume
+        entries = self._read()
+        if not entries or "salt" not in entries[0]:
+            print(f"[{label}] Resume: no interrupted sync journaled, running a regular sync")
+            return None
+        header = entries[0]
+        pairs = sorted(users.items()) if isinstance(users, dict) else users
+        digest = _hasher(bytes.fromhex(header["salt"]), templates)
+        names, passwords = set(), {}
+        needed = {username for e in entries for username, _, ops in e.get("plan", ())
+                  if any(action in SECRET_ARGS for action, *_ in ops)}
+        for username, password in pairs:
+            digest.update(f"{username}\0{password}\n".encode("utf-8"))
+            names.add(username)
+            if username in needed:
+                passwords[username] = password
+        if digest.hexdigest() != header["desired"]:
+            print(f"[{label}] Resume: users.txt or the templates changed since the interrupted sync, running a regular sync")
+            self.path.unlink(missing_ok=True)
+            return None
+        done = {tuple(e["done"]) for e in entries if "done" in e}
+        plans = []
+        for chunk in (e["plan"] for e in entries if "plan" in e):
+            for username, kind, ops in chunk:
+                plan = UserPlan(username, kind)
+                for action, scope, *args in ops:
+                    if (action, *args) in done:
+                        continue
+                    if action in SECRET_ARGS:
+                        args.insert(SECRET_ARGS[action], passwords[username])
+                    plan.add(action, *args, scope=scope)
+                if plan.ops:
+                    plans.append(plan)
+        complete = fully_planned(entries)
+        print(f"[{label}] Resume: {len(done)} operation(s) already confirmed, "
+              f"{sum(len(p.ops) for p in plans)} left for {len(plans)} user(s)"
+              + ("" if complete else "; the interrupted sync was not fully planned, a regular sync follows"))
+        scope = set(header["scope"]) if header["scope"] is not None else None
+        return Resume(plans, complete, scope, state.known_users() - names)
+
+    def reopen(self):
+        # Confirmations of a resumed run are appended to the journal it resumes
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def _append(self, entry: dict, sync: bool):
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._fd is None:
+                return
+            os.write(self._fd, line)
+            now = time.monotonic()
+            if sync or now - self._synced >= SYNC_INTERVAL:
+                os.fsync(self._fd)
+                self._synced = now
+
+    def _read(self) -> list:
+        if not self.path.exists():
+            return []
+        entries = []
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # The last line of a killed run may be cut short
+                    break
+        return entries
+
+def fully_planned(entries: list) -> bool:
+    return any(e.get("last") for e in entries)
+
+def op_entry(op: Operation) -> list:
+    # [action, scope, arguments without the password]
+    return [op.action, op.scope, *op_key(op)[1:]]
+
+def op_key(op: Operation) -> list:
+    args = list(op.args)
+    if op.action in SECRET_ARGS:
+        del args[SECRET_ARGS[op.action]]
+    return [op.action, *args]
+
+def desired_fingerprint(users, templates: list, salt: bytes) -> str:
+    pairs = sorted(users.items()) if isinstance(users, dict) else users
+    digest = _hasher(salt, templates)
+    for username, password in pairs:
+        digest.update(f"{username}\0{password}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _hasher(salt: bytes, templates: list):
+    digest = hashlib.blake2b(key=salt, person=b"db-sync-journal")
+    digest.update(templates_fingerprint(templates).encode("ascii") + b"\n")
+    return digest
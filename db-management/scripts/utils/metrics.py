@@ -0,0 +1,332 @@
+import heapq
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from .resilience import CircuitOpenError, UNRETRIED
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# inspect.CO_COROUTINE
+CO_COROUTINE = 0x80
+
+# Bookkeeping methods that are not worth timing
+UNTIMED = {"connection_stats"}
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation (the maximum for the +Inf bucket)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+class OperationStats:
+    __slots__ = ("latency", "errors", "retries")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.retries = 0
+
+class Metrics:
+    # Per-target latency histograms and error/retry counters, keyed by handler method name.
+    # Batch methods are recorded under their own name (one observation per batch).
+    def __init__(self, engine: str, keep_slowest: int = 0, target: str = ""):
+        self.engine = engine
+        self.target = target
+        self.keep_slowest = keep_slowest
+        self.operations = {}
+        self.slowest = []
+        self._lock = threading.Lock()
+
+    def _stats(self, operation: str) -> OperationStats:
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        return stats
+
+    def observe(self, operation: str, seconds: float, ok: bool = True, detail: str = ""):
+        with self._lock:
+            stats = self._stats(operation)
+            stats.latency.observe(seconds)
+            if not ok:
+                stats.errors += 1
+            if self.keep_slowest:
+                entry = (seconds, operation, detail)
+                if len(self.slowest) < self.keep_slowest:
+                    heapq.heappush(self.slowest, entry)
+                elif seconds > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+    def retry(self, operation: str, count: int = 1):
+        with self._lock:
+            self._stats(operation).retries += count
+
+    def error(self, operation: str, count: int = 1):
+        # Items reported as failed by a batch method that itself returned normally
+        with self._lock:
+            self._stats(operation).errors += count
+
+    def summary(self) -> list:
+        with self._lock:
+            return [(name, self.operations[name]) for name in sorted(self.operations)]
+
+class InstrumentedHandler:
+    # Transparent proxy around a handler: every public method call is timed and recorded,
+    # everything else (label, dry, pool, batch_methods, ...) is passed through untouched.
+    # With a Resilience, calls that fail transiently are retried (each attempt is recorded) and
+    # short-circuited while the target's circuit is open.
+    def __init__(self, handler, metrics: Metrics, resilience=None):
+        self._handler = handler
+        self.metrics = metrics
+        self.resilience = resilience
+        # Connection setup is recorded as its own operation
+        pool = getattr(handler, "pool", None)
+        if pool is not None:
+            pool.factory = self._timed("connect", pool.factory)
+
+    def __getattr__(self, name):
+        value = getattr(self._handler, name)
+        if name.startswith("_") or name in UNTIMED or not callable(value):
+            return value
+        return self._timed(name, value)
+
+    def _timed(self, name: str, fn):
+        metrics = self.metrics
+        # Connection setup is retried as part of the call that needed the connection
+        resilience = self.resilience if name not in UNRETRIED and name != "connect" else None
+        # Batch methods return {index: exception} for the items that failed; the transient ones are
+        # sent again on their own, so a lost connection halfway through a batch is retried like any call
+        batch = name in set((getattr(self._handler, "batch_methods", None) or {}).values())
+
+        if _is_coroutine_function(fn):
+            import asyncio
+
+            async def call_async(*args, **kwargs):
+                steps = _attempts(name, metrics, resilience, batch, args)
+                try:
+                    kind, value = next(steps)
+                    while True:
+                        if kind is SLEEP:
+                            await asyncio.sleep(value)
+                            kind, value = next(steps)
+                            continue
+                        try:
+                            result = await fn(*value, **kwargs)
+                        except Exception as e:
+                            kind, value = steps.throw(e)
+                        else:
+                            kind, value = steps.send(result)
+                except StopIteration as done:
+                    return done.value
+            return call_async
+
+        def call(*args, **kwargs):
+            steps = _attempts(name, metrics, resilience, batch, args)
+            try:
+                kind, value = next(steps)
+                while True:
+                    if kind is SLEEP:
+                        time.sleep(value)
+                        kind, value = next(steps)
+                        continue
+                    try:
+                        result = fn(*value, **kwargs)
+                    except Exception as e:
+                        kind, value = steps.throw(e)
+                    else:
+                        kind, value = steps.send(result)
+            except StopIteration as done:
+                return done.value
+        return call
+
+# What _attempts asks its caller for: a call of the wrapped method, or a pause before the next attempt
+CALL = "call"
+SLEEP = "sleep"
+
+def _attempts(name: str, metrics: Metrics, resilience, batch: bool, args: tuple):
+    # Retry state machine of one instrumented call, driven by both the sync and the asyncio wrapper.
+    # Yields (CALL, args) for every attempt, with the method's result sent back or its exception thrown
+    # in, and (SLEEP, seconds) between attempts; returns what the call returns.
+    attempt = 0
+    # Positions (in the original batch) of the items sent again, and the failures so far
+    pending, failures = None, {}
+    while True:
+        if resilience is not None:
+            try:
+                resilience.breaker.before()
+            except CircuitOpenError as e:
+                if pending is None:
+                    raise
+                return _merge_failures(failures, pending, dict.fromkeys(range(len(pending)), e))
+        call_args = args if pending is None else ([args[0][i] for i in pending],) + args[1:]
+        started = time.perf_counter()
+        try:
+            value = yield CALL, call_args
+        except Exception as e:
+            metrics.observe(name, time.perf_counter() - started, False, _describe(call_args))
+            if resilience is None or not resilience.should_retry(e, attempt):
+                if pending is None:
+                    raise
+                return _merge_failures(failures, pending, dict.fromkeys(range(len(pending)), e))
+            metrics.retry(name)
+        else:
+            metrics.observe(name, time.perf_counter() - started, True, _describe(call_args))
+            if resilience is None:
+                return value
+            if not batch:
+                resilience.breaker.success()
+                return value
+            failures = _merge_failures(failures, pending, value or {})
+            pending = resilience.retry_items(failures, attempt)
+            if not pending:
+                return failures
+            metrics.retry(name, len(pending))
+        yield SLEEP, resilience.delay(attempt)
+        attempt += 1
+
+def _merge_failures(failures: dict, pending: list, latest: dict) -> dict:
+    # latest is indexed by position among the items sent; pending maps those back to the original
+    # batch (None: the whole batch was sent). Items that were not sent again keep their failure.
+    if pending is None:
+        return dict(latest)
+    sent = set(pending)
+    merged = {i: e for i, e in failures.items() if i not in sent}
+    merged.update({pending[j]: e for j, e in latest.items()})
+    return merged
+
+def _is_coroutine_function(fn) -> bool:
+    # inspect.iscoroutinefunction without importing inspect (and, through it, most of the AST
+    # machinery) on the startup path; handler methods are plain bound functions
+    code = getattr(getattr(fn, "__func__", fn), "__code__", None)
+    return code is not None and bool(code.co_flags & CO_COROUTINE)
+
+def _describe(args: tuple) -> str:
+    # Never includes passwords: only the first argument (a user or database name) or the batch size
+    if not args:
+        return ""
+    first = args[0]
+    if isinstance(first, list):
+        return f"{len(first)} item(s)"
+    return str(first) if isinstance(first, str) else ""
+
+def report_metrics(results: list, options):
+    # Called once at the end of a run with the results of every target that was synced
+    metrics = [r.metrics for r in results if getattr(r, "metrics", None) is not None]
+    if not metrics:
+        return
+    if options.profile:
+        print_profile(metrics, options.profile)
+    if options.metrics_json:
+        write_json_lines(options.metrics_json, metrics)
+    if options.metrics_prom:
+        write_prometheus(options.metrics_prom, metrics, results)
+
+def print_profile(metrics: list, limit: int):
+    # Operations are listed per engine, or per engine/target once several targets were synced
+    by_target = len({(m.engine, m.target) for m in metrics}) > len({m.engine for m in metrics})
+    names = {id(m): f"{m.engine}/{m.target}" if by_target else m.engine for m in metrics}
+    width = max([len(n) for n in names.values()] + [10]) + 2
+    slowest = sorted((e + (names[id(m)],) for m in metrics for e in m.slowest), reverse=True)[:limit]
+    print()
+    print(f"Slowest {len(slowest)} operation(s):")
+    for seconds, operation, detail, name in slowest:
+        print(f"  {seconds * 1000:>10.1f} ms  {name:<{width}}{operation}" + (f" '{detail}'" if detail else ""))
+    print()
+    print(f"{'Target' if by_target else 'Engine':<{width}}{'Operation':<28}{'Count':>7}{'Errors':>8}{'Retries':>9}{'p50 ms':>9}{'p95 ms':>9}{'Max ms':>9}{'Total s':>9}")
+    for m in metrics:
+        for name, stats in m.summary():
+            h = stats.latency
+            print(f"{names[id(m)]:<{width}}{name:<28}{h.count:>7}{stats.errors:>8}{stats.retries:>9}"
+                  f"{h.quantile(0.5) * 1000:>9.1f}{h.quantile(0.95) * 1000:>9.1f}{h.max * 1000:>9.1f}{h.total:>9.2f}")
+
+def write_json_lines(path: str, metrics: list):
+    # Appends one line per (target, operation) so successive runs accumulate in the same file
+    now = time.time()
+    with open(path, "a", encoding="utf-8") as f:
+        for m in metrics:
+            for name, stats in m.summary():
+                h = stats.latency
+                f.write(json.dumps({
+                    "ts": now,
+                    "engine": m.engine,
+                    "target": m.target,
+                    "operation": name,
+                    "count": h.count,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "sum_seconds": round(h.total, 6),
+                    "max_seconds": round(h.max, 6),
+                    "p50_seconds": h.quantile(0.5),
+                    "p95_seconds": h.quantile(0.95),
+                    "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.counts)),
+                }) + "\n")
+
+def write_prometheus(path: str, metrics: list, results: list):
+    # node_exporter textfile format; written to a temporary file and renamed so the collector never reads a partial file
+    target = Path(path)
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_text(prometheus_text(metrics, results), encoding="utf-8")
+    os.replace(tmp, target)
+
+def prometheus_text(metrics: list, results: list, finished: float = None) -> str:
+    # Prometheus exposition format, shared by --metrics-prom and the --daemon /metrics endpoint
+    lines = [
+        "# HELP db_sync_operation_duration_seconds Latency of handler operations.",
+        "# TYPE db_sync_operation_duration_seconds histogram",
+    ]
+    for m in metrics:
+        for name, stats in m.summary():
+            labels = f'engine="{m.engine}",target="{m.target}",operation="{name}"'
+            cumulative = 0
+            for bound, n in zip([str(b) for b in BUCKETS] + ["+Inf"], stats.latency.counts):
+                cumulative += n
+                lines.append(f'db_sync_operation_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"db_sync_operation_duration_seconds_sum{{{labels}}} {stats.latency.total:.6f}")
+            lines.append(f"db_sync_operation_duration_seconds_count{{{labels}}} {stats.latency.count}")
+    for metric, attr, help_text in (
+        ("db_sync_operation_errors_total", "errors", "Handler operations that raised."),
+        ("db_sync_operation_retries_total", "retries", "Calls retried after a transient error, and operations retried one by one after a failed batch."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for m in metrics:
+            for name, stats in m.summary():
+                lines.append(f'{metric}{{engine="{m.engine}",target="{m.target}",operation="{name}"}} {getattr(stats, attr)}')
+    lines.append("# HELP db_sync_run_duration_seconds Wall time of the last sync per target.")
+    lines.append("# TYPE db_sync_run_duration_seconds gauge")
+    for r in results:
+        lines.append(f'db_sync_run_duration_seconds{{engine="{r.engine}",target="{r.target or ""}"}} {r.elapsed:.6f}')
+    lines.append("# HELP db_sync_run_errors Errors reported by the last sync per target.")
+    lines.append("# TYPE db_sync_run_errors gauge")
+    for r in results:
+        lines.append(f'db_sync_run_errors{{engine="{r.engine}",target="{r.target or ""}"}} {r.errors + (1 if r.failure else 0)}')
+    lines.append("# HELP db_sync_last_run_timestamp_seconds Unix time the last sync finished.")
+    lines.append("# TYPE db_sync_last_run_timestamp_seconds gauge")
+    lines.append(f"db_sync_last_run_timestamp_seconds {finished or time.time():.0f}")
+    return "\n".join(lines) + "\n"
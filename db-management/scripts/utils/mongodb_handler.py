@@ -1,11 +1,56 @@
 import importlib
+from collections import defaultdict
+from .pool import ConnectionPool
+from .snapshot import Snapshot
+
+# Databases of one batch materialized at the same time; each needs its own `create` command
+CREATE_CONCURRENCY = 8
+
+def snapshot_from_users_info(info: dict, databases: list) -> Snapshot:
+    users, grants = set(), {}
+    for u in info.get("users", []):
+        users.add(u["user"])
+        grants[u["user"]] = {r.get("db") for r in u.get("roles", []) if r.get("role") == "readWrite"}
+    return Snapshot(users, databases, grants)
+
+def grants_by_user(items: list) -> dict:
+    # username -> [(index, role document)] for a batch of (username, db_name) grants
+    by_user = defaultdict(list)
+    for i, (username, db_name) in enumerate(items):
+        by_user[username].append((i, {"role": "readWrite", "db": db_name}))
+    return by_user
 
 class MongoDBHandler:
+    label = "Mongo"
+    # Grants are additive grantRolesToUser commands, one per user per batch, so the user's role list is
+    # never read and rewritten; databases of a batch are materialized concurrently
+    batch_methods = {
+        "create_database": "create_databases",
+        "grant_full_privileges": "grant_full_privileges_many",
+    }
+    # (per call, per item, per user) round-trips for --dry-run estimates; one per call otherwise
+    round_trips = {
+        "create_databases": (0, 1, 0),
+        "grant_full_privileges_many": (0, 0, 1),
+    }
+
     def __init__(self, cfg: dict, dry_run: bool = False):
         self.cfg = cfg
         self.dry = dry_run
+        # MongoClient is thread-safe and pools sockets internally; one client serves the whole sync
+        self.pool = ConnectionPool(self._connect, shared=True)
 
     def _client(self):
+        with self.pool.connection() as c:
+            return c
+
+    def close(self):
+        self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
+    def _connect(self, _key=None):
         MongoClient = importlib.import_module("pymongo").MongoClient
         host = self.cfg.get("host", "localhost")
         port = int(self.cfg.get("port", 27017))
@@ -19,8 +64,6 @@ class MongoDBHandler:
         return MongoClient(uri)
 
     def get_existing_users(self) -> set:
-        if self.dry:
-            return set()
         c = self._client()
         admin = c[self.cfg.get("auth_source", "admin")]
         info = admin.command("usersInfo")
@@ -28,11 +71,16 @@ class MongoDBHandler:
         return users
 
     def get_existing_databases(self) -> list:
-        if self.dry:
-            return []
         c = self._client()
         return c.list_database_names()
 
+    def snapshot(self) -> Snapshot:
+        c = self._client()
+        admin = c[self.cfg.get("auth_source", "admin")]
+        info = admin.command("usersInfo")
+        databases = c.list_database_names()
+        return snapshot_from_users_info(info, databases)
+
     def create_user(self, username: str, password: str):
         if self.dry:
             print(f"[Mongo][DRY] Create user '{username}'")
@@ -53,7 +101,7 @@ class MongoDBHandler:
                  else:
                       raise e
 
-    def create_database(self, name: str):
+    def create_database(self, name: str, owner: str = None):
         if self.dry:
             print(f"[Mongo][DRY] Create database '{name}'")
             return
@@ -61,8 +109,13 @@ class MongoDBHandler:
         c = self._client()
         db = c[name]
         # MongoDB creates databases lazily. We must create a collection to make it persist.
-        if "init_marker" not in db.list_collection_names():
-            db.create_collection("init_marker")
+        # Whether the database exists is known from the snapshot, so skip the listCollections probe
+        # and treat NamespaceExists (48) as success.
+        try:
+            db.create_collection("init_marker", check_exists=False)
+        except Exception as e:
+            if getattr(e, "code", None) != 48:
+                raise
 
     def grant_full_privileges(self, username: str, db_name: str):
         if self.dry:
@@ -71,11 +124,40 @@ class MongoDBHandler:
         print(f"[Mongo] Granting privileges on '{db_name}' to '{username}'")
         c = self._client()
         admin = c[self.cfg.get("auth_source", "admin")]
-        info = admin.command("usersInfo", username)
-        roles = info.get("users", [{}])[0].get("roles", [])
-        if not any(r.get("db") == db_name and r.get("role") == "readWrite" for r in roles):
-            roles.append({"role": "readWrite", "db": db_name})
-            admin.command("updateUser", username, roles=roles)
+        # Granting a role the user already holds is a no-op, so no usersInfo read is needed first
+        admin.command("grantRolesToUser", username, roles=[{"role": "readWrite", "db": db_name}])
+
+    def create_databases(self, items: list) -> dict:
+        if self.dry:
+            for args in items:
+                self.create_database(*args)
+            return {}
+        from concurrent.futures import ThreadPoolExecutor
+        failures = {}
+        with ThreadPoolExecutor(max_workers=min(len(items), CREATE_CONCURRENCY)) as ex:
+            futures = [ex.submit(self.create_database, *args) for args in items]
+        for i, future in enumerate(futures):
+            if future.exception() is not None:
+                failures[i] = future.exception()
+        return failures
+
+    def grant_full_privileges_many(self, items: list) -> dict:
+        # One grantRolesToUser per user with every database of the batch, however many templates there are
+        if self.dry:
+            for username, db_name in items:
+                self.grant_full_privileges(username, db_name)
+            return {}
+        admin = self._client()[self.cfg.get("auth_source", "admin")]
+        failures = {}
+        for username, entries in grants_by_user(items).items():
+            for _, role in entries:
+                print(f"[Mongo] Granting privileges on '{role['db']}' to '{username}'")
+            try:
+                admin.command("grantRolesToUser", username, roles=[role for _, role in entries])
+            except Exception as e:
+                for i, _ in entries:
+                    failures[i] = e
+        return failures
 
     def drop_user(self, username: str):
         if self.dry:
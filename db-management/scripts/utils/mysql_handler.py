@@ -1,12 +1,62 @@
-from pathlib import Path
+import importlib
+from .pool import ConnectionPool
+from .snapshot import Snapshot
+from .statements import MYSQL, join_bound
+
+# Discovery queries, shared with the asyncio handler
+USERS_SQL = "SELECT User FROM mysql.user"
+DATABASES_SQL = "SHOW DATABASES"
+# Schema-level grants of every account at '%'
+DB_GRANTS_SQL = "SELECT * FROM mysql.db WHERE Host = '%'"
+
+# Statement templates, also shared with the asyncio handler. Every account lives at host '%'.
+CREATE_USER = MYSQL.statement("CREATE USER IF NOT EXISTS {user}@'%' IDENTIFIED BY {password!v}")
+ALTER_USER = MYSQL.statement("ALTER USER {user}@'%' IDENTIFIED BY {password!v}")
+DROP_USER = MYSQL.statement("DROP USER IF EXISTS {user}@'%'")
+CREATE_DATABASE = MYSQL.statement("CREATE DATABASE IF NOT EXISTS {db}")
+DROP_DATABASE = MYSQL.statement("DROP DATABASE IF EXISTS {db}")
+GRANT_ALL = MYSQL.statement("GRANT ALL PRIVILEGES ON {db}.* TO {user}@'%'")
+# CREATE/ALTER/DROP USER take a list of accounts: the batch methods send one statement for all of them
+ACCOUNT = MYSQL.statement("{user}@'%'")
+ACCOUNT_SPEC = MYSQL.statement("{user}@'%' IDENTIFIED BY {password!v}")
+
+def accounts_statement(prefix: str, items: list) -> tuple:
+    # (sql, params) of "<prefix> `a`@'%' IDENTIFIED BY %s, `b`@'%' ..." for (username, password) items
+    sql, params = join_bound([ACCOUNT_SPEC.bind(user=u, password=p) for u, p in items], ", ")
+    return f"{prefix} {sql}", params
+
+def grants_from_rows(columns: list, rows) -> dict:
+    # ALL PRIVILEGES sets every *_priv column except Grant_priv
+    privs = [i for i, c in enumerate(columns) if c.endswith("_priv") and c != "Grant_priv"]
+    db_col, user_col = columns.index("Db"), columns.index("User")
+    grants = {}
+    for row in rows:
+        if all(row[i] == "Y" for i in privs):
+            grants.setdefault(row[user_col], set()).add(row[db_col].replace("\\_", "_"))
+    return grants
 
 class MySQLHandler:
+    label = "MySQL"
+    # Batched variants used by the phased reconcile mode. Account-management statements
+    # (CREATE/ALTER/DROP USER, GRANT) update the grant tables in memory themselves, so
+    # none of these paths needs FLUSH PRIVILEGES.
+    batch_methods = {
+        "create_user": "create_users",
+        "update_user_password": "update_user_passwords",
+        "create_database": "create_databases",
+        "grant_full_privileges": "grant_full_privileges_many",
+        "drop_database": "drop_databases",
+        "drop_user": "drop_users",
+    }
+
     def __init__(self, cfg: dict, dry_run: bool = False):
         self.cfg = cfg
         self.dry = dry_run
+        self.pool = ConnectionPool(self._connect, alive=lambda conn: conn.open)
 
-    def _conn(self):
-        import pymysql
+    def _connect(self, _key=None):
+        pymysql = importlib.import_module("pymysql")
+        CLIENT = importlib.import_module("pymysql.constants").CLIENT
         return pymysql.connect(
             host=self.cfg.get("host", "localhost"),
             port=int(self.cfg.get("port", 3306)),
@@ -14,93 +64,153 @@ class MySQLHandler:
             password=self.cfg.get("admin_password", ""),
             ssl=self.cfg.get("ssl", False) or None,
             autocommit=True,
+            # Lets the batch methods send many DDL statements in one round-trip
+            client_flag=CLIENT.MULTI_STATEMENTS,
         )
 
+    def _conn(self):
+        return self.pool.connection()
+
+    def close(self):
+        self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
     def get_existing_users(self) -> set:
-        if self.dry:
-            return set()
         with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT User FROM mysql.user")
                 return {row[0] for row in cur.fetchall()}
 
     def get_existing_databases(self) -> list:
-        if self.dry:
-            return []
         with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SHOW DATABASES")
                 return [row[0] for row in cur.fetchall()]
 
+    def snapshot(self) -> Snapshot:
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(USERS_SQL)
+                users = {row[0] for row in cur.fetchall()}
+                cur.execute(DATABASES_SQL)
+                databases = [row[0] for row in cur.fetchall()]
+                cur.execute(DB_GRANTS_SQL)
+                grants = grants_from_rows([d[0] for d in cur.description], cur.fetchall())
+        return Snapshot(users, databases, grants)
+
     def create_user(self, username: str, password: str):
         if self.dry:
-            print(f"[MySQL][DRY] Create user '{username}'")
+            self._dry(CREATE_USER.show(user=username, password=password))
             return
         print(f"[MySQL] Creating user '{username}'")
-        with self._conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"CREATE USER IF NOT EXISTS `{username}`@'%%' IDENTIFIED BY %s", (password,))
-                cur.execute("FLUSH PRIVILEGES")
+        self._execute(*CREATE_USER.bind(user=username, password=password))
 
-    def create_database(self, name: str):
+    def create_database(self, name: str, owner: str = None):
         if self.dry:
-            print(f"[MySQL][DRY] Create database '{name}'")
+            self._dry(CREATE_DATABASE.show(db=name))
             return
         print(f"[MySQL] Creating database '{name}'")
-        with self._conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+        self._execute(CREATE_DATABASE.sql(db=name))
 
     def grant_full_privileges(self, username: str, db_name: str):
         if self.dry:
-            print(f"[MySQL][DRY] Grant privileges on '{db_name}' to '{username}'")
+            self._dry(GRANT_ALL.show(db=db_name, user=username))
             return
         print(f"[MySQL] Granting privileges on '{db_name}' to '{username}'")
-        with self._conn() as conn:
-            with conn.cursor() as cur:
-                # Use %% for wildcard to ensure PyMySQL handles it correctly even if no args
-                # Although theoretically no args = no formatting, safe bet is %% if we suspect issues
-                # But let's try strict % first with print
-                sql = f"GRANT ALL PRIVILEGES ON `{db_name}`.* TO `{username}`@'%%'"
-                # We pass empty tuple to force escaping check, or just rely on text
-                # Let's assume we need to escape % to %% if PyMySQL thinks it's a format string
-                # If we use execute(sql), PyMySQL sends as is.
-                # If we use execute(sql, ()), PyMySQL formats.
-                # Let's try sending as is but verify content.
-                
-                # REVISION: To be safe, let's use parameter substitution for user/host if possible? 
-                # No, identifiers can't be parameters.
-                
-                # Let's revert to using %% and passing an empty tuple to force formatting, 
-                # which guarantees % is sent as %
-                cur.execute(f"GRANT ALL PRIVILEGES ON `{db_name}`.* TO `{username}`@'%%'", ())
-                cur.execute("FLUSH PRIVILEGES")
+        # No values to bind: the statement goes out as is, host '%' included
+        self._execute(GRANT_ALL.sql(db=db_name, user=username))
 
     def drop_user(self, username: str):
         if self.dry:
-            print(f"[MySQL][DRY] Drop user '{username}'")
+            self._dry(DROP_USER.show(user=username))
             return
         print(f"[MySQL] Dropping user '{username}'")
-        with self._conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"DROP USER IF EXISTS `{username}`@'%'")
-                cur.execute("FLUSH PRIVILEGES")
+        self._execute(DROP_USER.sql(user=username))
 
     def drop_database(self, name: str):
         if self.dry:
-            print(f"[MySQL][DRY] Drop database '{name}'")
+            self._dry(DROP_DATABASE.show(db=name))
             return
         print(f"[MySQL] Dropping database '{name}'")
-        with self._conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"DROP DATABASE IF EXISTS `{name}`")
+        self._execute(DROP_DATABASE.sql(db=name))
 
     def update_user_password(self, username: str, password: str):
         if self.dry:
-            print(f"[MySQL][DRY] Update password for '{username}'")
+            self._dry(ALTER_USER.show(user=username, password=password))
             return
         print(f"[MySQL] Updating password for '{username}'")
+        self._execute(*ALTER_USER.bind(user=username, password=password))
+
+    def create_users(self, items: list):
+        if self.dry:
+            for username, password in items:
+                self.create_user(username, password)
+            return
+        for username, _ in items:
+            print(f"[MySQL] Creating user '{username}'")
+        self._execute(*accounts_statement("CREATE USER IF NOT EXISTS", items))
+
+    def update_user_passwords(self, items: list):
+        if self.dry:
+            for username, password in items:
+                self.update_user_password(username, password)
+            return
+        for username, _ in items:
+            print(f"[MySQL] Updating password for '{username}'")
+        self._execute(*accounts_statement("ALTER USER", items))
+
+    def create_databases(self, items: list):
+        if self.dry:
+            for args in items:
+                self.create_database(*args)
+            return
+        for args in items:
+            print(f"[MySQL] Creating database '{args[0]}'")
+        self._execute_all([CREATE_DATABASE.sql(db=args[0]) for args in items])
+
+    def grant_full_privileges_many(self, items: list):
+        if self.dry:
+            for username, db_name in items:
+                self.grant_full_privileges(username, db_name)
+            return
+        for username, db_name in items:
+            print(f"[MySQL] Granting privileges on '{db_name}' to '{username}'")
+        self._execute_all([GRANT_ALL.sql(db=d, user=u) for u, d in items])
+
+    def drop_databases(self, items: list):
+        if self.dry:
+            for (name,) in items:
+                self.drop_database(name)
+            return
+        for (name,) in items:
+            print(f"[MySQL] Dropping database '{name}'")
+        self._execute_all([DROP_DATABASE.sql(db=name) for (name,) in items])
+
+    def drop_users(self, items: list):
+        if self.dry:
+            for (username,) in items:
+                self.drop_user(username)
+            return
+        for (username,) in items:
+            print(f"[MySQL] Dropping user '{username}'")
+        self._execute("DROP USER IF EXISTS " + ", ".join(ACCOUNT.sql(user=u) for (u,) in items))
+
+    def _execute(self, sql: str, params: tuple = None):
+        # pymysql only %-formats the statement when params is not None
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+
+    def _execute_all(self, statements: list):
+        # One multi-statement round-trip; an error surfaces while draining the result sets
+        # and stops the remaining statements, which the caller then retries one by one.
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"ALTER USER `{username}`@'%%' IDENTIFIED BY %s", (password,))
-                cur.execute("FLUSH PRIVILEGES")
+                cur.execute(";\n".join(statements))
+                while cur.nextset():
+                    pass
+
+    def _dry(self, sql: str):
+        print(f"[MySQL][DRY] {sql}")
@@ -0,0 +1,81 @@
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_LISTEN = "127.0.0.1:9187"
+DEFAULT_PARALLEL_TARGETS = 8
+DEFAULT_RETRIES = 3
+
+class SyncOptions:
+    def __init__(self, workers: int = 1, plan_only: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                 profile: int = 0, metrics_json: str = None, metrics_prom: str = None,
+                 use_async: bool = False, concurrency: int = DEFAULT_CONCURRENCY, sorted_merge: bool = False,
+                 incremental: bool = False, full: bool = False, full_every: float = 0,
+                 daemon: bool = False, debounce: float = DEFAULT_DEBOUNCE, listen: str = DEFAULT_LISTEN,
+                 parallel_targets: int = DEFAULT_PARALLEL_TARGETS, resume: bool = False,
+                 retries: int = DEFAULT_RETRIES, config_cache: bool = True):
+        self.workers = max(1, workers)
+        self.plan_only = plan_only
+        self.batch_size = max(1, batch_size)
+        self.profile = max(0, profile)
+        self.metrics_json = metrics_json
+        self.metrics_prom = metrics_prom
+        self.use_async = use_async
+        self.concurrency = max(1, concurrency)
+        self.sorted_merge = sorted_merge
+        self.incremental = incremental
+        self.full = full
+        self.full_every = max(0.0, full_every)
+        self.daemon = daemon
+        self.debounce = max(0.0, debounce)
+        self.listen = listen
+        self.parallel_targets = max(1, parallel_targets)
+        self.resume = resume
+        self.retries = max(0, retries)
+        self.config_cache = config_cache
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(workers=args.workers, plan_only=args.plan, batch_size=args.batch_size,
+                   profile=args.profile, metrics_json=args.metrics_json, metrics_prom=args.metrics_prom,
+                   use_async=args.use_async, concurrency=args.concurrency, sorted_merge=args.sorted_merge,
+                   incremental=args.incremental, full=args.full, full_every=args.full_every,
+                   daemon=args.daemon, debounce=args.debounce, listen=args.listen,
+                   parallel_targets=args.parallel_targets, resume=args.resume,
+                   retries=args.retries, config_cache=args.config_cache)
+
+def add_sync_arguments(ap):
+    ap.add_argument("--config", required=True)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--workers", type=int, default=1, help="Number of users (or batches) reconciled in parallel")
+    ap.add_argument("--plan", action="store_true", help="Print the operations a sync would run, then exit")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                    help="Operations sent together on engines that support batching (1 disables batching)")
+    ap.add_argument("--profile", type=int, default=0, metavar="N",
+                    help="Print the N slowest operations and per-operation latency statistics")
+    ap.add_argument("--metrics-json", metavar="FILE", help="Append per-operation metrics as JSON lines to FILE")
+    ap.add_argument("--metrics-prom", metavar="FILE", help="Write metrics in Prometheus textfile format to FILE")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="Use the asyncio drivers (aiomysql, asyncpg, aiohttp, motor) on one event loop")
+    ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                    help="With --async: operations in flight per engine")
+    ap.add_argument("--sorted-merge", action="store_true",
+                    help="Stream users.txt (sorted by user name) and reconcile it in chunks instead of loading it whole")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Reconcile only users changed since the last sync (plus previous failures)")
+    ap.add_argument("--full", action="store_true", help="With --incremental: reconcile every user this time")
+    ap.add_argument("--full-every", type=float, default=0, metavar="HOURS",
+                    help="With --incremental: run a full sync when the last one is older than HOURS")
+    ap.add_argument("--resume", action="store_true",
+                    help="Finish an interrupted sync from its journal: confirmed operations are skipped, nothing is rediscovered")
+    ap.add_argument("--daemon", action="store_true",
+                    help="Keep running: watch the config directory and reconcile incrementally on every change")
+    ap.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE, metavar="SECONDS",
+                    help="With --daemon: wait until the config has been quiet this long before syncing")
+    ap.add_argument("--listen", default=DEFAULT_LISTEN, metavar="HOST:PORT",
+                    help="With --daemon: address of the /healthz and /metrics endpoint (empty to disable)")
+    ap.add_argument("--retries", type=int, default=DEFAULT_RETRIES, metavar="N",
+                    help="Retries of a handler call that failed with a transient error (lost connection, failover, timeout)")
+    ap.add_argument("--no-config-cache", dest="config_cache", action="store_false",
+                    help="Parse connections.yaml, users.txt and the template files even when they are unchanged")
+    ap.add_argument("--parallel-targets", type=int, default=DEFAULT_PARALLEL_TARGETS, metavar="N",
+                    help="Targets (servers listed in connections.yaml) reconciled at the same time")
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from pathlib import Path
+
+STATE_DIR = ".sync_state"
+
+class PasswordState:
+    # Remembers a salted hash of the password last applied to each user on one target,
+    # so unchanged users are not re-altered on every run.
+    # Only hashes are stored; users.txt next to it already holds the plaintext.
+    # For --incremental it also keeps a fingerprint of the templates of the last full sync,
+    # when that was, and the users whose last reconcile failed.
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._templates = None
+        self._last_full = None
+        self._pending = set()
+        self._dirty = False
+        if self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            self._hashes = data.get("passwords", {}) or {}
+            self._templates = data.get("templates")
+            self._last_full = data.get("last_full")
+            self._pending = set(data.get("pending", []))
+
+    @classmethod
+    def open(cls, config_dir: str, engine: str, cfg: dict):
+        return cls(Path(config_dir) / STATE_DIR / f"{target_id(engine, cfg)}.json")
+
+    def matches(self, username: str, password: str) -> bool:
+        with self._lock:
+            stored = self._hashes.get(username)
+        if not stored or "$" not in stored:
+            return False
+        salt, digest = stored.split("$", 1)
+        return secrets.compare_digest(_hash(password, bytes.fromhex(salt)), digest)
+
+    def record(self, username: str, password: str):
+        salt = secrets.token_bytes(16)
+        with self._lock:
+            self._hashes[username] = f"{salt.hex()}${_hash(password, salt)}"
+            self._dirty = True
+
+    def forget(self, username: str):
+        with self._lock:
+            if self._hashes.pop(username, None) is not None:
+                self._dirty = True
+
+    def known_users(self) -> set:
+        with self._lock:
+            return set(self._hashes)
+
+    def pending_users(self) -> set:
+        with self._lock:
+            return set(self._pending)
+
+    def full_sync_reason(self, templates_fingerprint: str, full_every_hours: float = 0) -> str:
+        # Why an incremental run has to reconcile everything, or "" when a delta is enough
+        if self._last_full is None or self._templates is None:
+            return "no previous full sync recorded"
+        if self._templates != templates_fingerprint:
+            return "template list changed"
+        if full_every_hours and time.time() - self._last_full >= full_every_hours * 3600:
+            return f"last full sync is older than {full_every_hours:g}h"
+        return ""
+
+    def finish_run(self, scope, failed: set, templates_fingerprint: str = None):
+        # scope is None after a full sync: only this run's failures are left to retry
+        with self._lock:
+            if scope is None:
+                self._pending = set(failed)
+                self._templates = templates_fingerprint
+                self._last_full = time.time()
+            else:
+                self._pending = (self._pending - set(scope)) | set(failed)
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({
+                "passwords": self._hashes,
+                "templates": self._templates,
+                "last_full": self._last_full,
+                "pending": sorted(self._pending),
+            }, indent=1, sort_keys=True)
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+def target_id(engine: str, cfg: dict) -> str:
+    raw = f"{engine}_{cfg.get('host', 'localhost')}_{cfg.get('port', '')}"
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", raw)
+
+def _hash(password: str, salt: bytes) -> str:
+    return hashlib.blake2b(password.encode("utf-8"), salt=salt, person=b"db-sync-passwd").hexdigest()
@@ -0,0 +1,141 @@
+from .common import build_managed_index
+
+# How each handler action is shown in plans and error messages; arguments after
+# the ones referenced here (passwords) are never printed.
+LABELS = {
+    "create_user": "create user '{0}'",
+    "update_user_password": "update password for '{0}'",
+    "create_database": "create database '{0}'",
+    "set_database_owner": "set owner of '{0}' to '{1}'",
+    "grant_full_privileges": "grant privileges on '{1}' to '{0}'",
+    "drop_database": "drop database '{0}'",
+    "drop_user": "drop user '{0}'",
+}
+
+class Operation:
+    # One handler call. Operations sharing a scope (a database name) depend on each other:
+    # when one fails the rest of that scope is skipped. A failed operation without a scope
+    # (user-level) aborts the remainder of the user's plan.
+    __slots__ = ("action", "args", "scope")
+
+    def __init__(self, action: str, *args, scope: str = None):
+        self.action = action
+        self.args = args
+        self.scope = scope
+
+    def apply(self, handler):
+        return getattr(handler, self.action)(*self.args)
+
+    def __str__(self):
+        return LABELS[self.action].format(*self.args)
+
+class UserPlan:
+    def __init__(self, username: str, kind: str):
+        self.username = username
+        self.kind = kind
+        self.ops = []
+
+    def add(self, action: str, *args, scope: str = None):
+        self.ops.append(Operation(action, *args, scope=scope))
+
+def build_plan(users: dict, templates: list, snapshot, state) -> list:
+    desired = set(users.keys())
+    # user -> {template: dbname}, built once and used for every ownership decision below
+    index = build_managed_index(snapshot.databases, templates, desired)
+    managed_users = set(index)
+    template_set = set(templates)
+    plans = []
+    for username in sorted(desired - managed_users):
+        plans.append(_add_plan(username, users[username], templates, snapshot, state))
+    for username in sorted(desired & managed_users):
+        plans.append(_update_plan(username, users[username], templates, template_set, index, snapshot, state))
+    for username in sorted(managed_users - desired):
+        plans.append(_remove_plan(username, index, snapshot))
+    return plans
+
+def iter_merged_plans(users, templates: list, snapshot, state):
+    # Sorted-merge variant of build_plan: walks a users stream sorted by name alongside the sorted
+    # managed users found on the server and yields one plan per user, so neither the desired users
+    # nor the full plan are ever held in memory. Without the full desired set, ambiguous database
+    # names are attributed using the accounts that exist on the server.
+    index = build_managed_index(snapshot.databases, templates, snapshot.users)
+    template_set = set(templates)
+    managed = iter(sorted(index))
+    pending = next(managed, None)
+    for username, password in users:
+        while pending is not None and pending < username:
+            yield _remove_plan(pending, index, snapshot)
+            pending = next(managed, None)
+        if pending == username:
+            yield _update_plan(username, password, templates, template_set, index, snapshot, state)
+            pending = next(managed, None)
+        else:
+            yield _add_plan(username, password, templates, snapshot, state)
+    while pending is not None:
+        yield _remove_plan(pending, index, snapshot)
+        pending = next(managed, None)
+
+def _add_plan(username: str, password: str, templates: list, snapshot, state) -> UserPlan:
+    plan = UserPlan(username, "add")
+    if username in snapshot.users:
+        # The account exists without any managed database yet (e.g. an interrupted run)
+        if not state.matches(username, password):
+            plan.add("update_user_password", username, password)
+    else:
+        plan.add("create_user", username, password)
+    _plan_databases(plan, templates, snapshot)
+    return plan
+
+def _update_plan(username: str, password: str, templates: list, template_set: set, index: dict, snapshot, state) -> UserPlan:
+    plan = UserPlan(username, "update")
+    if username not in snapshot.users:
+        # The account was dropped outside the sync and its databases kept: whatever the password
+        # state says, there is nothing to ALTER or GRANT to until it exists again
+        plan.add("create_user", username, password)
+    elif not state.matches(username, password):
+        # Only send the ALTER when the password differs from the one we last applied
+        plan.add("update_user_password", username, password)
+    _plan_databases(plan, templates, snapshot)
+
+    # Remove databases whose template is NO LONGER required
+    for t, dbn in sorted(index[username].items()):
+        if t not in template_set:
+            plan.add("drop_database", dbn, scope=dbn)
+    return plan
+
+def _remove_plan(username: str, index: dict, snapshot) -> UserPlan:
+    plan = UserPlan(username, "remove")
+    # Every database the user owns, including ones from removed templates, so the role can be dropped
+    for dbn in sorted(index[username].values()):
+        plan.add("drop_database", dbn, scope=dbn)
+    if username in snapshot.users:
+        plan.add("drop_user", username)
+    return plan
+
+def _plan_databases(plan: UserPlan, templates: list, snapshot):
+    username = plan.username
+    for t in templates:
+        dbn = f"{username}_{t}"
+        if dbn not in snapshot.databases:
+            plan.add("create_database", dbn, username, scope=dbn)
+        elif dbn in snapshot.owners and snapshot.owners[dbn] != username:
+            plan.add("set_database_owner", dbn, username, scope=dbn)
+        # Missing databases never carry grants; existing ones need the grant present and PUBLIC locked out
+        if not snapshot.has_grant(username, dbn) or dbn in snapshot.public_access:
+            plan.add("grant_full_privileges", username, dbn, scope=dbn)
+
+def print_plan(label: str, plans: list, summary: bool = True):
+    total = 0
+    for plan in plans:
+        if not plan.ops:
+            continue
+        print(f"[{label}][PLAN] {plan.kind} '{plan.username}'")
+        for op in plan.ops:
+            print(f"[{label}][PLAN]   {op}")
+        total += len(plan.ops)
+    if summary:
+        print_plan_summary(label, total, sum(1 for p in plans if p.ops))
+    return total
+
+def print_plan_summary(label: str, operations: int, users: int):
+    print(f"[{label}][PLAN] {operations} operation(s) for {users} user(s)")
@@ -0,0 +1,101 @@
+import threading
+from contextlib import contextmanager
+
+class ConnectionPool:
+    # Keeps admin connections alive for the whole sync instead of opening one per statement.
+    # Connections are keyed (e.g. by database name for PostgreSQL) and checked out exclusively,
+    # unless `shared` is set for clients that are already thread-safe pools themselves (MongoClient).
+    def __init__(self, factory, close=None, alive=None, shared: bool = False, max_idle: int = 32):
+        self.factory = factory
+        self._close = close or (lambda conn: conn.close())
+        self._alive = alive or (lambda conn: True)
+        self.shared = shared
+        self.max_idle = max_idle
+        self._idle = []
+        self._shared = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @contextmanager
+    def connection(self, key=None):
+        conn = self._checkout(key)
+        try:
+            yield conn
+        finally:
+            if not self.shared:
+                self._release(key, conn)
+
+    def _checkout(self, key):
+        with self._lock:
+            if self.shared:
+                conn = self._shared.get(key)
+                if conn is not None:
+                    self.reused += 1
+                    return conn
+            else:
+                for i in range(len(self._idle) - 1, -1, -1):
+                    k, conn = self._idle[i]
+                    if k != key:
+                        continue
+                    del self._idle[i]
+                    if self._alive(conn):
+                        self.reused += 1
+                        return conn
+                    self.discarded += 1
+                    self._safe_close(conn)
+                    break
+        conn = self.factory(key)
+        with self._lock:
+            self.opened += 1
+            if self.shared:
+                # Another thread may have raced us to open the shared client
+                existing = self._shared.get(key)
+                if existing is not None:
+                    self._safe_close(conn)
+                    return existing
+                self._shared[key] = conn
+        return conn
+
+    def _release(self, key, conn):
+        if not self._alive(conn):
+            with self._lock:
+                self.discarded += 1
+            self._safe_close(conn)
+            return
+        evicted = None
+        with self._lock:
+            self._idle.append((key, conn))
+            if len(self._idle) > self.max_idle:
+                evicted = self._idle.pop(0)[1]
+        if evicted is not None:
+            self._safe_close(evicted)
+
+    def discard(self, key=None):
+        # Drops every cached connection for `key`, e.g. after the database it points to was dropped
+        with self._lock:
+            dropped = [c for k, c in self._idle if k == key]
+            self._idle = [(k, c) for k, c in self._idle if k != key]
+            if key in self._shared:
+                dropped.append(self._shared.pop(key))
+        for conn in dropped:
+            self._safe_close(conn)
+
+    def close(self):
+        with self._lock:
+            conns = [c for _, c in self._idle] + list(self._shared.values())
+            self._idle = []
+            self._shared = {}
+        for conn in conns:
+            self._safe_close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"opened": self.opened, "reused": self.reused, "discarded": self.discarded}
+
+    def _safe_close(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
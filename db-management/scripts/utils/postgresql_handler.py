@@ -1,11 +1,107 @@
 import importlib
+import threading
+import time
+from .pool import ConnectionPool
+from .snapshot import Snapshot
+from .statements import POSTGRESQL, join_bound
+
+# Discovery queries, shared with the asyncio handler
+ROLES_SQL = "SELECT rolname FROM pg_roles"
+# One row per (database, grantee); grantee 0 is PUBLIC. A NULL datacl means default
+# privileges, i.e. PUBLIC can still connect and nobody holds an explicit grant.
+DATABASE_ACL_SQL = """
+    SELECT d.datname, pg_get_userbyid(d.datdba), d.datacl IS NULL,
+           a.grantee, r.rolname, count(a.privilege_type)
+    FROM pg_database d
+    LEFT JOIN LATERAL aclexplode(d.datacl) a ON true
+    LEFT JOIN pg_roles r ON r.oid = a.grantee
+    WHERE NOT d.datistemplate
+    GROUP BY d.datname, d.datdba, d.datacl IS NULL, a.grantee, r.rolname
+"""
+
+# Run inside every managed database (one round-trip): nobody but the grantee may create objects in public.
+# This runs BEFORE the database-level ACL: the planner treats a locked-down database ACL as proof
+# that the schema step is done too, so a failure here must leave the database ACL untouched.
+SCHEMA_ACL = POSTGRESQL.statement("REVOKE CREATE ON SCHEMA public FROM PUBLIC; GRANT ALL ON SCHEMA public TO {user}")
+# Applied once to the optional `template_database`: databases copied from it leave the public schema to
+# their owner (pg_database_owner, PostgreSQL 14+) and closed to PUBLIC, so they need no SCHEMA_ACL session
+TEMPLATE_SCHEMA_SQL = "REVOKE CREATE ON SCHEMA public FROM PUBLIC; ALTER SCHEMA public OWNER TO pg_database_owner"
+
+# Statement templates, also shared with the asyncio handler. CREATE/ALTER ROLE are utility statements:
+# psycopg2 binds the password client-side, asyncpg gets it inlined as a literal (see statements.py).
+CREATE_ROLE = POSTGRESQL.statement("CREATE ROLE {user} LOGIN PASSWORD {password!v}")
+ALTER_ROLE_PASSWORD = POSTGRESQL.statement("ALTER ROLE {user} WITH PASSWORD {password!v}")
+DROP_ROLE = POSTGRESQL.statement("DROP ROLE IF EXISTS {user}")
+CREATE_DATABASE = POSTGRESQL.statement("CREATE DATABASE {db} OWNER {owner}")
+CREATE_DATABASE_FROM = POSTGRESQL.statement("CREATE DATABASE {db} OWNER {owner} TEMPLATE {template}")
+CREATE_TEMPLATE = POSTGRESQL.statement("CREATE DATABASE {db}")
+MARK_TEMPLATE = POSTGRESQL.statement("ALTER DATABASE {db} WITH IS_TEMPLATE true")
+SET_OWNER = POSTGRESQL.statement("ALTER DATABASE {db} OWNER TO {owner}")
+DATABASE_ACL = POSTGRESQL.statement(
+    "REVOKE ALL PRIVILEGES ON DATABASE {db} FROM PUBLIC; GRANT ALL PRIVILEGES ON DATABASE {db} TO {user}")
+CLOSE_DATABASE = POSTGRESQL.statement("ALTER DATABASE {db} WITH ALLOW_CONNECTIONS false")
+OPEN_DATABASE = POSTGRESQL.statement("ALTER DATABASE {db} WITH ALLOW_CONNECTIONS true")
+DROP_DATABASE = POSTGRESQL.statement("DROP DATABASE IF EXISTS {db}")
+DROP_DATABASE_FORCE = POSTGRESQL.statement("DROP DATABASE IF EXISTS {db} WITH (FORCE)")
+
+def create_database_statement(template: str = None):
+    return CREATE_DATABASE_FROM if template else CREATE_DATABASE
+
+# Terminates every other session of the given databases in one query; one row per database
+TERMINATE_SQL = """
+    SELECT datname, count(pg_terminate_backend(pid))
+    FROM pg_stat_activity
+    WHERE datname = ANY({databases}) AND pid <> pg_backend_pid()
+    GROUP BY datname
+"""
+# Databases of one batch dropped at the same time (`drop_concurrency` in the postgresql section)
+DEFAULT_DROP_CONCURRENCY = 4
+# Before PostgreSQL 13 (no DROP DATABASE ... WITH (FORCE)) a terminated backend may take a moment to exit
+DROP_ATTEMPTS = 5
+
+def snapshot_from_rows(users: set, acl_rows) -> Snapshot:
+    databases, owners, grants, public_access = set(), {}, {}, set()
+    for datname, owner, default_acl, grantee, grantee_name, privileges in acl_rows:
+        databases.add(datname)
+        owners[datname] = owner
+        if default_acl or grantee == 0:
+            public_access.add(datname)
+        elif grantee_name and privileges >= 3:
+            # CREATE, CONNECT and TEMPORARY: what GRANT ALL PRIVILEGES ON DATABASE gives
+            grants.setdefault(grantee_name, set()).add(datname)
+    return Snapshot(users, databases, grants, owners, public_access)
 
 class PostgreSQLHandler:
+    label = "PG"
+    # Roles and owners are changed in one transaction per batch, databases are created over one
+    # session, and database ACLs go out in one round-trip after each database's schema step
+    batch_methods = {
+        "create_user": "create_users",
+        "update_user_password": "update_user_passwords",
+        "create_database": "create_databases",
+        "set_database_owner": "set_database_owners",
+        "grant_full_privileges": "grant_full_privileges_many",
+        "drop_database": "drop_databases",
+    }
+    # Round-trips of the calls that send more than one, as (per call, per item, per user) for --dry-run
+    # estimates; every other method costs one per call
+    round_trips = {
+        "grant_full_privileges": (2, 0, 0),
+        "create_databases": (0, 1, 0),
+        "grant_full_privileges_many": (1, 1, 0),
+        "drop_databases": (2, 1, 0),
+    }
+
     def __init__(self, cfg: dict, dry_run: bool = False):
         self.cfg = cfg
         self.dry = dry_run
+        self.pool = ConnectionPool(self._connect, alive=lambda conn: not conn.closed)
+        # database -> owner, for databases this handler copied from template_database
+        self._from_template = {}
+        self._template_ready = False
+        self._template_lock = threading.Lock()
 
-    def _conn(self, db_name="postgres"):
+    def _connect(self, db_name):
         psycopg2 = importlib.import_module("psycopg2")
         conn = psycopg2.connect(
             host=self.cfg.get("host", "localhost"),
@@ -17,73 +113,77 @@ class PostgreSQLHandler:
         conn.autocommit = True
         return conn
 
+    def _conn(self, db_name="postgres"):
+        # Pooled and always in autocommit mode, so CREATE/DROP DATABASE never run inside a transaction block.
+        # The pooled connection is yielded as-is: psycopg2's own `with conn` would not close it anyway.
+        return self.pool.connection(db_name)
+
+    def close(self):
+        self.pool.close()
+
+    def connection_stats(self) -> dict:
+        return self.pool.stats()
+
     def get_existing_users(self) -> set:
-        if self.dry:
-            return set()
         with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT rolname FROM pg_roles")
                 return {r[0] for r in cur.fetchall()}
 
     def get_existing_databases(self) -> list:
-        if self.dry:
-            return []
         with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false")
                 return [r[0] for r in cur.fetchall()]
 
+    def snapshot(self) -> Snapshot:
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(ROLES_SQL)
+                users = {r[0] for r in cur.fetchall()}
+                cur.execute(DATABASE_ACL_SQL)
+                rows = cur.fetchall()
+        return snapshot_from_rows(users, rows)
+
     def create_user(self, username: str, password: str):
         if self.dry:
-            print(f"[PG][DRY] Create role '{username}'")
+            self._dry(CREATE_ROLE.show(user=username, password=password))
             return
         print(f"[PG] Creating role '{username}'")
         psycopg2 = importlib.import_module("psycopg2")
         with self._conn() as conn:
             with conn.cursor() as cur:
                 try:
-                    cur.execute(f"CREATE ROLE {self._ident(username)} LOGIN PASSWORD %s", (password,))
+                    cur.execute(*CREATE_ROLE.bind(user=username, password=password))
                 except psycopg2.errors.DuplicateObject:
                     print(f"Role '{username}' already exists, skipping creation.")
                     pass
 
     def create_database(self, name: str, owner: str):
         if self.dry:
-            print(f"[PG][DRY] Create database '{name}' owner '{owner}'")
+            template = self.cfg.get("template_database")
+            self._dry(create_database_statement(template).show(db=name, owner=owner, template=template))
             return
         print(f"[PG] Creating database '{name}' owner '{owner}'")
         psycopg2 = importlib.import_module("psycopg2")
         
-        # Check if database exists first to avoid error spam
-        # We need a dedicated connection for checking to ensure clean state
-        conn = self._conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
-                if cur.fetchone():
-                    return
-        finally:
-            conn.close()
-
-        # Connect again for creation.
-        # CRITICAL: PostgreSQL CREATE DATABASE cannot run inside a transaction block.
-        # psycopg2 connection with autocommit=True SHOULD handle this, but using 'with self._conn() as conn'
-        # might imply context manager behavior that affects transaction state.
-        # Let's use a raw connection object without 'with' for the creation to be explicit.
-        conn = self._conn()
-        conn.autocommit = True
-        try:
+        # Existence is known from the snapshot taken before planning, so there is no per-database probe here.
+        # CRITICAL: PostgreSQL CREATE DATABASE cannot run inside a transaction block; pooled connections are autocommit.
+        template = self._template()
+        with self._conn() as conn:
             with conn.cursor() as cur:
                 try:
-                    cur.execute(f"CREATE DATABASE {self._ident(name)} OWNER {self._ident(owner)}")
+                    cur.execute(create_database_statement(template).sql(db=name, owner=owner, template=template))
                 except psycopg2.errors.DuplicateDatabase:
-                     pass
-        finally:
-            conn.close()
-                     
+                    return
+        if template:
+            self._from_template[name] = owner
+
+
     def grant_full_privileges(self, username: str, db_name: str):
         if self.dry:
-            print(f"[PG][DRY] Grant privileges on '{db_name}' to '{username}'")
+            self._dry(SCHEMA_ACL.show(user=username), db_name)
+            self._dry(DATABASE_ACL.show(db=db_name, user=username))
             return
         print(f"[PG] Granting privileges on '{db_name}' to '{username}'")
         # GRANT ALL ON DATABASE only grants connect/create/temp. 
@@ -93,63 +193,280 @@ class PostgreSQLHandler:
         # Owners implicitly have full control.
         # So GRANT ALL PRIVILEGES ON DATABASE is actually somewhat redundant if they are owner,
         # but good for ensuring CONNECT rights etc.
-        
+
+        # Revoke CREATE on public schema from PUBLIC to prevent users from creating tables in others' DBs
+        # AND explicitly grant it to the owner, because they might not own the public schema itself.
+        self._lock_schema(username, db_name)
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"REVOKE ALL PRIVILEGES ON DATABASE {self._ident(db_name)} FROM PUBLIC")
-                cur.execute(f"GRANT ALL PRIVILEGES ON DATABASE {self._ident(db_name)} TO {self._ident(username)}")
-                
+                cur.execute(DATABASE_ACL.sql(db=db_name, user=username))
+
                 # NOTE: In Postgres, just granting on DATABASE isn't enough for tables created by others.
                 # But since we create the DB with this user as OWNER, they will have full rights by default.
                 # So this is sufficient.
-        
-        # Also revoke CREATE on public schema from PUBLIC to prevent users from creating tables in others' DBs
-        # AND explicitly grant it to the owner, because they might not own the public schema itself.
-        try:
-            with self._conn(db_name) as conn:
-                with conn.cursor() as cur:
-                    cur.execute("REVOKE CREATE ON SCHEMA public FROM PUBLIC")
-                    cur.execute(f"GRANT ALL ON SCHEMA public TO {self._ident(username)}")
-        except Exception as e:
-            print(f"Warning: Could not adjust public schema privileges for {db_name}: {e}")
+
+    def set_database_owner(self, name: str, owner: str):
+        if self.dry:
+            self._dry(SET_OWNER.show(db=name, owner=owner))
+            return
+        print(f"[PG] Setting owner of '{name}' to '{owner}'")
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SET_OWNER.sql(db=name, owner=owner))
 
     def drop_user(self, username: str):
         if self.dry:
-            print(f"[PG][DRY] Drop role '{username}'")
+            self._dry(DROP_ROLE.show(user=username))
             return
         print(f"[PG] Dropping role '{username}'")
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"DROP ROLE IF EXISTS {self._ident(username)}")
+                cur.execute(DROP_ROLE.sql(user=username))
 
     def drop_database(self, name: str):
         if self.dry:
-            print(f"[PG][DRY] Drop database '{name}'")
+            self._dry(DROP_DATABASE.show(db=name))
             return
         print(f"[PG] Dropping database '{name}'")
-        conn = self._conn()
-        conn.autocommit = True
+        # Our own cached session into the database would block the DROP as well
+        self.pool.discard(name)
+        with self._conn() as conn:
+            force = conn.server_version >= 130000
+            if not force:
+                # Terminate connections first or DROP will fail
+                with conn.cursor() as cur:
+                    cur.execute(TERMINATE_SQL.format(databases="%s"), ([name],))
+        self._drop(name, force)
+
+    def drop_databases(self, items: list) -> dict:
+        # Offboarding pipeline: every database of the batch is closed to new sessions in one round-trip,
+        # the remaining sessions of all of them are terminated in one query, then the databases are
+        # dropped concurrently on `drop_concurrency` sessions, each reporting how long it took to drain.
+        # A database that is not dropped in the end accepts connections again.
+        if self.dry:
+            for args in items:
+                self.drop_database(*args)
+            return {}
+        names = [args[0] for args in items]
+        started = time.monotonic()
+        for name in names:
+            print(f"[PG] Dropping database '{name}'")
+            self.pool.discard(name)
         try:
+            with self._conn() as conn:
+                force = conn.server_version >= 130000
+                with conn.cursor() as cur:
+                    cur.execute(";\n".join(CLOSE_DATABASE.sql(db=n) for n in names))
+                    cur.execute(TERMINATE_SQL.format(databases="%s"), (names,))
+                    terminated = dict(cur.fetchall())
+        except Exception:
+            # The CLOSE statements are not atomic: any of the batch may already be closed
+            self._reopen(names)
+            raise
+
+        def drop(name: str) -> float:
+            self._drop(name, force)
+            return time.monotonic() - started
+
+        workers = min(len(names), max(1, int(self.cfg.get("drop_concurrency", DEFAULT_DROP_CONCURRENCY))))
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(drop, name) for name in names]
+        failures = {}
+        for i, (name, future) in enumerate(zip(names, futures)):
+            try:
+                drained = future.result()
+            except Exception as e:
+                failures[i] = e
+                continue
+            print(f"[PG] Dropped database '{name}' after {drained:.2f}s ({terminated.get(name, 0)} session(s) terminated)")
+        self._reopen([names[i] for i in failures])
+        return failures
+
+    def _reopen(self, names: list):
+        # Undoes CLOSE_DATABASE for databases that were not dropped. Best effort: it runs on error paths
+        # and must not hide the error that brought it there.
+        if not names:
+            return
+        try:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT datname FROM pg_database WHERE datname = ANY(%s)", (names,))
+                    for (name,) in cur.fetchall():
+                        try:
+                            cur.execute(OPEN_DATABASE.sql(db=name))
+                        except Exception as e:
+                            print(f"[PG] Database '{name}' still refuses connections: {e}")
+                        else:
+                            print(f"[PG] Database '{name}' was not dropped and accepts connections again")
+        except Exception as e:
+            print(f"[PG] Databases {', '.join(names)} may still refuse connections: {e}")
+
+    def _drop(self, name: str, force: bool):
+        with self._conn() as conn:
             with conn.cursor() as cur:
-                # Terminate connections first or DROP will fail
-                cur.execute(f"""
-                    SELECT pg_terminate_backend(pg_stat_activity.pid)
-                    FROM pg_stat_activity
-                    WHERE pg_stat_activity.datname = %s
-                    AND pid <> pg_backend_pid()
-                """, (name,))
-                cur.execute(f"DROP DATABASE IF EXISTS {self._ident(name)}")
-        finally:
-            conn.close()
+                if force:
+                    cur.execute(DROP_DATABASE_FORCE.sql(db=name))
+                    return
+                psycopg2 = importlib.import_module("psycopg2")
+                for attempt in range(1, DROP_ATTEMPTS + 1):
+                    try:
+                        cur.execute(DROP_DATABASE.sql(db=name))
+                        return
+                    except psycopg2.errors.ObjectInUse:
+                        if attempt == DROP_ATTEMPTS:
+                            raise
+                    time.sleep(0.2 * attempt)
+                    cur.execute(TERMINATE_SQL.format(databases="%s"), ([name],))
 
     def update_user_password(self, username: str, password: str):
         if self.dry:
-            print(f"[PG][DRY] Update password for '{username}'")
+            self._dry(ALTER_ROLE_PASSWORD.show(user=username, password=password))
             return
         print(f"[PG] Updating password for '{username}'")
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"ALTER ROLE {self._ident(username)} WITH PASSWORD %s", (password,))
+                cur.execute(*ALTER_ROLE_PASSWORD.bind(user=username, password=password))
+
+    def create_users(self, items: list):
+        if self.dry:
+            for username, password in items:
+                self.create_user(username, password)
+            return
+        for username, _ in items:
+            print(f"[PG] Creating role '{username}'")
+        self._transaction([CREATE_ROLE.bind(user=u, password=p) for u, p in items])
+
+    def update_user_passwords(self, items: list):
+        if self.dry:
+            for username, password in items:
+                self.update_user_password(username, password)
+            return
+        for username, _ in items:
+            print(f"[PG] Updating password for '{username}'")
+        self._transaction([ALTER_ROLE_PASSWORD.bind(user=u, password=p) for u, p in items])
+
+    def set_database_owners(self, items: list):
+        if self.dry:
+            for name, owner in items:
+                self.set_database_owner(name, owner)
+            return
+        for name, owner in items:
+            print(f"[PG] Setting owner of '{name}' to '{owner}'")
+        self._transaction([SET_OWNER.bind(db=n, owner=o) for n, o in items])
+
+    def create_databases(self, items: list) -> dict:
+        # CREATE DATABASE cannot share a transaction or a multi-statement string, so the batch is one
+        # statement after another over a single autocommit session instead of a session per database
+        if self.dry:
+            for name, owner in items:
+                self.create_database(name, owner)
+            return {}
+        psycopg2 = importlib.import_module("psycopg2")
+        template = self._template()
+        failures = {}
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                for i, (name, owner) in enumerate(items):
+                    print(f"[PG] Creating database '{name}' owner '{owner}'")
+                    try:
+                        cur.execute(create_database_statement(template).sql(db=name, owner=owner, template=template))
+                    except psycopg2.errors.DuplicateDatabase:
+                        continue
+                    except psycopg2.OperationalError:
+                        # The session is gone: the whole batch is retried one by one
+                        raise
+                    except Exception as e:
+                        failures[i] = e
+                        continue
+                    if template:
+                        self._from_template[name] = owner
+        return failures
+
+    def grant_full_privileges_many(self, items: list) -> dict:
+        # The schema step needs a session in each database (skipped for copies of template_database);
+        # the database-level ACLs of every database that passed it then go out in one round-trip
+        if self.dry:
+            for username, db_name in items:
+                self.grant_full_privileges(username, db_name)
+            return {}
+        failures = {}
+        ready = []
+        for i, (username, db_name) in enumerate(items):
+            print(f"[PG] Granting privileges on '{db_name}' to '{username}'")
+            try:
+                self._lock_schema(username, db_name)
+            except Exception as e:
+                failures[i] = e
+                continue
+            ready.append(i)
+        if not ready:
+            return failures
+        try:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(";\n".join(DATABASE_ACL.sql(db=items[i][1], user=items[i][0]) for i in ready))
+        except Exception:
+            # Each ACL is idempotent: find the database that failed
+            for i in ready:
+                try:
+                    with self._conn() as conn:
+                        with conn.cursor() as cur:
+                            cur.execute(DATABASE_ACL.sql(db=items[i][1], user=items[i][0]))
+                except Exception as e:
+                    failures[i] = e
+        return failures
+
+    def _transaction(self, bound: list):
+        # Statement.bind() results sent as one BEGIN ... COMMIT string: one round-trip, all or nothing.
+        # On failure the aborted transaction is rolled back and the caller retries one by one.
+        sql, params = join_bound([("BEGIN", None)] + bound + [("COMMIT", None)], ";\n")
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute(sql, params)
+                except Exception:
+                    if not conn.closed:
+                        cur.execute("ROLLBACK")
+                    raise
+
+    def _lock_schema(self, username: str, db_name: str):
+        # A database copied from template_database for this owner already has its public schema locked down
+        if self._from_template.get(db_name) == username:
+            return
+        try:
+            with self._conn(db_name) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SCHEMA_ACL.sql(user=username))
+        except Exception as e:
+            raise RuntimeError(f"Could not adjust public schema privileges for {db_name}: {e}") from e
+
+    def _template(self):
+        # Name of the configured template_database, created and locked down on first use
+        name = self.cfg.get("template_database")
+        if not name or self._template_ready:
+            return name
+        with self._template_lock:
+            if not self._template_ready:
+                self._prepare_template(name)
+                self._template_ready = True
+        return name
+
+    def _prepare_template(self, name: str):
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+                if cur.fetchone() is None:
+                    print(f"[PG] Creating template database '{name}'")
+                    cur.execute(CREATE_TEMPLATE.sql(db=name))
+        with self._conn(name) as conn:
+            with conn.cursor() as cur:
+                cur.execute(TEMPLATE_SCHEMA_SQL)
+        # CREATE DATABASE ... TEMPLATE fails while any session is connected to the template
+        self.pool.discard(name)
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(MARK_TEMPLATE.sql(db=name))
 
-    def _ident(self, s: str) -> str:
-        return '"' + s.replace('"', '""') + '"'
+    def _dry(self, sql: str, db_name: str = None):
+        print(f"[PG][DRY] {sql}" + (f"  -- in {db_name}" if db_name else ""))
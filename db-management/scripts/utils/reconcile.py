@@ -0,0 +1,325 @@
+import threading
+import time
+from .estimate import CostEstimate
+from .incremental import settle_state, sync_scope
+from .journal import Journal
+from .options import SyncOptions
+from .planner import build_plan, iter_merged_plans, print_plan, print_plan_summary
+
+class SyncResult:
+    def __init__(self, engine: str):
+        self.engine = engine
+        # Name of the connections.yaml target (see targets.py)
+        self.target = None
+        self.added = 0
+        self.updated = 0
+        self.removed = 0
+        self.operations = 0
+        self.errors = 0
+        self.failure = None
+        self.elapsed = 0.0
+        self.metrics = None
+        # CostEstimate of a --dry-run or --plan run, reported by sync_engine
+        self.estimate = None
+        # Journal of a real run; every confirmed operation is written to it
+        self.journal = None
+        # Users with at least one failed operation; retried by the next --incremental run
+        self.failed_users = set()
+        # (username, operation) of successful calls the handler only confirms in finish() (async
+        # distributed DDL); None when every call is confirmed as it returns
+        self.unconfirmed = None
+        self._lock = threading.Lock()
+
+    def error(self, message: str, username: str = None):
+        print(message)
+        with self._lock:
+            self.errors += 1
+            if username is not None:
+                self.failed_users.add(username)
+
+    @property
+    def ok(self) -> bool:
+        return self.failure is None and self.errors == 0
+
+# Order in which a batched run executes actions across all users. Every user plan lists its
+# operations in this same order, so per-user ordering still holds when a phase is sent in batches.
+PHASES = (
+    "create_user",
+    "update_user_password",
+    "create_database",
+    "set_database_owner",
+    "grant_full_privileges",
+    "drop_database",
+    "drop_user",
+)
+
+def reconcile(handler, users: dict, templates: list, state=None, options: SyncOptions = None) -> SyncResult:
+    options = options or SyncOptions()
+    result = SyncResult(handler.label)
+    if state is None:
+        state = NullPasswordState()
+    defer_confirmations(handler, result)
+    journal = Journal.for_run(handler, state, options)
+    resumed = journal.resume(users, templates, state, handler.label) if journal is not None and options.resume else None
+    if resumed is not None:
+        # The rest of an interrupted run, straight from its journal: no discovery
+        result.journal = journal
+        journal.reopen()
+        try:
+            count_plans(result, resumed.plans)
+            execute_chunk(handler, result, state, resumed.plans, options)
+            finish_run(handler, result, state)
+        finally:
+            journal.close()
+        if resumed.complete:
+            settle_state(state, templates, resumed.scope, resumed.removed, result)
+            journal.finish()
+            return result
+        journal.finish()
+    scope, removed = sync_scope(users, templates, state, options, handler.label)
+    if scope is not None and not scope:
+        # Nothing changed since the last sync: no connection is opened at all
+        return result
+    # A dry run reads the server like a real one (the password state is never saved), so its plan is exact
+    estimate = CostEstimate(handler, options, PHASES) if handler.dry or options.plan_only else None
+    started = time.monotonic()
+    # One bulk read of users, databases and grants; the plan is a diff against it, so a converged
+    # fleet costs the snapshot queries and nothing else
+    snapshot = handler.snapshot()
+    if estimate is not None:
+        estimate.discovery = time.monotonic() - started
+        result.estimate = estimate
+    if journal is not None:
+        journal.begin(users, templates, scope, handler.label)
+        result.journal = journal
+    try:
+        for plans, last in with_last(plan_chunks(users, templates, snapshot, state, scope)):
+            count_plans(result, plans)
+            if estimate is not None:
+                estimate.add(plans)
+            if options.plan_only:
+                print_plan(handler.label, plans, summary=False)
+                continue
+            if journal is not None:
+                journal.plan(plans, last)
+            execute_chunk(handler, result, state, plans, options)
+        if not options.plan_only:
+            # Confirmations held back until the handler's finish() are journaled as well
+            finish_run(handler, result, state)
+    finally:
+        if journal is not None:
+            journal.close()
+    if options.plan_only:
+        print_plan_summary(handler.label, result.operations, result.added + result.updated + result.removed)
+        return result
+    settle_state(state, templates, scope, removed, result)
+    if journal is not None:
+        journal.finish()
+    return result
+
+def execute_chunk(handler, result: SyncResult, state, plans: list, options: SyncOptions):
+    # Keep one idle connection per worker, otherwise the pool churns connections between jobs
+    handler.pool.max_idle = max(handler.pool.max_idle, options.workers)
+    if options.batch_size > 1 and getattr(handler, "batch_methods", None):
+        execute_phased(handler, result, state, plans, options)
+    else:
+        # Each job carries every step for one user, so per-user ordering
+        # (create user -> create DBs -> grant; drop DBs -> drop user) holds under any worker count.
+        run_jobs([(execute_plan, (handler, result, state, p)) for p in plans], options.workers)
+
+def defer_confirmations(handler, result: SyncResult):
+    # With async distributed DDL a call returns once its statement is queued; whether it ran on every
+    # host is only known in finish(), so the password state and the journal wait until then
+    if getattr(handler, "async_ddl", False) and not handler.dry:
+        result.unconfirmed = []
+
+def finish_run(handler, result: SyncResult, state):
+    # Handlers that defer work (e.g. async distributed DDL) confirm it here
+    finish = getattr(handler, "finish", None)
+    settle_unconfirmed(result, state, finish() if finish is not None else [])
+
+def settle_unconfirmed(result: SyncResult, state, problems: list):
+    # problems are (message, key) from the handler's finish(): key is (action, first argument) of the
+    # operations a failed or unfinished statement was submitted for, or None for the run as a whole
+    failed = {}
+    for message, key in problems:
+        if key is None:
+            result.error(message)
+        else:
+            failed.setdefault(key, message)
+    if result.unconfirmed is None:
+        return
+    unconfirmed, result.unconfirmed = result.unconfirmed, []
+    for username, op in unconfirmed:
+        message = failed.get((op.action, op.args[0]))
+        if message is None:
+            record_success(state, op, result.journal)
+        else:
+            result.error(f"Failed to {op}: {message}", username)
+
+# Plans generated and executed together in --sorted-merge mode; memory is bounded by this many users
+MERGE_CHUNK_USERS = 1000
+
+def plan_chunks(users, templates: list, snapshot, state, scope: set = None):
+    # A dict of users is planned in one go; a sorted users stream (UsersStream) is merged against
+    # the snapshot and executed chunk by chunk. With a scope only those users get a plan.
+    if isinstance(users, dict):
+        yield [p for p in build_plan(users, templates, snapshot, state) if p.ops and (scope is None or p.username in scope)]
+        return
+    chunk = []
+    for plan in iter_merged_plans(users, templates, snapshot, state):
+        if not plan.ops or (scope is not None and plan.username not in scope):
+            continue
+        chunk.append(plan)
+        if len(chunk) >= MERGE_CHUNK_USERS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def with_last(chunks):
+    # (plans, is_last) for every chunk; the next chunk is planned before the current one runs,
+    # so the journal knows when it holds the whole run
+    previous = None
+    for plans in chunks:
+        if previous is not None:
+            yield previous, False
+        previous = plans
+    if previous is not None:
+        yield previous, True
+
+def count_plans(result: SyncResult, plans: list):
+    result.added += sum(1 for p in plans if p.kind == "add")
+    result.updated += sum(1 for p in plans if p.kind == "update")
+    result.removed += sum(1 for p in plans if p.kind == "remove")
+    result.operations += sum(len(p.ops) for p in plans)
+
+def run_jobs(jobs: list, workers: int = 1) -> list:
+    if workers <= 1:
+        return [fn(*args) for fn, args in jobs]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(fn, *args) for fn, args in jobs]
+        return [f.result() for f in futures]
+
+def execute_plan(handler, result: SyncResult, state, plan):
+    failed_scopes = set()
+    for op in plan.ops:
+        if op.scope is not None and op.scope in failed_scopes:
+            continue
+        try:
+            op.apply(handler)
+        except Exception as e:
+            result.error(f"Failed to {op}: {e}", plan.username)
+            if op.scope is None:
+                return
+            failed_scopes.add(op.scope)
+            continue
+        confirm(result, state, plan.username, op)
+
+def execute_phased(handler, result: SyncResult, state, plans: list, options: SyncOptions):
+    # Runs one action at a time across all users so the handler can send it in batches.
+    # Failures are tracked per user exactly like execute_plan: a failed scope skips the rest of
+    # that database's operations, a failed user-level operation skips the rest of the user.
+    failed = {}
+    for action in PHASES:
+        pending = phase_pending(plans, action, failed)
+        if not pending:
+            continue
+        batch_method = handler.batch_methods.get(action)
+        if batch_method:
+            size = options.batch_size
+            jobs = [(_apply_batch, (handler, batch_method, pending[i:i + size])) for i in range(0, len(pending), size)]
+        else:
+            jobs = [(_apply_one, (handler, item)) for item in pending]
+        for outcomes in run_jobs(jobs, options.workers):
+            record_outcomes(outcomes, result, state, failed)
+
+def phase_pending(plans: list, action: str, failed: dict) -> list:
+    # (plan, op) pairs of one action that are not blocked by an earlier failure of the same user or scope
+    pending = []
+    for plan in plans:
+        failed_scopes = failed.get(plan.username, set())
+        if None in failed_scopes:
+            continue
+        pending.extend((plan, op) for op in plan.ops if op.action == action and op.scope not in failed_scopes)
+    return pending
+
+def record_outcomes(outcomes: list, result: SyncResult, state, failed: dict):
+    for plan, op, error in outcomes:
+        if error is None:
+            confirm(result, state, plan.username, op)
+        else:
+            result.error(f"Failed to {op}: {error}", plan.username)
+            failed.setdefault(plan.username, set()).add(op.scope)
+
+def _apply_one(handler, item) -> list:
+    plan, op = item
+    try:
+        op.apply(handler)
+    except Exception as e:
+        return [(plan, op, e)]
+    return [(plan, op, None)]
+
+def _apply_batch(handler, method: str, chunk: list) -> list:
+    # Batch methods take the argument tuples of every operation and return {index: exception}
+    # for the ones that failed. If the batch fails as a whole, the statements are idempotent,
+    # so each operation is retried on its own to find the culprit.
+    try:
+        failures = getattr(handler, method)([op.args for _, op in chunk]) or {}
+    except Exception as e:
+        note_batch_failure(handler, method, chunk, e)
+        return [outcome for item in chunk for outcome in _apply_one(handler, item)]
+    return batch_outcomes(handler, method, chunk, failures)
+
+def note_batch_failure(handler, method: str, chunk: list, error: Exception):
+    print(f"[{handler.label}] Batch {method} of {len(chunk)} failed ({error}), retrying one by one")
+    metrics = getattr(handler, "metrics", None)
+    if metrics is not None:
+        metrics.retry(method, len(chunk))
+
+def batch_outcomes(handler, method: str, chunk: list, failures: dict) -> list:
+    if failures:
+        metrics = getattr(handler, "metrics", None)
+        if metrics is not None:
+            metrics.error(method, len(failures))
+    return [(plan, op, failures.get(i)) for i, (plan, op) in enumerate(chunk)]
+
+def confirm(result: SyncResult, state, username: str, op):
+    # A call that returned: recorded now, or in finish_run when the handler confirms it there
+    if result.unconfirmed is not None:
+        with result._lock:
+            result.unconfirmed.append((username, op))
+        return
+    record_success(state, op, result.journal)
+
+def record_success(state, op, journal=None):
+    if op.action in ("create_user", "update_user_password"):
+        state.record(op.args[0], op.args[1])
+    elif op.action == "drop_user":
+        state.forget(op.args[0])
+    if journal is not None:
+        journal.done(op)
+
+class NullPasswordState:
+    # Used by callers without a state file: every password counts as changed
+    def matches(self, username: str, password: str) -> bool:
+        return False
+
+    def record(self, username: str, password: str):
+        pass
+
+    def forget(self, username: str):
+        pass
+
+    def known_users(self) -> set:
+        return set()
+
+    def pending_users(self) -> set:
+        return set()
+
+    def full_sync_reason(self, templates_fingerprint: str, full_every_hours: float = 0) -> str:
+        return "no state file"
+
+    def finish_run(self, scope, failed: set, templates_fingerprint: str = None):
+        pass
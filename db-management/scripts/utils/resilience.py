@@ -0,0 +1,173 @@
+import random
+import re
+import threading
+import time
+
+# Retries and circuit breaking around handler calls (applied by InstrumentedHandler). A call that fails
+# with a transient error (lost connection, failover, lock timeout, overloaded server) is retried with
+# jittered exponential backoff; anything else (bad credentials, missing privilege, syntax) fails at once.
+# Consecutive transient failures on one target open its circuit: calls then fail fast until
+# BREAKER_COOLDOWN has passed and a single trial call gets through again.
+
+# Backoff before retry n (0-based) is uniform in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+
+# Consecutive transient failures that open a target's circuit, and how long it stays open (seconds)
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# Methods that are never retried
+UNRETRIED = {"close"}
+
+# MySQL error numbers (pymysql, aiomysql): too many connections, server shutdown / network errors,
+# lock wait timeout, deadlock, connection killed, client-side lost connection
+MYSQL_RETRYABLE = {1040, 1053, 1158, 1159, 1160, 1161, 1205, 1213, 1927, 2003, 2006, 2013, 2055}
+
+# PostgreSQL SQLSTATEs (psycopg2 pgcode, asyncpg sqlstate): serialization failure, deadlock,
+# too many connections, lock not available, query canceled, server shutting down or starting up.
+# Class 08 (connection exception) is matched as a whole.
+POSTGRESQL_RETRYABLE = {"40001", "40P01", "53300", "55P03", "57014", "57P01", "57P02", "57P03"}
+
+# ClickHouse error codes: timeout (including distributed DDL), socket timeout, network error,
+# too many simultaneous queries, read-only replica, too few live replicas, Keeper errors
+CLICKHOUSE_RETRYABLE = {159, 202, 209, 210, 242, 285, 319, 425, 999}
+
+# MongoDB server error codes: host unreachable / not found, network timeout, shutdown in progress,
+# primary stepped down, exceeded time limit, socket exception, not writable primary, interrupted
+# at shutdown or by a replica set state change, not primary
+MONGODB_RETRYABLE = {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, label: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.label = label
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+
+    def before(self):
+        # Raises CircuitOpenError while the circuit is open; after the cooldown one caller gets through
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.cooldown - time.monotonic()
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError(f"circuit open for {self.label} after {self._failures} consecutive transient "
+                               f"failure(s), next attempt in {max(remaining, 0):.0f}s")
+
+    def success(self):
+        with self._lock:
+            if self._opened is not None:
+                print(f"[{self.label}] Circuit closed, server is responding again")
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened is None and self._failures >= self.threshold):
+                if self._opened is None:
+                    print(f"[{self.label}] Circuit open after {self._failures} consecutive transient failure(s), "
+                          f"failing fast for {self.cooldown:g}s")
+                self._opened = time.monotonic()
+                self._trial = False
+
+class Resilience:
+    # Retry policy and circuit breaker of one handler (one target)
+    def __init__(self, engine: str, retries: int, label: str):
+        self.engine = engine
+        self.retries = retries
+        self.breaker = CircuitBreaker(label)
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        # Called after a failed attempt; transient failures count towards opening the circuit,
+        # any other error still proves the server is there
+        if isinstance(error, CircuitOpenError):
+            return False
+        if not is_retryable(self.engine, error):
+            self.breaker.success()
+            return False
+        self.breaker.failure()
+        return attempt < self.retries
+
+    def retry_items(self, failures: dict, attempt: int) -> list:
+        # Batch methods report their failed items as {index: exception} instead of raising.
+        # A batch counts as one call for the breaker (a failure when any item failed transiently);
+        # returns the indexes of the transient failures while retries are left.
+        transient = sorted(i for i, e in failures.items()
+                           if not isinstance(e, CircuitOpenError) and is_retryable(self.engine, e))
+        if not transient:
+            self.breaker.success()
+            return []
+        self.breaker.failure()
+        return transient if attempt < self.retries else []
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def is_retryable(engine: str, error: Exception) -> bool:
+    # A driver error re-raised with more context (`raise RuntimeError(...) from e`) is judged by its cause
+    classify = CLASSIFIERS.get(engine)
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if classify is not None and classify(error):
+            return True
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True
+        error = error.__cause__
+    return False
+
+def _mysql(error: Exception) -> bool:
+    names = _class_names(error)
+    if "InterfaceError" in names:
+        # Operation on a connection that is already closed
+        return True
+    code = error.args[0] if error.args and isinstance(error.args[0], int) else None
+    return "OperationalError" in names and code in MYSQL_RETRYABLE
+
+def _postgresql(error: Exception) -> bool:
+    code = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+    if code:
+        return code in POSTGRESQL_RETRYABLE or code.startswith("08")
+    # psycopg2 reports a failed or lost connection as OperationalError/InterfaceError without a SQLSTATE
+    return bool(_class_names(error) & {"OperationalError", "InterfaceError", "ConnectionDoesNotExistError"})
+
+def _clickhouse(error: Exception) -> bool:
+    if _class_names(error) & {"NetworkError", "SocketTimeoutError", "ClientConnectionError"}:
+        return True
+    code = getattr(error, "code", None)
+    if code is None:
+        # The HTTP interface (--async) reports "Code: N. DB::Exception: ..."
+        match = re.search(r"\bCode: (\d+)", str(error))
+        code = int(match.group(1)) if match else None
+    return code in CLICKHOUSE_RETRYABLE
+
+def _mongodb(error: Exception) -> bool:
+    # AutoReconnect covers NotPrimaryError, NetworkTimeout and ServerSelectionTimeoutError
+    if "AutoReconnect" in _class_names(error):
+        return True
+    has_label = getattr(error, "has_error_label", None)
+    if has_label is not None and has_label("RetryableWriteError"):
+        return True
+    return getattr(error, "code", None) in MONGODB_RETRYABLE
+
+def _class_names(error: Exception) -> set:
+    # Drivers are optional imports, so their exception classes are recognized by name
+    return {cls.__name__ for cls in type(error).__mro__}
+
+CLASSIFIERS = {
+    "mysql": _mysql,
+    "postgresql": _postgresql,
+    "clickhouse": _clickhouse,
+    "mongodb": _mongodb,
+}
@@ -0,0 +1,17 @@
+class Snapshot:
+    # Server state captured once per sync so planning decisions are made from memory
+    def __init__(self, users=(), databases=(), grants=None, owners=None, public_access=()):
+        self.users = set(users)
+        self.databases = set(databases)
+        # username -> databases the user holds full privileges on
+        self.grants = grants or {}
+        # database -> owner, for engines with database ownership (PostgreSQL)
+        self.owners = owners or {}
+        # databases that PUBLIC can still use (PostgreSQL)
+        self.public_access = set(public_access)
+
+    def has_grant(self, username: str, db_name: str) -> bool:
+        return db_name in self.grants.get(username, ())
+
+    def add_grant(self, username: str, db_name: str):
+        self.grants.setdefault(username, set()).add(db_name)
@@ -0,0 +1,85 @@
+import string
+from functools import lru_cache
+
+# Statement templates shared by the sync and asyncio handlers and by --dry-run output. A template is
+# parsed once at import; rendering only joins the pieces. In a template, "{name}" is an identifier
+# (quoted by the engine's dialect), "{name!v}" a value such as a password (a driver placeholder,
+# an inline literal, or '***' when shown) and "{name!r}" an already rendered fragment inserted as is.
+
+REDACTED = "'***'"
+
+class Dialect:
+    def __init__(self, quote: str, escape_literal):
+        self.quote = quote
+        self._escape_literal = escape_literal
+        # The same user and database names are quoted over and over in a large sync
+        self.ident = lru_cache(maxsize=65536)(self._quote)
+
+    def _quote(self, name: str) -> str:
+        return self.quote + name.replace(self.quote, self.quote * 2) + self.quote
+
+    def literal(self, value: str) -> str:
+        return "'" + self._escape_literal(value) + "'"
+
+    def statement(self, template: str) -> "Statement":
+        return Statement(self, template)
+
+# Backslash escapes in string literals (MySQL default sql_mode, ClickHouse)
+def _backslash_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+MYSQL = Dialect("`", _backslash_escape)
+# standard_conforming_strings is on by default since PostgreSQL 9.1: only quotes are doubled
+POSTGRESQL = Dialect('"', lambda value: value.replace("'", "''"))
+CLICKHOUSE = Dialect("`", _backslash_escape)
+
+class Statement:
+    __slots__ = ("dialect", "template", "_parts", "_has_values")
+
+    def __init__(self, dialect: Dialect, template: str):
+        self.dialect = dialect
+        self.template = template
+        self._parts = [(text, field, conversion) for text, field, _, conversion in string.Formatter().parse(template)]
+        self._has_values = any(field is not None and conversion == "v" for _, field, conversion in self._parts)
+
+    def sql(self, **args) -> str:
+        # Values inlined as escaped literals: ClickHouse, and PostgreSQL utility statements on asyncpg
+        return self._render(args, self.dialect.literal, False)
+
+    def bind(self, **args) -> tuple:
+        # (sql, params) for drivers with %s placeholders (pymysql, psycopg2). params is None when there is
+        # nothing to bind; only then is a literal '%' (as in user@'%') left undoubled.
+        if not self._has_values:
+            return self._render(args, None, False), None
+        params = []
+
+        def placeholder(value):
+            params.append(value)
+            return "%s"
+
+        return self._render(args, placeholder, True), tuple(params)
+
+    def show(self, **args) -> str:
+        # Dry-run and log output: values are never printed
+        return self._render(args, lambda value: REDACTED, False)
+
+    def _render(self, args: dict, value, escape_percent: bool) -> str:
+        ident = self.dialect.ident
+        out = []
+        for text, field, conversion in self._parts:
+            out.append(text.replace("%", "%%") if escape_percent else text)
+            if field is None:
+                continue
+            if conversion == "v":
+                out.append(value(args[field]))
+            elif conversion == "r":
+                out.append(args[field])
+            else:
+                name = ident(args[field])
+                out.append(name.replace("%", "%%") if escape_percent else name)
+        return "".join(out)
+
+def join_bound(bound: list, separator: str) -> tuple:
+    # Joins bind() results into one (sql, params); all of them must take values, or none
+    params = tuple(p for _, ps in bound if ps for p in ps)
+    return separator.join(sql for sql, _ in bound), params or None
@@ -0,0 +1,164 @@
+import copy
+from pathlib import Path
+from .common import UsersStream
+from .config_cache import ConfigCache
+from .engines import ENGINES, create_handler, sync_engine, sync_engine_async, template_file
+from .options import SyncOptions
+from .password_state import PasswordState
+from .reconcile import SyncResult
+
+# An engine section of connections.yaml is either one target (a mapping, as before), a list of targets,
+# or a mapping with a `targets` list whose entries inherit every other key of the section:
+#
+#   mysql:
+#     admin_username: root
+#     admin_password: "secret"
+#     targets:
+#       - {name: eu-1, host: mysql-eu-1.internal}
+#       - {name: us-1, host: mysql-us-1.internal, templates: [web], concurrency: 4}
+#
+# `name` identifies the target in output and metrics (default host:port), `templates` replaces the
+# engine's *_databases.txt for that target and `concurrency` caps its --workers / --concurrency.
+
+def engine_targets(section) -> list:
+    # Target configs of one engine section, each with its `name` filled in
+    if isinstance(section, list):
+        shared, entries = {}, section
+    elif isinstance(section, dict) and "targets" in section:
+        shared = {k: v for k, v in section.items() if k != "targets"}
+        entries = section["targets"] or []
+    else:
+        shared, entries = {}, [section or {}]
+    targets = []
+    names = set()
+    endpoints = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"connections.yaml: a target must be a mapping, got {entry!r}")
+        cfg = {**shared, **entry}
+        host, port = cfg.get("host", "localhost"), cfg.get("port")
+        cfg["name"] = str(cfg.get("name") or (f"{host}:{port}" if port else host))
+        if cfg["name"] in names:
+            raise ValueError(f"connections.yaml: duplicate target name '{cfg['name']}'")
+        names.add(cfg["name"])
+        # The password state, journal and latency history of a target are keyed by its host and port,
+        # and two targets on one server would drop each other's databases anyway
+        endpoint = (str(host), str(port or ""))
+        if endpoint in endpoints:
+            raise ValueError(f"connections.yaml: targets '{endpoints[endpoint]}' and '{cfg['name']}' "
+                             f"use the same server {host}:{port or 'default port'}")
+        endpoints[endpoint] = cfg["name"]
+        targets.append(cfg)
+    return targets
+
+def load_config(config_dir: str, engines: list, options: SyncOptions, cache: ConfigCache = None) -> tuple:
+    # (users, jobs) of one run. Unchanged files come from the config cache; with --sorted-merge users.txt
+    # is a UsersStream that every target reads on its own instead of a dict, and is never cached.
+    if cache is None:
+        cache = ConfigCache.open(config_dir, options.config_cache)
+    users = UsersStream(str(Path(config_dir) / "users.txt")) if options.sorted_merge else cache.users()
+    jobs = load_jobs(config_dir, engines, cache)
+    cache.save()
+    return users, jobs
+
+def load_jobs(config_dir: str, engines: list = None, cache: ConfigCache = None) -> list:
+    # (engine, cfg, templates) for every target of the given engines (default: every configured engine)
+    if cache is None:
+        cache = ConfigCache.open(config_dir, enabled=False)
+    connections = cache.connections()
+    if not engines:
+        engines = [e for e in ENGINES if connections.get(e)]
+    jobs = []
+    for engine in engines:
+        templates = cache.templates(template_file(engine))
+        for cfg in engine_targets(connections.get(engine)):
+            override = cfg.get("templates")
+            jobs.append((engine, cfg, list(override) if override is not None else templates))
+    return jobs
+
+def target_options(options: SyncOptions, cfg: dict) -> SyncOptions:
+    cap = cfg.get("concurrency")
+    if not cap:
+        return options
+    capped = copy.copy(options)
+    capped.workers = min(options.workers, int(cap))
+    capped.concurrency = min(options.concurrency, int(cap))
+    return capped
+
+def sync_targets(config_dir: str, jobs: list, users, dry_run: bool, options: SyncOptions) -> list:
+    # Every target reconciles independently, at most --parallel-targets at a time; a target that
+    # fails (unreachable, bad credentials) is reported in its own result and does not stop the others
+    if options.use_async:
+        # Every target on one event loop, each bounded by its own --concurrency semaphore
+        import asyncio
+        return asyncio.run(_sync_targets_async(config_dir, jobs, users, dry_run, options))
+    if len(jobs) == 1:
+        return [sync_target(config_dir, *jobs[0], users, dry_run, options)]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), options.parallel_targets))) as ex:
+        futures = [ex.submit(sync_target, config_dir, engine, cfg, templates, users, dry_run, options)
+                   for engine, cfg, templates in jobs]
+        return [f.result() for f in futures]
+
+def sync_target(config_dir: str, engine: str, cfg: dict, templates: list, users, dry_run: bool,
+                options: SyncOptions) -> SyncResult:
+    try:
+        state = PasswordState.open(config_dir, engine, cfg)
+        result = sync_engine(create_handler(engine, cfg, dry_run), users, templates, state, target_options(options, cfg))
+    except Exception as e:
+        print(f"Error syncing {engine} target '{cfg['name']}': {e}")
+        result = SyncResult(engine)
+        result.failure = str(e)
+    result.engine = engine
+    result.target = cfg["name"]
+    return result
+
+async def _sync_targets_async(config_dir: str, jobs: list, users, dry_run: bool, options: SyncOptions) -> list:
+    import asyncio
+    limit = asyncio.Semaphore(options.parallel_targets)
+
+    async def bounded(engine, cfg, templates):
+        async with limit:
+            return await sync_target_async(config_dir, engine, cfg, templates, users, dry_run, options)
+
+    return list(await asyncio.gather(*(bounded(*job) for job in jobs)))
+
+async def sync_target_async(config_dir: str, engine: str, cfg: dict, templates: list, users, dry_run: bool,
+                            options: SyncOptions) -> SyncResult:
+    try:
+        state = PasswordState.open(config_dir, engine, cfg)
+        handler = create_handler(engine, cfg, dry_run, use_async=True)
+        result = await sync_engine_async(handler, users, templates, state, target_options(options, cfg))
+    except Exception as e:
+        print(f"Error syncing {engine} target '{cfg['name']}': {e}")
+        result = SyncResult(engine)
+        result.failure = str(e)
+    result.engine = engine
+    result.target = cfg["name"]
+    return result
+
+def combine_results(engine: str, results: list) -> SyncResult:
+    # One result for an engine synced on several targets (single-engine scripts)
+    if len(results) == 1:
+        return results[0]
+    combined = SyncResult(engine)
+    for r in results:
+        combined.added += r.added
+        combined.updated += r.updated
+        combined.removed += r.removed
+        combined.operations += r.operations
+        combined.errors += r.errors
+        combined.elapsed = max(combined.elapsed, r.elapsed)
+        combined.failed_users |= r.failed_users
+    failures = [f"{r.target}: {r.failure}" for r in results if r.failure]
+    combined.failure = "; ".join(failures) or None
+    return combined
+
+def print_summary(results: list):
+    width = max([len(r.target or "") for r in results] + [6]) + 2
+    print()
+    print(f"{'Engine':<12}{'Target':<{width}}{'Added':>8}{'Updated':>9}{'Removed':>9}{'Ops':>7}{'Errors':>8}{'Time':>9}  Status")
+    for r in results:
+        status = "ok" if r.ok else (f"failed: {r.failure}" if r.failure else "errors")
+        print(f"{r.engine:<12}{r.target or '':<{width}}{r.added:>8}{r.updated:>9}{r.removed:>9}{r.operations:>7}"
+              f"{r.errors:>8}{r.elapsed:>8.1f}s  {status}")
@@ -0,0 +1,127 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+# inotify(7) flags; only complete writes and renames are of interest, editors and config management
+# usually write a temporary file and rename it over the original
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Kubernetes ConfigMap volumes update every file at once by renaming this symlink
+CONFIGMAP_DATA = "..data"
+
+class ConfigWatcher:
+    # Reports which of `names` changed in `directory`. Uses inotify through libc on Linux and falls back
+    # to polling the files' mtime/size/inode elsewhere (or when the inotify limits are exhausted).
+    def __init__(self, directory: str, names, poll_interval: float = 1.0):
+        self.directory = Path(directory)
+        self.names = set(names)
+        self.poll_interval = poll_interval
+        self._fd = _inotify_open(self.directory)
+        self._stamps = self._stat_all()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._fd is not None else "polling"
+
+    def wait(self, timeout: float = None) -> set:
+        # Blocks until at least one watched file changed or `timeout` seconds passed (then returns an empty set)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self._fd is not None:
+                changed = self._read_inotify(remaining)
+            else:
+                changed = self._poll(remaining)
+            if changed:
+                self._stamps = self._stat_all()
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_inotify(self, timeout: float) -> set:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                # The directory itself went away (or was replaced): keep going by polling
+                print(f"[watch] {self.directory} is no longer watchable, falling back to polling")
+                self.close()
+                return self._poll(0)
+            if name == CONFIGMAP_DATA:
+                changed |= self.names
+            elif name in self.names:
+                changed.add(name)
+        return changed
+
+    def _poll(self, timeout: float) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stamps = self._stat_all()
+            changed = {name for name in self.names if stamps[name] != self._stamps.get(name)}
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            interval = self.poll_interval
+            if deadline is not None:
+                interval = min(interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(interval)
+
+    def _stat_all(self) -> dict:
+        stamps = {}
+        for name in self.names:
+            try:
+                st = os.stat(self.directory / name)
+                stamps[name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except OSError:
+                stamps[name] = None
+        return stamps
+
+def _inotify_open(directory: Path):
+    # Returns an inotify file descriptor watching `directory`, or None when inotify is not available
+    path = ctypes.util.find_library("c")
+    if not path or not hasattr(os, "O_NONBLOCK"):
+        return None
+    try:
+        libc = ctypes.CDLL(path, use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    fd = init(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if add_watch(fd, os.fsencode(str(directory)), WATCH_MASK) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        print(f"[watch] inotify unavailable for {directory} ({os.strerror(errno)}), polling instead")
+        return None
+    return fd